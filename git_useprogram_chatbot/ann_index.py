@@ -0,0 +1,275 @@
+import json
+import numpy as np
+
+# 件数がこれを超えたら自動選択で IVF を使う
+ANN_MIN_VECTORS = 10000
+
+# 行列の各行を単位ベクトルに正規化する（ゼロベクトルはそのまま）
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# 追記していく行列（dim=None なら1次元配列）。容量を倍々に確保するので1件ずつの追加もならし O(1)
+class GrowableRows:
+    def __init__(self, dim=None, dtype=np.float32, capacity=16):
+        self._data = np.empty((capacity,) if dim is None else (capacity, dim), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def view(self):
+        return self._data[:self.size]
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self._data.dtype)
+        needed = self.size + len(rows)
+        if needed > len(self._data):
+            capacity = max(needed, 2 * len(self._data))
+            grown = np.empty((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = rows
+        self.size = needed
+
+# スコア行列の各行について上位 k 件を (スコア, 位置) の降順で返す
+# argpartition で k 件だけを取り出してから並べるので、全件のソートはしない
+def top_k_batch(scores, k):
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.float32), np.empty((len(scores), 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(scores, candidates, axis=1)
+    # k 番目と同点の要素のどれを選ぶかは argpartition では決まらないので、あふれた行だけ位置の小さい順に選び直す
+    kth = values.min(axis=1, keepdims=True)
+    for row in np.flatnonzero(np.sum(scores == kth, axis=1) > np.sum(values == kth, axis=1)):
+        greater = np.flatnonzero(scores[row] > kth[row])
+        tied = np.flatnonzero(scores[row] == kth[row])[:k - len(greater)]
+        candidates[row] = np.concatenate([greater, tied])
+    values = np.take_along_axis(scores, candidates, axis=1)
+    # 同点のときは位置の小さい方を先にする（線形走査の結果と揃える）
+    order = np.lexsort((candidates, -values), axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    return np.take_along_axis(scores, candidates, axis=1), candidates
+
+# スコアの上位 k 件を (スコア, 位置) の降順で返す
+def top_k(scores, k):
+    best_scores, positions = top_k_batch(scores[None, :], k)
+    return best_scores[0], positions[0]
+
+# 各ベクトルに最も近いクラスタ中心の番号を返す（巨大な類似度行列を作らないよう分割して計算する）
+# spherical=False のときはユークリッド距離で比べる
+def nearest_centroids(vectors, centroids, spherical=True, chunk_size=16384):
+    # ||x - c||^2 の最小化は x・c - ||c||^2 / 2 の最大化と同じ
+    bias = 0.0 if spherical else -0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for begin in range(0, len(vectors), chunk_size):
+        scores = vectors[begin:begin + chunk_size] @ centroids.T + bias
+        assignment[begin:begin + chunk_size] = np.argmax(scores, axis=1)
+    return assignment
+
+# k-means でクラスタ中心を求める（spherical=True なら中心を単位ベクトルに保つ）
+def kmeans(sample, k, iterations, rng, spherical=True):
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(sample, centroids, spherical)
+        order = np.argsort(assignment, kind="stable")
+        clusters, starts = np.unique(assignment[order], return_index=True)
+        counts = np.diff(np.append(starts, len(order)))
+        # 空のクラスタはランダムなサンプルで置き直す
+        updated = sample[rng.choice(len(sample), k)].copy()
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        updated[clusters] = sums if spherical else sums / counts[:, None]
+        centroids = normalize_rows(updated) if spherical else updated
+    return centroids
+
+# 全件との内積を計算する厳密検索
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.vectors = GrowableRows(dim)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    # ベクトルを追加し、割り当てた id（追加順の連番）を返す
+    def add(self, vectors):
+        vectors = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        first = len(self.vectors)
+        self.vectors.extend(vectors)
+        return np.arange(first, len(self.vectors))
+
+    def search(self, query, k=1):
+        query = normalize_rows(np.reshape(query, (1, self.dim)))[0]
+        return top_k(self.vectors.view @ query, k)
+
+    # 複数の質問をまとめて1回の行列積で検索する
+    def search_batch(self, queries, k=1):
+        queries = normalize_rows(np.reshape(queries, (-1, self.dim)))
+        return top_k_batch(queries @ self.vectors.view.T, k)
+
+    def save(self, path):
+        np.savez(path, kind=self.kind, dim=self.dim, vectors=self.vectors.view)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls(int(arrays["dim"]))
+        index.vectors.extend(arrays["vectors"])
+        return index
+
+# 転置ファイル（IVF）による近似最近傍検索
+# k-means で nlist 個のクラスタに分け、検索時は質問に近い nprobe 個のクラスタだけを走査する
+# nprobe を大きくすると再現率が上がり、遅くなる
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, dim, nlist=256, nprobe=16, train_iterations=10, seed=0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids = None
+        self.list_vectors = []
+        self.list_ids = []
+        # 学習前に追加されたベクトルはここにためて厳密検索する
+        self.pending = GrowableRows(dim)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    # 学習に必要な件数（クラスタあたり 39 件程度）
+    @property
+    def min_train_size(self):
+        return self.nlist * 39
+
+    # 球面 k-means でクラスタ中心を求める（サンプルはクラスタあたり最大 64 件）
+    def train(self, vectors):
+        vectors = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist, len(vectors))
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * 64), replace=False)]
+        centroids = kmeans(sample, nlist, self.train_iterations, rng)
+
+        self.nlist = nlist
+        self.centroids = np.ascontiguousarray(centroids)
+        self.list_vectors = [GrowableRows(self.dim) for _ in range(nlist)]
+        self.list_ids = [GrowableRows(dtype=np.int64) for _ in range(nlist)]
+        # 学習前にためていたベクトルをクラスタへ振り分ける
+        if len(self.pending):
+            pending = self.pending.view
+            self.pending = GrowableRows(self.dim)
+            self._assign(pending, np.arange(len(pending)))
+
+    def _assign(self, vectors, ids):
+        assignment = nearest_centroids(vectors, self.centroids)
+        order = np.argsort(assignment, kind="stable")
+        clusters, starts = np.unique(assignment[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for cluster, begin, end in zip(clusters, starts, ends):
+            members = order[begin:end]
+            self.list_vectors[cluster].extend(vectors[members])
+            self.list_ids[cluster].extend(ids[members])
+
+    # ベクトルを追加し、割り当てた id を返す。学習に十分な件数がたまったら自動で学習する
+    def add(self, vectors):
+        vectors = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        ids = np.arange(self.count, self.count + len(vectors))
+        self.count += len(vectors)
+        if self.is_trained:
+            self._assign(vectors, ids)
+        else:
+            self.pending.extend(vectors)
+            if len(self.pending) >= self.min_train_size:
+                self.train(self.pending.view)
+        return ids
+
+    def search(self, query, k=1, nprobe=None):
+        query = normalize_rows(np.reshape(query, (1, self.dim)))[0]
+        if not self.is_trained:
+            return top_k(self.pending.view @ query, k)
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        _, probes = top_k(self.centroids @ query, nprobe)
+        scores = [self.list_vectors[c].view @ query for c in probes]
+        ids = [self.list_ids[c].view for c in probes]
+        scores = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        best_scores, positions = top_k(scores, k)
+        return best_scores, ids[positions]
+
+    def save(self, path):
+        sizes = np.array([len(ids) for ids in self.list_ids], dtype=np.int64)
+        trained = self.is_trained
+        np.savez(
+            path,
+            kind=self.kind,
+            dim=self.dim,
+            params=json.dumps({"nlist": self.nlist, "nprobe": self.nprobe,
+                               "train_iterations": self.train_iterations, "seed": self.seed}),
+            count=self.count,
+            centroids=self.centroids if trained else np.empty((0, self.dim), dtype=np.float32),
+            list_sizes=sizes,
+            list_vectors=np.concatenate([v.view for v in self.list_vectors]) if trained else self.pending.view,
+            list_ids=np.concatenate([i.view for i in self.list_ids]) if trained else np.empty(0, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls(int(arrays["dim"]), **json.loads(str(arrays["params"])))
+        index.count = int(arrays["count"])
+        if len(arrays["centroids"]) == 0:
+            index.pending.extend(arrays["list_vectors"])
+            return index
+
+        index.centroids = arrays["centroids"]
+        index.list_vectors = [GrowableRows(index.dim) for _ in range(index.nlist)]
+        index.list_ids = [GrowableRows(dtype=np.int64) for _ in range(index.nlist)]
+        offsets = np.concatenate([[0], np.cumsum(arrays["list_sizes"])])
+        vectors, ids = arrays["list_vectors"], arrays["list_ids"]
+        for cluster in range(index.nlist):
+            begin, end = offsets[cluster], offsets[cluster + 1]
+            index.list_vectors[cluster].extend(vectors[begin:end])
+            index.list_ids[cluster].extend(ids[begin:end])
+        return index
+
+INDEX_TYPES = {ExactIndex.kind: ExactIndex, IVFIndex.kind: IVFIndex}
+
+# 量子化インデックスと次元削減は、それぞれのモジュールがこのモジュールを使うため、必要になった時点で読み込む
+def _index_type(kind):
+    if kind == "quantized":
+        from quantized_store import QuantizedIndex
+        return QuantizedIndex
+    if kind == "projected":
+        from projection import ProjectedIndex
+        return ProjectedIndex
+    return INDEX_TYPES[kind]
+
+# 保存したインデックスを種類に応じて読み込む
+def load_index(path):
+    with np.load(path) as arrays:
+        return _index_type(str(arrays["kind"])).from_arrays(arrays)
+
+# 件数に応じて厳密検索か IVF を選ぶ（kind="auto"）
+# kind="int8" / "pq" のときは圧縮コード + 全精度での再ランキングを使う
+# projection (projection.Projection) を渡すと、次元削減した空間のインデックスを作る（dim は変換前の次元）
+def create_index(dim, expected_size=0, kind="auto", projection=None, **params):
+    if projection is not None:
+        return _index_type("projected")(projection, create_index(projection.dim, expected_size, kind, **params))
+    if kind == "auto":
+        kind = IVFIndex.kind if expected_size >= ANN_MIN_VECTORS else ExactIndex.kind
+    if kind in ("int8", "pq"):
+        return _index_type("quantized")(dim, mode=kind, **params)
+    if kind == IVFIndex.kind:
+        return IVFIndex(dim, **params)
+    return ExactIndex(dim)
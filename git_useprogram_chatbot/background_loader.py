@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import Future
+
+# 起動から最初の入力待ち・最初の回答までの時間を記録して表示する
+class StartupTimer:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.first_prompt = None
+        self.first_answer = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    # 入力待ちを始める直前に呼ぶ（最初の1回だけ記録する）
+    def prompt(self):
+        if self.first_prompt is None:
+            self.first_prompt = self.elapsed()
+            print(f"[起動] 最初の入力待ちまで {self.first_prompt:.2f} 秒")
+
+    # 回答を表示した直後に呼ぶ（最初の1回だけ記録する。入力を待っていた時間も含む）
+    def answer(self, waited=0.0):
+        if self.first_answer is None:
+            self.first_answer = self.elapsed()
+            print(f"[起動] 最初の回答まで {self.first_answer:.2f} 秒 (モデルの読み込み待ち {waited:.2f} 秒)")
+
+# load_fn(log) をバックグラウンドのスレッドで実行し、結果を Future で受け取る
+# 読み込み中のメッセージは log に渡すとためておき、flush() で表示する（入力中の行に割り込まないように）
+class BackgroundLoader:
+    def __init__(self, load_fn, name="model-loader"):
+        self.future = Future()
+        self.messages = []
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.thread = threading.Thread(target=self._run, args=(load_fn,), name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self, load_fn):
+        try:
+            result = load_fn(self.log)
+        except BaseException as e:
+            self.seconds = time.perf_counter() - self.started
+            self.future.set_exception(e)
+            return
+        self.seconds = time.perf_counter() - self.started
+        self.log(f"モデルの読み込みが完了しました ({self.seconds:.2f} 秒)")
+        self.future.set_result(result)
+
+    def log(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    # ためたメッセージを表示する
+    def flush(self):
+        with self.lock:
+            messages, self.messages = self.messages, []
+        for message in messages:
+            print(message)
+
+    @property
+    def ready(self):
+        return self.future.done()
+
+    # 読み込みが終わっていれば結果を返し、まだなら None
+    def result_if_ready(self):
+        return self.future.result() if self.ready else None
+
+    # 読み込みが終わるまで待って結果を返す。戻り値は (結果, 待った秒数)
+    def wait(self, message="モデルを読み込んでいます。しばらくお待ちください..."):
+        start = time.perf_counter()
+        if not self.ready:
+            self.flush()
+            print(message)
+        result = self.future.result()
+        self.flush()
+        return result, time.perf_counter() - start
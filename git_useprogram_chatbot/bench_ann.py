@@ -0,0 +1,71 @@
+import argparse
+import time
+import numpy as np
+from ann_index import ExactIndex, IVFIndex, normalize_rows
+
+# クラスタ構造を持つ合成ベクトル（実際の文埋め込みに近い分布）を作る
+def synthetic_vectors(count, dim, clusters, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for begin in range(0, count, 100000):
+        end = min(begin + 100000, count)
+        labels = rng.integers(0, clusters, end - begin)
+        vectors[begin:end] = centers[labels] + 0.6 * rng.standard_normal((end - begin, dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+# 1件ずつ検索して上位1件の id と検索時間を返す
+def run_queries(index, queries, **search_kwargs):
+    ids = np.empty(len(queries), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, found = index.search(query, k=1, **search_kwargs)
+        latencies[i] = time.perf_counter() - start
+        ids[i] = found[0] if len(found) else -1
+    return ids, latencies
+
+def format_latency(latencies):
+    return f"p50 {np.percentile(latencies, 50) * 1000:7.3f} ms / p99 {np.percentile(latencies, 99) * 1000:7.3f} ms"
+
+# 厳密検索と IVF の recall@1 と検索時間を比較する
+def benchmark(size, dim, queries, nlist, nprobes, seed):
+    rng = np.random.default_rng(seed)
+    vectors = synthetic_vectors(size, dim, max(16, size // 1000), rng)
+    # 既存ベクトルにノイズを加えたものを質問とする
+    picks = rng.integers(0, size, queries)
+    query_vectors = normalize_rows(vectors[picks] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32))
+
+    exact = ExactIndex(dim)
+    start = time.perf_counter()
+    exact.add(vectors)
+    print(f"\n=== {size} 件 x {dim} 次元 ===")
+    print(f"厳密検索  構築 {time.perf_counter() - start:7.2f} 秒")
+    exact_ids, exact_latencies = run_queries(exact, query_vectors)
+    print(f"厳密検索  recall@1 1.000  {format_latency(exact_latencies)}")
+
+    ivf = IVFIndex(dim, nlist=nlist)
+    start = time.perf_counter()
+    ivf.train(vectors)
+    ivf.add(vectors)
+    print(f"IVF(nlist={nlist}) 構築 {time.perf_counter() - start:7.2f} 秒")
+    for nprobe in nprobes:
+        ids, latencies = run_queries(ivf, query_vectors, nprobe=nprobe)
+        recall = float(np.mean(ids == exact_ids))
+        print(f"IVF nprobe={nprobe:<3d} recall@1 {recall:.3f}  {format_latency(latencies)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="近似最近傍インデックスと厳密検索の比較")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=0, help="0 のときは sqrt(件数) 程度を使う")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        nlist = args.nlist or int(np.sqrt(size)) * 2
+        benchmark(size, args.dim, args.queries, nlist, args.nprobe, args.seed)
+
+if __name__ == "__main__":
+    main()
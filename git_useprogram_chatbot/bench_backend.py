@@ -0,0 +1,93 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from bench_ann import format_latency
+from inference_backend import BACKENDS
+from precision import DEFAULT_PRECISION, PRECISION_MODES
+
+# 1つのバックエンドで、準備（ウォームアップ）の時間・最初の質問の遅延・その後の質問の遅延を計る
+# 1回目の質問はウォームアップ直後に計り、遅延初期化やコンパイルが残っていないかを確かめる
+# バックエンドごとに新しいプロセスで実行し、前のバックエンドのコンパイル結果やキャッシュを持ち越さない
+def measure(backend, model_name, precision, questions, sources, read_top_k, warm):
+    from transformers import AutoTokenizer
+    from ann_index import normalize_rows, top_k
+    from encoder import encode_texts
+    from inference_backend import create_backend, warm_up
+    from passage_reader import split_passages
+    from shared_model import SharedEncoderModel
+    from tokenized_context import TokenizedReader
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+    model = SharedEncoderModel.from_pretrained(model_name, precision=precision)
+    embedding_model = create_backend(model.backbone, backend)
+    reader_model = create_backend(model.qa_model, backend)
+    warm_up_seconds = 0.0
+    if warm:
+        warm_up_seconds = warm_up(embedding_model) + warm_up(reader_model, batch_sizes=(1, 2, 4),
+                                                             lengths=(128, 256, 384))
+
+    passages = [passage.text for _, data in sources for passage in split_passages(data, tokenizer)]
+    passage_matrix = normalize_rows(encode_texts(passages, tokenizer, embedding_model, truncation=True))
+    reader = TokenizedReader(reader_model, tokenizer, passages)
+
+    latencies = np.empty(len(questions))
+    embeddings = np.empty((len(questions), model.config.hidden_size), dtype=np.float32)
+    answers = []
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        embeddings[i] = encode_texts([question], tokenizer, embedding_model)[0]
+        _, passage_ids = top_k(passage_matrix @ normalize_rows(embeddings[i:i + 1])[0], read_top_k)
+        answers.append(reader.read(question, passage_ids)["answer"].strip())
+        latencies[i] = time.perf_counter() - start
+
+    return {
+        "backend": getattr(embedding_model, "kind", backend),
+        "warm_up": warm_up_seconds,
+        "prepare": getattr(embedding_model, "prepare_seconds", 0.0) + getattr(reader_model, "prepare_seconds", 0.0),
+        "latencies": latencies,
+        "embeddings": embeddings,
+        "answers": answers,
+    }
+
+# eager を基準に、各バックエンドの準備時間・遅延・結果のずれを比べる
+def main():
+    from learndata7 import load_feedback_data, load_json_data
+
+    parser = argparse.ArgumentParser(description="推論バックエンド (eager / torchscript / compile / onnx) の比較")
+    parser.add_argument("--model", default="xlm-roberta-base")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--precision", choices=PRECISION_MODES, default=DEFAULT_PRECISION)
+    parser.add_argument("--questions", type=int, default=50, help="0 のときはフィードバックの質問をすべて使う")
+    parser.add_argument("--read-top-k", type=int, default=3)
+    parser.add_argument("--no-warm-up", action="store_true", help="ウォームアップせずに最初の質問の遅延を計る")
+    args = parser.parse_args()
+
+    feedback_data = load_feedback_data("data/feedback.json")
+    questions = [entry.get("question", "") for entry in feedback_data]
+    if args.questions:
+        questions = questions[:args.questions]
+    sources = [("Wikipedia", load_json_data("data/wikipedia_sections.json")),
+               ("推薦選抜", load_json_data("data/numazu_recommendation_selection_retry.json"))]
+
+    backends = ["eager"] + [backend for backend in args.backends if backend != "eager"]
+    results = []
+    for backend in backends:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results.append(executor.submit(measure, backend, args.model, args.precision, questions, sources,
+                                           args.read_top_k, not args.no_warm_up).result())
+
+    baseline = results[0]
+    print(f"\n質問 {len(questions)} 件, 精度: {args.precision}, 基準: eager")
+    for result in results:
+        latencies = result["latencies"]
+        drift = np.abs(result["embeddings"] - baseline["embeddings"]).max()
+        answers = np.mean([a == b for a, b in zip(result["answers"], baseline["answers"])])
+        print(f"\n=== {result['backend']} ===")
+        print(f"ウォームアップ {result['warm_up']:.2f} 秒 (形ごとの準備 {result['prepare']:.2f} 秒)")
+        print(f"最初の質問 {latencies[0] * 1000:.1f} ms  2件目以降 {format_latency(latencies[1:])}")
+        print(f"埋め込みの最大誤差 (対 eager) {drift:.2e}  読み取り結果の一致率 {answers:.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import threading
+import time
+import numpy as np
+from bench_ann import format_latency
+from micro_batch import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, batched_encoder, batched_reader
+
+# concurrency 個のスレッドから質問を同時に送り、全体のスループット (件/秒) と質問ごとの遅延を計る
+# answer(question) は質問のベクトル化からパッセージの読み取りまでを行う関数
+def run_clients(answer, questions, concurrency):
+    latencies = np.empty(len(questions))
+
+    def client(worker):
+        for i in range(worker, len(questions), concurrency):
+            start = time.perf_counter()
+            answer(questions[i])
+            latencies[i] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=client, args=(worker,)) for worker in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(questions) / (time.perf_counter() - start), latencies
+
+# 1件ずつモデルに通す場合と、同時に届いた質問をまとめて通す場合を同時接続数ごとに比べる
+def main():
+    from transformers import AutoTokenizer
+    from ann_index import normalize_rows, top_k
+    from encoder import encode_texts
+    from learndata7 import load_feedback_data, load_json_data
+    from passage_reader import split_passages
+    from shared_model import SharedEncoderModel
+    from tokenized_context import TokenizedReader
+
+    parser = argparse.ArgumentParser(description="同時に届いた質問のまとめ処理 (マイクロバッチ) の比較")
+    parser.add_argument("--model", default="xlm-roberta-base")
+    parser.add_argument("--questions", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    parser.add_argument("--read-top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    feedback_data = load_feedback_data("data/feedback.json")
+    questions = [entry.get("question", "") for entry in feedback_data][:args.questions]
+    data = load_json_data("data/wikipedia_sections.json")
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=False)
+    model = SharedEncoderModel.from_pretrained(args.model)
+    passages = [passage.text for passage in split_passages(data, tokenizer)]
+    passage_matrix = normalize_rows(encode_texts(passages, tokenizer, model.backbone, truncation=True))
+    reader = TokenizedReader(model.qa_model, tokenizer, passages)
+
+    def retrieve(embedding):
+        _, passage_ids = top_k(passage_matrix @ normalize_rows(embedding.reshape(1, -1))[0], args.read_top_k)
+        return passage_ids
+
+    def answer_one(question):
+        embedding = encode_texts([question], tokenizer, model.backbone)[0]
+        return reader.read(question, retrieve(embedding))
+
+    encoder = batched_encoder(tokenizer, model.backbone, args.max_batch, args.max_wait_ms)
+    batched = batched_reader(reader, args.max_batch, args.max_wait_ms)
+
+    def answer_batched(question):
+        return batched((question, retrieve(encoder(question))))
+
+    print(f"質問 {len(questions)} 件, max_batch {args.max_batch}, max_wait {args.max_wait_ms} ms")
+    for concurrency in args.concurrency:
+        print(f"\n=== 同時接続 {concurrency} ===")
+        for name, answer in (("1件ずつ", answer_one), ("まとめ処理", answer_batched)):
+            encoder.batches = encoder.items = batched.batches = batched.items = 0
+            throughput, latencies = run_clients(answer, questions, concurrency)
+            batch_sizes = ""
+            if answer is answer_batched:
+                batch_sizes = (f"  平均バッチ: ベクトル化 {encoder.average_batch_size:.1f} 件 / "
+                               f"読み取り {batched.average_batch_size:.1f} 件")
+            print(f"{name:<6} {throughput:7.1f} 件/秒  {format_latency(latencies)}{batch_sizes}")
+
+    encoder.close()
+    batched.close()
+
+if __name__ == "__main__":
+    main()
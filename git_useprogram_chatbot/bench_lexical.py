@@ -0,0 +1,61 @@
+import argparse
+import time
+import numpy as np
+from bench_ann import format_latency
+from learndata7 import feedback_answer, load_feedback_data, load_json_data
+from lexical_index import TOKENIZERS, build_lexical_index
+
+# 既存のセクションの文を組み合わせて、件数を増やした合成コーパスを作る
+def synthetic_sections(data, count, sentences_per_section, rng):
+    sentences = [sentence + "。" for content in data.values() for sentence in content.split("。") if sentence.strip()]
+    titles = list(data)
+    sections = {}
+    for i in range(count):
+        picks = rng.integers(0, len(sentences), sentences_per_section)
+        sections[f"{titles[i % len(titles)]} {i}"] = "".join(sentences[j] for j in picks)
+    return sections
+
+# 索引の構築時間と、質問ごとの検索時間を計る
+def benchmark(label, sources, feedback_data, tokenizer, questions, k):
+    start = time.perf_counter()
+    index = build_lexical_index(sources, feedback_data, tokenizer, answer_fn=feedback_answer)
+    build_seconds = time.perf_counter() - start
+
+    latencies = np.empty(len(questions))
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        index.search(question, k)
+        latencies[i] = time.perf_counter() - start
+    print(f"{label:<20s} {len(index):7d} 件 / {len(index.postings):7d} 語  構築 {build_seconds:7.2f} 秒  "
+          f"検索 {format_latency(latencies)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 キーワード索引の構築時間と検索時間")
+    parser.add_argument("--tokenizers", nargs="+", default=["fugashi", "sudachi", "janome", "bigram"],
+                        choices=list(TOKENIZERS))
+    parser.add_argument("--synthetic-size", type=int, default=100000)
+    parser.add_argument("--sentences", type=int, default=3, help="合成セクション1件あたりの文の数")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = load_json_data("data/wikipedia_sections.json")
+    recommendation_data = load_json_data("data/numazu_recommendation_selection_retry.json")
+    feedback_data = load_feedback_data("data/feedback.json")
+    sources = [("Wikipedia", data), ("推薦選抜", recommendation_data)]
+    # フィードバックの質問とセクションのタグを質問として使う
+    questions = [entry.get("question", "") for entry in feedback_data] + list(data) + list(recommendation_data)
+    synthetic = synthetic_sections({**data, **recommendation_data}, args.synthetic_size, args.sentences,
+                                   np.random.default_rng(args.seed))
+
+    for tokenizer in args.tokenizers:
+        print(f"\n=== {tokenizer} ===")
+        try:
+            benchmark("既存の JSON", sources, feedback_data, tokenizer, questions, args.k)
+        except ImportError as e:
+            print(f"{tokenizer} を利用できません: {e}")
+            continue
+        benchmark(f"合成 {args.synthetic_size} 件", [("合成", synthetic)], (), tokenizer, questions, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from bench_ann import format_latency
+from precision import PRECISION_MODES, bf16_supported, current_rss
+
+# 1つの精度モードで、モデルの読み込み・質問のベクトル化・検索・読み取りを計る
+# モードごとに新しいプロセスで実行し、常駐メモリが前のモードの影響を受けないようにする
+def measure(mode, model_name, questions, sources, read_top_k):
+    from transformers import AutoTokenizer
+    from ann_index import normalize_rows, top_k
+    from corpus_index import build_corpus_index
+    from encoder import encode_texts
+    from passage_reader import split_passages
+    from shared_model import SharedEncoderModel
+    from tokenized_context import TokenizedReader
+
+    rss_start = current_rss()
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+    model = SharedEncoderModel.from_pretrained(model_name, precision=mode)
+    rss_loaded = current_rss()
+
+    corpus_index = build_corpus_index(sources, tokenizer, model.backbone)
+    passages = [passage.text for _, data in sources for passage in split_passages(data, tokenizer)]
+    passage_matrix = normalize_rows(encode_texts(passages, tokenizer, model.backbone, truncation=True))
+    reader = TokenizedReader(model.qa_model, tokenizer, passages)
+
+    embeddings = np.empty((len(questions), model.config.hidden_size), dtype=np.float32)
+    encode_latencies = np.empty(len(questions))
+    read_latencies = np.empty(len(questions))
+    answers = []
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        embeddings[i] = encode_texts([question], tokenizer, model.backbone)[0]
+        encode_latencies[i] = time.perf_counter() - start
+
+        _, passage_ids = top_k(passage_matrix @ normalize_rows(embeddings[i:i + 1])[0], read_top_k)
+        start = time.perf_counter()
+        answers.append(reader.read(question, passage_ids)["answer"].strip())
+        read_latencies[i] = time.perf_counter() - start
+
+    _, top1 = corpus_index.search(embeddings, 1)
+    return {
+        "mode": mode,
+        "weights": model.parameter_bytes,
+        "rss_model": rss_loaded - rss_start,
+        "rss_total": current_rss(),
+        "encode_latencies": encode_latencies,
+        "read_latencies": read_latencies,
+        "embeddings": embeddings,
+        "top1": top1[:, 0],
+        "answers": answers,
+    }
+
+def cosine(a, b):
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+# fp32 を基準に、各精度モードの速度・メモリ・埋め込みのずれ・検索結果の一致率を比べる
+def main():
+    from learndata7 import load_feedback_data, load_json_data
+
+    parser = argparse.ArgumentParser(description="推論の精度モード (fp32 / int8 / bf16) の比較")
+    parser.add_argument("--model", default="xlm-roberta-base")
+    parser.add_argument("--modes", nargs="+", default=list(PRECISION_MODES), choices=PRECISION_MODES)
+    parser.add_argument("--questions", type=int, default=0, help="0 のときはフィードバックの質問をすべて使う")
+    parser.add_argument("--read-top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    feedback_data = load_feedback_data("data/feedback.json")
+    questions = [entry.get("question", "") for entry in feedback_data]
+    if args.questions:
+        questions = questions[:args.questions]
+    sources = [("Wikipedia", load_json_data("data/wikipedia_sections.json")),
+               ("推薦選抜", load_json_data("data/numazu_recommendation_selection_retry.json"))]
+    if "bf16" in args.modes and not bf16_supported():
+        print("この CPU は bfloat16 に対応していないため、bf16 は fp32 と同じ結果になります")
+
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"]
+    results = []
+    for mode in modes:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results.append(executor.submit(measure, mode, args.model, questions, sources, args.read_top_k).result())
+
+    baseline = results[0]
+    print(f"\n質問 {len(questions)} 件, 基準: fp32")
+    for result in results:
+        drift = cosine(result["embeddings"], baseline["embeddings"])
+        top1 = np.mean(result["top1"] == baseline["top1"])
+        answers = np.mean([a == b for a, b in zip(result["answers"], baseline["answers"])])
+        print(f"\n=== {result['mode']} ===")
+        print(f"重み {result['weights'] / 1024 ** 2:7.1f} MB  モデル読み込みによる RSS 増加 {result['rss_model'] / 1024 ** 2:7.1f} MB  "
+              f"終了時 RSS {result['rss_total'] / 1024 ** 2:7.1f} MB")
+        print(f"質問のベクトル化  {format_latency(result['encode_latencies'])}")
+        print(f"パッセージ読み取り {format_latency(result['read_latencies'])}")
+        print(f"埋め込みのコサイン類似度 (対 fp32) 平均 {drift.mean():.5f} / 最小 {drift.min():.5f}  "
+              f"検索上位1件の一致率 {top1:.1%}  読み取り結果の一致率 {answers:.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import multiprocessing
+import time
+import numpy as np
+from bench_ann import format_latency
+from chatbot_client import ChatbotClient
+from prefork_server import WorkerPool, listening_socket, load_for_workers, run_worker, threads_per_worker
+
+# clients 個のクライアントのプロセスから質問を同時に送り、全体のスループット (件/秒) と遅延を計る
+# クライアントもプロセスに分け、送る側の GIL で頭打ちにならないようにする
+def run_clients(host, port, questions, clients):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    def client(index):
+        latencies, errors = [], 0
+        with ChatbotClient(host, port) as connection:
+            for question in questions[index::clients]:
+                start = time.perf_counter()
+                status, _ = connection.ask(question)
+                latencies.append(time.perf_counter() - start)
+                errors += status != 200
+        results.put((latencies, errors))
+
+    processes = [context.Process(target=client, args=(index,), daemon=True) for index in range(clients)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    latencies = np.array([latency for latencies, _ in collected for latency in latencies])
+    return len(latencies) / elapsed, latencies, sum(errors for _, errors in collected)
+
+# 親でモデルを1回だけ読み込み、ワーカーの数を変えながら prefork サーバのスループットを比べる
+# 質問には番号を付け、完全一致と質問キャッシュに当たらずにモデルまで届くようにする
+def main():
+    from chatbot_server import server_parser
+    from learndata7 import load_feedback_data
+
+    parser = server_parser("prefork サーバのワーカー数ごとのスループットの比較 (Linux のみ)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=0, help="ワーカーごとの推論スレッド数 (0 なら CPU 数 / ワーカー数)")
+    parser.add_argument("--clients", type=int, default=16, help="同時に質問を送るクライアントの数")
+    parser.add_argument("--requests", type=int, default=512, help="ワーカー数ごとに送る質問の数")
+    args = parser.parse_args()
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("この環境では fork が使えないため計測できません")
+        return
+    base = [entry.get("question", "") for entry in load_feedback_data(args.feedback)]
+    questions = [f"{base[i % len(base)]}（{i}）" for i in range(args.requests)]
+    warm_up = [f"{base[i % len(base)]}（暖機 {i}）" for i in range(args.clients * 2)]
+
+    service = load_for_workers(args, threads_per_worker(min(args.workers), args.threads))
+    sock = listening_socket(args.host, args.port)
+    port = sock.getsockname()[1]
+    quiet = lambda message: None
+
+    print(f"質問 {len(questions)} 件, クライアント {args.clients} 個")
+    baseline = None
+    for workers in args.workers:
+        threads = threads_per_worker(workers, args.threads)
+        pool = WorkerPool(lambda slot: run_worker(service, sock, threads, args.max_concurrency, args.max_pending,
+                                                  log=quiet), workers).start()
+        try:
+            run_clients(args.host, port, warm_up, args.clients)
+            throughput, latencies, errors = run_clients(args.host, port, questions, args.clients)
+        finally:
+            pool.stop()
+        baseline = baseline or throughput
+        print(f"ワーカー {workers:>2} 個 (各 {threads} スレッド): {throughput:8.1f} 件/秒 ({throughput / baseline:4.2f} 倍)  "
+              f"{format_latency(latencies)}  エラー {errors} 件")
+    sock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import time
+import numpy as np
+from ann_index import normalize_rows, top_k_batch
+from bench_ann import synthetic_vectors
+from projection import PROJECTION_MODES, Projection
+
+# 元の次元での上位 k 件を正解として、次元削減した空間での上位 k 件がどれだけ一致するか (recall@k)
+def recall_at_k(truth, found):
+    return float(np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]))
+
+# 次元数・方式ごとに、索引の大きさ・検索時間・recall@1 / recall@k を比べる
+def benchmark(database, queries, dims, modes, k):
+    database = normalize_rows(database)
+    queries = normalize_rows(queries)
+    start = time.perf_counter()
+    _, truth = top_k_batch(queries @ database.T, k)
+    full_seconds = time.perf_counter() - start
+    print(f"\n=== {len(database)} 件 x {database.shape[1]} 次元, 質問 {len(queries)} 件 ===")
+    print(f"{'元の次元':<14} {database.nbytes / 1024 ** 2:8.2f} MB  検索 {full_seconds * 1000 / len(queries):7.3f} ms/件  "
+          f"recall@1 1.000  recall@{k} 1.000")
+
+    for mode in modes:
+        for dim in dims:
+            projection = Projection.fit([database, queries], dim, mode)
+            matrix = normalize_rows(projection.transform(database))
+            start = time.perf_counter()
+            projected_queries = normalize_rows(projection.transform(queries))
+            _, found = top_k_batch(projected_queries @ matrix.T, k)
+            seconds = time.perf_counter() - start
+            print(f"{mode:<6} {projection.dim:>4} 次元 {matrix.nbytes / 1024 ** 2:8.2f} MB  "
+                  f"検索 {seconds * 1000 / len(queries):7.3f} ms/件  "
+                  f"recall@1 {recall_at_k(truth[:, :1], found[:, :1]):.3f}  recall@{k} {recall_at_k(truth, found):.3f}")
+
+# 実データ: コーパスのタイトル・内容を索引、フィードバックの質問を検索語として埋め込みを計算する
+def model_embeddings(model_name):
+    from transformers import AutoModel, AutoTokenizer
+    from corpus_index import build_corpus_index
+    from encoder import encode_texts
+    from learndata7 import load_feedback_data, load_json_data
+
+    sources = [("Wikipedia", load_json_data("data/wikipedia_sections.json")),
+               ("推薦選抜", load_json_data("data/numazu_recommendation_selection_retry.json"))]
+    questions = [entry.get("question", "") for entry in load_feedback_data("data/feedback.json")]
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+    model = AutoModel.from_pretrained(model_name).eval()
+    corpus_index = build_corpus_index(sources, tokenizer, model)
+    database = np.concatenate([corpus_index.title_matrix, corpus_index.content_matrix])
+    return database, encode_texts(questions, tokenizer, model)
+
+# 合成データ: 低次元 (intrinsic_dim) のクラスタ構造を 768 次元に埋め込み、全ベクトル共通の成分を足して
+# 文埋め込みのような偏り（異方性）を持たせる
+def anisotropic_vectors(size, dim, queries, rng, intrinsic_dim=64):
+    latent = synthetic_vectors(size + queries, intrinsic_dim, max(16, size // 1000), rng)
+    basis = np.linalg.qr(rng.standard_normal((dim, intrinsic_dim)))[0].T.astype(np.float32)
+    noise = 0.01 * rng.standard_normal((size + queries, dim)).astype(np.float32)
+    shared = normalize_rows(rng.standard_normal((1, dim)).astype(np.float32))
+    vectors = normalize_rows(latent @ basis + noise + 2.0 * shared)
+    return vectors[:size], vectors[size:]
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みの次元削減 (PCA / 白色化) による recall と検索時間の比較")
+    parser.add_argument("--model", default="xlm-roberta-base")
+    parser.add_argument("--dims", type=int, nargs="+", default=[32, 64, 128, 256])
+    parser.add_argument("--modes", nargs="+", default=list(PROJECTION_MODES), choices=PROJECTION_MODES)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[], help="合成データの件数（指定したときだけ実行する）")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    database, queries = model_embeddings(args.model)
+    benchmark(database, queries, args.dims, args.modes, args.k)
+    rng = np.random.default_rng(args.seed)
+    for size in args.synthetic:
+        database, queries = anisotropic_vectors(size, 768, args.queries, rng)
+        benchmark(database, queries, args.dims, args.modes, args.k)
+
+if __name__ == "__main__":
+    main()
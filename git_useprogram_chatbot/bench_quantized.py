@@ -0,0 +1,51 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from ann_index import ExactIndex, normalize_rows
+from bench_ann import format_latency, run_queries, synthetic_vectors
+from quantized_store import QuantizedIndex
+
+# 量子化インデックスを作り、recall@1・1件あたりのメモリ・検索時間を表示する
+def evaluate(label, index, vectors, query_vectors, exact_ids, rerank_values):
+    start = time.perf_counter()
+    index.add(vectors)
+    print(f"{label:<10} 構築 {time.perf_counter() - start:6.2f} 秒  {index.bytes_per_vector} バイト/件")
+    for rerank in rerank_values:
+        ids, latencies = run_queries(index, query_vectors, rerank=rerank)
+        recall = float(np.mean(ids == exact_ids))
+        name = "再ランキングなし" if rerank == 0 else f"再ランキング x{rerank}"
+        print(f"  {name:<14} recall@1 {recall:.3f} (損失 {1 - recall:.3f})  {format_latency(latencies)}")
+    index.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="量子化した埋め込みストアと厳密なコサイン類似度検索の比較")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pq-subspaces", type=int, nargs="+", default=[48, 96, 192])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 10, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_vectors(args.size, args.dim, max(16, args.size // 1000), rng)
+    picks = rng.integers(0, args.size, args.queries)
+    query_vectors = normalize_rows(vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+
+    exact = ExactIndex(args.dim)
+    exact.add(vectors)
+    exact_ids, exact_latencies = run_queries(exact, query_vectors)
+    print(f"=== {args.size} 件 x {args.dim} 次元 ===")
+    print(f"{'float32':<10} {4 * args.dim} バイト/件  {format_latency(exact_latencies)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = QuantizedIndex(args.dim, "int8", os.path.join(directory, "int8.f32"))
+        evaluate("int8", index, vectors, query_vectors, exact_ids, args.rerank)
+        for subspaces in args.pq_subspaces:
+            index = QuantizedIndex(args.dim, "pq", os.path.join(directory, f"pq{subspaces}.f32"), pq_subspaces=subspaces)
+            evaluate(f"pq{subspaces}", index, vectors, query_vectors, exact_ids, args.rerank)
+
+if __name__ == "__main__":
+    main()
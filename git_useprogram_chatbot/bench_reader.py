@@ -0,0 +1,76 @@
+import argparse
+import time
+import numpy as np
+from transformers import pipeline, AutoTokenizer, AutoModelForQuestionAnswering
+from bench_ann import format_latency
+from learndata7 import load_feedback_data, load_json_data
+from passage_reader import PASSAGE_MAX_TOKENS, PASSAGE_OVERLAP_TOKENS, PassageReader
+
+# 質問ごとに読み取りを行い、答えと処理時間を返す
+def run_reader(read, questions):
+    answers = []
+    latencies = np.empty(len(questions))
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        answers.append(read(question)["answer"].strip())
+        latencies[i] = time.perf_counter() - start
+    return answers, latencies
+
+# 毎回パッセージをトークン化するパイプラインで、上位 k 件のパッセージを読む
+def pipeline_read(reader, question, k):
+    passage_ids = reader.retrieve(question, k)
+    if not passage_ids:
+        return reader.read_all(question)
+    results = reader.qa_pipeline(question=[question] * len(passage_ids),
+                                 context=[reader.passages[i].text for i in passage_ids])
+    if isinstance(results, dict):
+        results = [results]
+    return max(results, key=lambda result: result["score"])
+
+# 答えの一致率（完全一致と、片方がもう片方を含む部分一致）
+def agreement(answers, expected_answers):
+    exact = np.mean([answer == expected for answer, expected in zip(answers, expected_answers)])
+    overlap = np.mean([bool(answer) and (answer in expected or expected in answer)
+                       for answer, expected in zip(answers, expected_answers)])
+    return f"一致率 {exact:.1%} (部分一致を含む {overlap:.1%})"
+
+# 全文を読む従来の方法と、上位 k 件のパッセージだけを読む方法の処理時間と答えの一致率を比べる
+# 上位 k 件はパイプライン（毎回トークン化）とトークン化済みの読み取りの両方で計る
+def main():
+    parser = argparse.ArgumentParser(description="全文読み取りとパッセージ検索 + 読み取りの比較")
+    parser.add_argument("--model", default="xlm-roberta-base")
+    parser.add_argument("--data", default="data/wikipedia_sections.json")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--max-tokens", type=int, default=PASSAGE_MAX_TOKENS)
+    parser.add_argument("--overlap", type=int, default=PASSAGE_OVERLAP_TOKENS)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--cache-dir", default=None, help="トークン化済みパッセージの保存先")
+    args = parser.parse_args()
+
+    data = load_json_data(args.data)
+    feedback_data = load_feedback_data("data/feedback.json")
+    # フィードバックの質問とセクションのタグを質問として使う
+    questions = ([entry.get("question", "") for entry in feedback_data] + list(data))[:args.questions]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=False)
+    qa_model = AutoModelForQuestionAnswering.from_pretrained(args.model)
+    qa_pipeline = pipeline("question-answering", model=qa_model, tokenizer=tokenizer, framework="pt")
+
+    start = time.perf_counter()
+    reader = PassageReader(data, qa_pipeline, tokenizer, max_tokens=args.max_tokens, overlap=args.overlap,
+                           cache_dir=args.cache_dir)
+    print(f"パッセージの分割とトークン化: {time.perf_counter() - start:.2f} 秒")
+    print(f"{len(data)} セクション → {len(reader)} パッセージ, 質問 {len(questions)} 件")
+
+    baseline, baseline_latencies = run_reader(reader.read_all, questions)
+    print(f"全文                      {format_latency(baseline_latencies)}  合計 {baseline_latencies.sum():6.2f} 秒")
+    for k in args.top_k:
+        piped, piped_latencies = run_reader(lambda question: pipeline_read(reader, question, k), questions)
+        print(f"上位 {k:<2d} 件 パイプライン     {format_latency(piped_latencies)}  合計 {piped_latencies.sum():6.2f} 秒  "
+              f"全文との{agreement(piped, baseline)}")
+        answers, latencies = run_reader(lambda question: reader.read(question, k), questions)
+        print(f"上位 {k:<2d} 件 トークン化済み   {format_latency(latencies)}  合計 {latencies.sum():6.2f} 秒  "
+              f"全文との{agreement(answers, baseline)}  パイプラインとの{agreement(answers, piped)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+from mapped_weights import available_memory, process_memory
+
+# 重みの読み込み方
+#   separate: ワーカーごとに from_pretrained で読み込む（ワーカーの数だけ重みのコピーができる）
+#   fork:     親プロセスで from_pretrained してから fork する（書き込まなければコピーオンライトで共有される）
+#   mmap:     親プロセスで safetensors を読み取り専用で mmap してから fork する（ファイルのページキャッシュを共有する）
+LOAD_MODES = ("separate", "fork", "mmap")
+
+def megabytes(value):
+    return f"{value / 1024 ** 2:8.1f} MB"
+
+# workers 個のワーカーを fork し、それぞれで質問をベクトル化した後のメモリ使用量を親から測る
+# load() は (トークナイザ, モデル) を返す関数。preload なら親で1回だけ呼び、ワーカーはそれを引き継ぐ
+# 親では推論しない（推論のスレッドプールを作った後に fork するとワーカーが止まることがある）
+def run_workers(load, workers, questions, threads, preload):
+    from encoder import encode_texts
+
+    context = multiprocessing.get_context("fork")
+    loaded = load() if preload else None
+    # 親の Python オブジェクトを GC の対象から外し、ワーカーの GC が参照カウント以外のページに書き込まないようにする
+    gc.collect()
+    gc.freeze()
+    ready = context.Queue()
+    done = context.Event()
+
+    def work():
+        import torch
+        torch.set_num_threads(threads)
+        tokenizer, model = loaded if loaded is not None else load()
+        start = time.perf_counter()
+        encode_texts(questions, tokenizer, model)
+        ready.put((os.getpid(), len(questions) / (time.perf_counter() - start)))
+        # 全ワーカーが揃ってから測るため、親の合図まで終了しない
+        done.wait()
+
+    processes = [context.Process(target=work, daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    results = [ready.get() for _ in processes]
+    usage = [(pid, throughput, process_memory(pid)) for pid, throughput in results]
+    parent = process_memory()
+    done.set()
+    for process in processes:
+        process.join()
+    gc.unfreeze()
+    return parent, usage
+
+def report(mode, parent, usage):
+    print(f"\n=== {mode} (ワーカー {len(usage)} 個) ===")
+    print(f"{'親':<10} RSS {megabytes(parent['rss'])}  PSS {megabytes(parent['pss'])}  USS {megabytes(parent['uss'])}")
+    for pid, throughput, memory in usage:
+        print(f"{pid:<10} RSS {megabytes(memory['rss'])}  PSS {megabytes(memory['pss'])}  USS {megabytes(memory['uss'])}  "
+              f"共有 {megabytes(memory['shared'])}  {throughput:7.1f} 件/秒")
+    total = parent["pss"] + sum(memory["pss"] for _, _, memory in usage)
+    per_worker = sum(memory["uss"] for _, _, memory in usage) / len(usage)
+    print(f"合計 PSS (ホストで使うメモリの目安): {megabytes(total)}")
+    print(f"ワーカー1つあたりの増分 (USS の平均): {megabytes(per_worker)}", end="")
+    available = available_memory()
+    if available is not None and per_worker > 0:
+        print(f"  → 空きメモリ {megabytes(available).strip()} で追加できるワーカー数の目安: {int(available // per_worker)} 個")
+    else:
+        print()
+
+# 重みの読み込み方ごとに、ワーカーを fork したときのワーカーごとの固有メモリ (USS) と合計を比べる
+def main():
+    from transformers import AutoModel, AutoTokenizer
+    from learndata7 import load_feedback_data
+    from mapped_weights import mmap_pretrained
+
+    parser = argparse.ArgumentParser(description="ワーカーを fork したときのメモリ使用量の比較 (Linux のみ)")
+    parser.add_argument("--model", default="xlm-roberta-base")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=list(LOAD_MODES), choices=LOAD_MODES)
+    parser.add_argument("--questions", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="ワーカーごとの推論スレッド数 (0 なら CPU 数 / ワーカー数)")
+    args = parser.parse_args()
+
+    if process_memory() is None or "fork" not in multiprocessing.get_all_start_methods():
+        print("この環境では /proc/<pid>/smaps_rollup か fork が使えないため計測できません")
+        return
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    questions = [entry.get("question", "") for entry in load_feedback_data("data/feedback.json")][:args.questions]
+
+    def from_pretrained():
+        return AutoTokenizer.from_pretrained(args.model, use_fast=False), AutoModel.from_pretrained(args.model).eval()
+
+    def mapped():
+        return AutoTokenizer.from_pretrained(args.model, use_fast=False), mmap_pretrained(AutoModel, args.model)
+
+    print(f"{args.model}, 質問 {len(questions)} 件, ワーカーごとのスレッド {threads}")
+    for mode in args.modes:
+        load = mapped if mode == "mmap" else from_pretrained
+        parent, usage = run_workers(load, args.workers, questions, threads, preload=(mode != "separate"))
+        report(mode, parent, usage)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import http.client
+import json
+from json_http import DEFAULT_HOST, DEFAULT_PORT
+
+# chatbot_server.py のクライアント（標準ライブラリだけを使う）
+# 1つの接続を使い回し (keep-alive)、サーバが接続を閉じていたら1回だけ接続し直す
+# スレッドごとに別のクライアントを作ること（http.client の接続はスレッドセーフではない）
+class ChatbotClient:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=60.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    # JSON を送り、(ステータス, JSON) を返す
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json; charset=utf-8"} if body is not None else {}
+        for retry in (True, False):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if not retry:
+                    raise
+                continue
+            if response.will_close:
+                self.close()
+            return response.status, json.loads(data) if data else None
+
+    def ask(self, question, k=5, candidates=False):
+        return self.request("POST", "/ask", {"question": question, "k": k, "candidates": candidates})
+
+    # /ask/stream を呼び、届いたイベントを (イベント名, JSON) として届いた順に返す
+    # サーバは送り終えると接続を閉じるので、使い回している接続とは別の接続を使う
+    def stream(self, question, k=5, candidates=False):
+        body = json.dumps({"question": question, "k": k, "candidates": candidates}, ensure_ascii=False).encode("utf-8")
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("POST", "/ask/stream", body, {"Content-Type": "application/json; charset=utf-8",
+                                                             "Accept": "text/event-stream"})
+            response = connection.getresponse()
+            if response.status != 200:
+                data = response.read()
+                yield "error", json.loads(data) if data else {"status": response.status}
+                return
+            event, data = "message", []
+            for line in response:
+                line = line.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    if data:
+                        yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].lstrip())
+        finally:
+            connection.close()
+
+    def rate(self, question, answer, rating, human_answer=None):
+        return self.request("POST", "/rate", {"question": question, "answer": answer, "rating": rating,
+                                              "human_answer": human_answer})
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def print_answer(response):
+    for candidate in response.get("candidates", []):
+        print(f"[{candidate['source']}] '{candidate['id']}' の類似度: {candidate['score']:.4f}")
+    print(f"チャットボットの回答: {response['answer']}")
+    print(f"({response['source']}, スコア {response['score']:.4f}, {response['seconds'] * 1000:.0f} ms)")
+
+# 答えが届くたびに表示し、最後に届いた答え（なければ None）を返す
+def stream_answer(client, question, candidates=False):
+    bot_answer = None
+    for event, payload in client.stream(question, candidates=candidates):
+        if event == "answer":
+            print_answer(payload)
+            bot_answer = payload["answer"] or bot_answer
+        elif event == "status":
+            print("モデルを読み込んでいます。しばらくお待ちください...")
+        elif event == "error":
+            print(f"エラー ({payload.get('status')}): {payload.get('error')}")
+        elif event == "done" and payload["first_event_seconds"] is not None:
+            print(f"(最初の回答まで {payload['first_event_seconds'] * 1000:.0f} ms, 全体 {payload['seconds'] * 1000:.0f} ms)")
+    return bot_answer
+
+# learndata7 の対話と同じ流れを、HTTP サーバ越しに行う
+def main():
+    parser = argparse.ArgumentParser(description="沼津高専チャットボットの HTTP クライアント")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--candidates", action="store_true", help="類似度の高い候補も表示する")
+    parser.add_argument("--health", action="store_true", help="サーバの状態を表示して終了する")
+    parser.add_argument("--stream", action="store_true", help="答えが見つかるたびに表示する (/ask/stream)")
+    args = parser.parse_args()
+
+    with ChatbotClient(args.host, args.port) as client:
+        if args.health:
+            status, health = client.health()
+            print(json.dumps(health, ensure_ascii=False, indent=2))
+            return
+
+        print("沼津高専チャットボットへようこそ！'exit'と入力して終了できます。")
+        while True:
+            user_input = input("あなた: ")
+            if user_input.lower() == "exit":
+                break
+
+            if args.stream:
+                bot_answer = stream_answer(client, user_input, args.candidates)
+            else:
+                status, response = client.ask(user_input, candidates=args.candidates)
+                if status != 200:
+                    print(f"エラー ({status}): {response.get('error') if response else ''}")
+                    continue
+                print_answer(response)
+                bot_answer = response["answer"]
+
+            try:
+                rating = int(input("評価を1から5で入力してください（1が最低、5が最高）: "))
+            except ValueError:
+                print("無効な入力です。1から5の数字で評価してください。")
+                continue
+
+            human_answer = None
+            if rating < 3:
+                human_answer = input("改善された回答を入力してください: ")
+            status, response = client.rate(user_input, bot_answer, rating, human_answer)
+            if status != 200:
+                print(f"エラー ({status}): {response.get('error') if response else ''}")
+
+if __name__ == "__main__":
+    main()
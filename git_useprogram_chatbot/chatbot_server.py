@@ -0,0 +1,479 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from startup_profile import PROFILE, phase
+from json_http import DEFAULT_HOST, DEFAULT_PORT, EventStream, HttpError, JsonHttpServer, request_json
+from learndata7 import (feedback_answer, load_feedback_data, load_json_data, load_models, quick_match, save_feedback,
+                        search_match, update_feedback_index)
+from exact_match import ExactMatchIndex
+from lexical_index import LEXICAL_THRESHOLD, build_lexical_index
+from background_loader import BackgroundLoader
+from micro_batch import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, batched_encoder, batched_reader
+from runtime_options import runtime_parser
+
+# 同時にモデルで処理する質問の数（executor のスレッド数）と、順番を待てる質問の数（超えたら 503 を返す）
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_PENDING = 128
+# /ask で返せる候補の数の上限
+MAX_CANDIDATES = 20
+# /health で最初のイベントまでの時間の分布を求めるのに使う、直近のストリームの数
+FIRST_EVENT_SAMPLES = 1000
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# learndata7 の検索とフィードバックの処理を、複数のスレッドから同時に呼べるようにまとめたもの
+# 完全一致・BM25・フィードバックの埋め込みの索引と質問キャッシュは lock で守り、モデルの推論はロックの外で行う
+# 同時に届いた質問のベクトル化は micro_batch でまとめて1回の推論にする
+# フィードバックはファイルに追記された行から索引に反映するので、同じファイルを使う他のプロセスの評価も取り込まれる
+# load_options は learndata7.load_models の引数（precision, backend, reranker_name, mmap_weights など）
+class ChatbotService:
+    def __init__(self, feedback_path="data/feedback.json", lexical_only=False, max_batch=DEFAULT_MAX_BATCH,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, **load_options):
+        self.feedback_path = feedback_path
+        self.started = time.perf_counter()
+        with phase("data", "wikipedia_sections.json"):
+            data = load_json_data('data/wikipedia_sections.json')
+        with phase("data", "numazu_recommendation_selection_retry.json"):
+            recommendation_data = load_json_data('data/numazu_recommendation_selection_retry.json')
+        with phase("data", "feedback.json"):
+            feedback_data = load_feedback_data(feedback_path)
+            self.feedback_offset = file_size(feedback_path)
+        with phase("index", "キーワード索引"):
+            self.lexical_index = build_lexical_index([("Wikipedia", data), ("推薦選抜", recommendation_data)],
+                                                     feedback_data, answer_fn=feedback_answer)
+        print(f"キーワード索引: {len(self.lexical_index)} 件 ({self.lexical_index.tokenizer_name})")
+        with phase("index", "完全一致索引"):
+            self.exact_index = ExactMatchIndex(feedback_data)
+
+        self.lock = threading.Lock()
+        # フィードバックを反映する処理を1つずつ行い、保存した順に索引へ反映するためのロック（検索は止めない）
+        self.flush_lock = threading.Lock()
+        # 埋め込みの索引にまだ反映していないフィードバック（モデルの読み込みが終わったら反映する）
+        self.pending_feedback = []
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.encoder = None
+        self.reader_batcher = None
+        self.loader = None
+        if not lexical_only:
+            self.loader = BackgroundLoader(lambda log: self._load_models(data, recommendation_data, feedback_data,
+                                                                         load_options, log))
+            self.loader.future.add_done_callback(self._loaded)
+
+    def _load_models(self, data, recommendation_data, feedback_data, load_options, log):
+        models = load_models(data, recommendation_data, feedback_data, self.lexical_index, max_batch=self.max_batch,
+                             log=log, **load_options)
+        models.retriever.encode_fn = self._encode
+        self._start_batchers(models)
+        return models
+
+    def _start_batchers(self, models):
+        self.encoder = batched_encoder(models.tokenizer, models.retriever.model, self.max_batch, self.max_wait_ms)
+        if models.reader is not None:
+            self.reader_batcher = batched_reader(models.reader.reader, self.max_batch, self.max_wait_ms)
+        models.retriever.lock = self.lock
+
+    def _loaded(self, future):
+        self.loader.flush()
+        if future.exception() is not None:
+            print(f"モデルの読み込みに失敗しました: {future.exception()!r}")
+        if PROFILE.enabled and not PROFILE.reported:
+            PROFILE.report()
+
+    # 質問を1件ずつ micro_batch に渡し、他のスレッドの質問と一緒にベクトル化してもらう
+    def _encode(self, questions):
+        futures = [self.encoder.submit(question) for question in questions]
+        return np.stack([future.result() for future in futures])
+
+    @property
+    def models_status(self):
+        if self.loader is None:
+            return "disabled"
+        if not self.loader.ready:
+            return "loading"
+        return "failed" if self.loader.future.exception() is not None else "ready"
+
+    # 読み込みが終わったモデル（読み込み中・失敗・lexical_only なら None）
+    def models(self):
+        return self.loader.future.result() if self.models_status == "ready" else None
+
+    # 質問応答モデルで答えの範囲を読み取れるか（--qa-reader。読み込みが終わるまでは分からないので False）
+    @property
+    def has_reader(self):
+        models = self.models()
+        return models is not None and models.reader is not None
+
+    # fork したワーカーで最初に呼ぶ（prefork_server）。親のスレッドは引き継がれないので micro_batch を作り直し、
+    # fork したときに他のスレッドが持っていたかもしれないロックも作り直す
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        models = self.models()
+        if models is not None:
+            self._start_batchers(models)
+
+    # フィードバックのファイルに追記された行（自分や他のプロセスが保存したもの）を索引に反映する。lock を取ってから呼ぶ
+    def _read_new_feedback(self):
+        size = file_size(self.feedback_path)
+        if size <= self.feedback_offset:
+            return
+        with open(self.feedback_path, "rb") as file:
+            file.seek(self.feedback_offset)
+            data = file.read(size - self.feedback_offset)
+        # 書き込み途中の行は次に回す
+        data = data[:data.rfind(b"\n") + 1]
+        self.feedback_offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            update_feedback_index(entry, None, None, None, exact_index=self.exact_index, lexical_index=self.lexical_index)
+            if self.loader is not None:
+                self.pending_feedback.append(entry)
+
+    # 反映待ちのフィードバックを埋め込みの索引に反映する（update_feedback_index と同じ結果）
+    # 新しい質問のベクトル化は lock の外で行い、索引とキャッシュへの追加だけを lock の中で行う
+    # wait=False なら、他のスレッドが反映している間は待たずに戻る（検索を反映の終わりまで待たせない）
+    def _flush_pending(self, models, wait=True):
+        if not self.flush_lock.acquire(blocking=wait):
+            return
+        try:
+            self._flush_pending_locked(models)
+        finally:
+            self.flush_lock.release()
+
+    def _flush_pending_locked(self, models):
+        cache = models.feedback_cache
+        with self.lock:
+            pending, self.pending_feedback = self.pending_feedback, []
+            # 登録済みの質問は回答を置き換えるだけで済む
+            new_entries = [entry for entry in pending
+                           if not models.feedback_index.update_answer(entry.get("question", ""), feedback_answer(entry))]
+            questions = list(dict.fromkeys(entry.get("question", "") for entry in new_entries))
+            embeddings = cache.get(questions) if cache is not None else {}
+        if not new_entries:
+            return
+
+        missing = [question for question in questions if question not in embeddings]
+        if missing:
+            from encoder import encode_texts
+            vectors = np.asarray(encode_texts(missing, models.tokenizer, models.embedding_model), dtype=np.float32)
+            embeddings.update(zip(missing, vectors))
+        with self.lock:
+            if cache is not None and missing:
+                cache.add(missing, vectors)
+            # 同じ質問が何度も評価されていたら、add_many は後の回答で置き換える
+            models.feedback_index.add_many([entry.get("question", "") for entry in new_entries],
+                                           np.stack([embeddings[entry.get("question", "")] for entry in new_entries]),
+                                           [feedback_answer(entry) for entry in new_entries])
+
+    # モデルを使わない回答 (回答, "exact" / "lexical", スコア)。なければ (None, None, 0.0)
+    def quick(self, question):
+        with self.lock:
+            self._read_new_feedback()
+            return quick_match(question, self.exact_index, self.lexical_index)
+
+    # 埋め込みで検索する（モデルの読み込みが終わってから呼ぶこと）。戻り値は (SearchResult, 回答の種類)
+    # lexical_only ならキーワード検索だけで探す
+    def search(self, question, k=5):
+        if self.loader is None:
+            with self.lock:
+                return search_match(question, self.lexical_index, threshold=LEXICAL_THRESHOLD, k=k), "lexical"
+        models = self.loader.future.result()
+        if self.pending_feedback:
+            self._flush_pending(models, wait=False)
+        start = time.perf_counter()
+        result = search_match(question, models.retriever, k=k, reranker=models.reranker)
+        with self.lock:
+            self.exact_index.stats.record_model_time(time.perf_counter() - start)
+        return result, "reranked" if result.reranked else "dense"
+
+    # BM25 で選んだパッセージを質問応答モデルで読み、答えの範囲を返す（has_reader のときだけ呼ぶこと）
+    # 同時に届いた質問のウィンドウは micro_batch でまとめて読む
+    def read(self, question):
+        reader = self.loader.future.result().reader
+        result = self.reader_batcher.submit((question, reader.retrieve(question) or None)).result()
+        passage = result["passage"]
+        return {"answer": result["answer"] or None, "score": result["score"],
+                "section": reader.passages[passage].section if passage is not None else None}
+
+    # フィードバックを保存し、再起動せずに索引へ反映する
+    def rate(self, question, answer, rating, human_answer=None):
+        with self.lock:
+            entry = save_feedback(question, answer, rating, human_answer, self.feedback_path)
+            self._read_new_feedback()
+        models = self.models()
+        if models is not None:
+            self._flush_pending(models)
+        return entry
+
+    def health(self):
+        with self.lock:
+            health = {"feedback_questions": len(self.exact_index), "exact_match": str(self.exact_index.stats),
+                      "pending_feedback": len(self.pending_feedback)}
+        status = self.models_status
+        health = {"status": "degraded" if status == "failed" else "ok", "models": status,
+                  "uptime_seconds": round(time.perf_counter() - self.started, 1), **health}
+        if status == "failed":
+            health["error"] = repr(self.loader.future.exception())
+        elif status == "ready":
+            models = self.models()
+            health["query_cache"] = str(models.retriever.query_cache)
+            health["average_batch_size"] = round(self.encoder.average_batch_size, 2)
+            if models.reranker is not None:
+                health["reranker"] = str(models.reranker.stats)
+            if self.reader_batcher is not None:
+                health["average_read_batch_size"] = round(self.reader_batcher.average_batch_size, 2)
+        return health
+
+    def close(self):
+        for batcher in (self.encoder, self.reader_batcher):
+            if batcher is not None:
+                batcher.close()
+
+# ChatbotService を HTTP/JSON で公開するハンドラ
+#   GET  /health   サーバとモデルの状態
+#   POST /ask      {"question": "...", "k": 5, "candidates": false}（GET /ask?question=... でもよい）
+#   POST /ask/stream  /ask と同じ引数で、答えが見つかるたびに Server-Sent Events で送る（stream を参照）
+#   POST /rate     {"question": "...", "answer": "...", "rating": 1-5, "human_answer": "..."}
+# モデルを使う処理は executor のスレッドで実行し、イベントループは止めない
+# 同時に実行するのは max_concurrency 件まで。順番待ちが max_pending 件を超えたら 503 を返す
+class ChatbotHandler:
+    def __init__(self, service, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_pending=DEFAULT_MAX_PENDING):
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chatbot")
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_pending = max_pending
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = Counter()
+        # ストリームの開始から最初の回答のイベントを送るまでの秒数（体感の待ち時間）
+        self.first_event_seconds = deque(maxlen=FIRST_EVENT_SAMPLES)
+        self.routes = {("GET", "/health"): self.health, ("GET", "/ask"): self.ask, ("POST", "/ask"): self.ask,
+                       ("GET", "/ask/stream"): self.ask_stream, ("POST", "/ask/stream"): self.ask_stream,
+                       ("POST", "/rate"): self.rate}
+
+    async def __call__(self, request):
+        route = self.routes.get((request.method, request.path))
+        if route is None:
+            if any(path == request.path for _, path in self.routes):
+                raise HttpError(405)
+            raise HttpError(404)
+        return await route(request)
+
+    # fn(*args) を executor のスレッドで実行する
+    async def run(self, fn, *args):
+        if self.semaphore.locked() and self.waiting >= self.max_pending:
+            raise HttpError(503, "混み合っています。しばらくしてからもう一度お試しください")
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    # モデルの読み込みが終わるまで待ち、待った秒数を返す
+    async def wait_for_models(self):
+        loader = self.service.loader
+        if loader is None:
+            return 0.0
+        start = time.perf_counter()
+        if not loader.ready:
+            # 接続が切れて待つのをやめても、読み込み中の Future は取り消さない
+            await asyncio.shield(asyncio.wrap_future(loader.future))
+        if loader.future.exception() is not None:
+            raise HttpError(503, "モデルの読み込みに失敗しました")
+        return time.perf_counter() - start
+
+    # /ask と /ask/stream の引数 (質問, k, 候補も返すか)
+    def question_args(self, request):
+        payload = request_json(request) if request.method == "POST" else {
+            name: values[-1] for name, values in request.query.items()}
+        question = payload.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise HttpError(400, "question を指定してください")
+        try:
+            k = int(payload.get("k", 5))
+        except (TypeError, ValueError):
+            raise HttpError(400, "k は整数で指定してください")
+        if not 1 <= k <= MAX_CANDIDATES:
+            raise HttpError(400, f"k は1から{MAX_CANDIDATES}の範囲で指定してください")
+        return question, k, payload.get("candidates") not in (None, False, "", "0", "false")
+
+    # 回答が見つからなかったときは、--qa-reader ならパッセージから読み取った範囲を返す（learndata4 と同じ順番）
+    async def ask(self, request):
+        question, k, with_candidates = self.question_args(request)
+        start = time.perf_counter()
+        waited = 0.0
+        candidates = []
+        answer, source, score = await self.run(self.service.quick, question)
+        if source is None:
+            waited = await self.wait_for_models()
+            result, source = await self.run(self.service.search, question, k)
+            candidates = result.candidates
+            answer = result.best.text if result.best is not None else None
+            score = candidates[0].score if candidates else 0.0
+            if answer is None and self.service.has_reader:
+                read = await self.run(self.service.read, question)
+                answer, source, score = read["answer"], "reader", read["score"]
+        self.requests[source if answer is not None else "unanswered"] += 1
+
+        response = {"question": question, "answer": answer, "source": source, "score": round(float(score), 4),
+                    "seconds": round(time.perf_counter() - start, 4), "waited_seconds": round(waited, 4)}
+        if with_candidates:
+            response["candidates"] = candidate_list(candidates)
+        return 200, response
+
+    async def ask_stream(self, request):
+        question, k, with_candidates = self.question_args(request)
+        return 200, EventStream(self.stream(question, k, with_candidates))
+
+    # 速く求まる答えから順に answer イベントで送る。どのイベントにも source（答えの出どころ）と score を付ける
+    #   1. 完全一致 (exact) かキーワード検索 (lexical) の答え。完全一致なら評価済みの回答なので、ここで終える
+    #   2. 埋め込みの検索 (dense / reranked) の答え（モデルの読み込み中なら、先に status イベントを送る）
+    #   3. --qa-reader なら、質問応答モデルがパッセージから読み取った範囲 (reader)
+    # 最後に done イベントで、最初の answer イベントまでの秒数と全体の秒数を送る
+    async def stream(self, question, k, with_candidates):
+        start = time.perf_counter()
+        first_event = None
+
+        def answer_event(source, answer, score, **extra):
+            nonlocal first_event
+            seconds = time.perf_counter() - start
+            if first_event is None:
+                first_event = seconds
+                self.first_event_seconds.append(seconds)
+            return "answer", {"question": question, "source": source, "answer": answer, "score": round(float(score), 4),
+                              "seconds": round(seconds, 4), **extra}
+
+        answer, source, score = await self.run(self.service.quick, question)
+        if source is not None:
+            yield answer_event(source, answer, score)
+        # lexical_only ではキーワード検索の答えがそのまま最終的な答え
+        if source != "exact" and not (source is not None and self.service.loader is None):
+            if self.service.models_status == "loading":
+                yield "status", {"models": "loading", "seconds": round(time.perf_counter() - start, 4)}
+            await self.wait_for_models()
+            result, source = await self.run(self.service.search, question, k)
+            candidates = result.candidates
+            extra = {"candidates": candidate_list(candidates)} if with_candidates else {}
+            yield answer_event(source, result.best.text if result.best is not None else None,
+                               candidates[0].score if candidates else 0.0, **extra)
+            if self.service.has_reader:
+                read = await self.run(self.service.read, question)
+                yield answer_event("reader", read["answer"], read["score"], section=read["section"])
+        self.requests["stream"] += 1
+        yield "done", {"first_event_seconds": round(first_event, 4) if first_event is not None else None,
+                       "seconds": round(time.perf_counter() - start, 4)}
+
+    async def rate(self, request):
+        payload = request_json(request)
+        question, answer = payload.get("question"), payload.get("answer")
+        rating, human_answer = payload.get("rating"), payload.get("human_answer")
+        if not isinstance(question, str) or not question.strip():
+            raise HttpError(400, "question を指定してください")
+        if answer is not None and not isinstance(answer, str):
+            raise HttpError(400, "answer は文字列で指定してください")
+        if isinstance(rating, bool) or not isinstance(rating, int) or not 1 <= rating <= 5:
+            raise HttpError(400, "rating は1から5の整数で指定してください")
+        if human_answer is not None and not isinstance(human_answer, str):
+            raise HttpError(400, "human_answer は文字列で指定してください")
+        entry = await self.run(self.service.rate, question, answer, rating, human_answer or None)
+        self.requests["rate"] += 1
+        return 200, {"saved": True, "feedback": entry}
+
+    # 混み合っていても答えられるよう、同時実行数の制限は受けない
+    async def health(self, request):
+        health = await asyncio.get_running_loop().run_in_executor(None, self.service.health)
+        health.update(pid=os.getpid(), in_flight=self.in_flight, waiting=self.waiting, requests=dict(self.requests))
+        if self.first_event_seconds:
+            seconds = np.array(self.first_event_seconds)
+            health["time_to_first_event_ms"] = {"count": len(seconds),
+                                                "p50": round(float(np.percentile(seconds, 50)) * 1000, 2),
+                                                "p95": round(float(np.percentile(seconds, 95)) * 1000, 2)}
+        return 200, health
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def candidate_list(candidates):
+    return [{"id": candidate.id, "source": candidate.source, "score": round(float(candidate.score), 4)}
+            for candidate in candidates]
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                max_pending=DEFAULT_MAX_PENDING, sock=None, log=print):
+    handler = ChatbotHandler(service, max_concurrency, max_pending)
+    server = JsonHttpServer(handler)
+    try:
+        await server.start(host, port, sock)
+        for listening in server.server.sockets:
+            address = listening.getsockname()
+            log(f"http://{address[0]}:{address[1]} で待ち受けています (同時実行 {max_concurrency}, 順番待ち {max_pending})")
+        async with server.server:
+            await server.server.serve_forever()
+    finally:
+        handler.close()
+        log(f"リクエスト: {dict(handler.requests)}")
+
+# HTTP サーバの起動オプション（runtime_options の共通の引数に、待ち受けと同時実行数の引数を足したもの）
+def server_parser(description="沼津高専チャットボットの HTTP サーバ"):
+    parser = runtime_parser(description)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--feedback", default="data/feedback.json",
+                        help="評価を読み込み、/rate の評価を追記するファイル（試すときは一時ファイルを指定する）")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="同時に処理する質問の数")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="順番を待てる質問の数 (超えたら 503 を返す)")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="1回の推論にまとめる質問の最大数")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="質問が揃うのを待つ最大時間")
+    parser.add_argument("--lexical-only", action="store_true",
+                        help="埋め込みのモデルを読み込まず、完全一致とキーワード検索だけで答える")
+    parser.add_argument("--qa-reader", action="store_true",
+                        help="質問応答モデルも読み込み、パッセージから答えの範囲を読み取る (/ask/stream の最後のイベント)")
+    return parser
+
+def service_from_args(args):
+    if args.profile_startup:
+        PROFILE.enable()
+    service = ChatbotService(args.feedback, lexical_only=args.lexical_only, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                             precision=args.precision, backend=args.backend, query_encoder=args.query_encoder,
+                             projection_dim=args.projection_dim, projection_mode=args.projection,
+                             reranker_name=args.reranker, rerank_budget_ms=args.rerank_budget_ms,
+                             mmap_weights=args.mmap_weights, qa_reader=args.qa_reader)
+    if args.lexical_only and PROFILE.enabled:
+        PROFILE.report()
+    return service
+
+# チャットボットを HTTP サーバとして起動する（例: python chatbot_server.py --port 8000 --precision int8）
+# 使い方は chatbot_client.py を参照。複数のプロセスで待ち受けるには prefork_server.py を使う
+# /rate を手元で試すときは、data/feedback.json に評価が残らないよう --feedback でコピーを指定する
+# 例: cp data/feedback.json /tmp/feedback.json && python chatbot_server.py --feedback /tmp/feedback.json
+def main():
+    args = server_parser().parse_args()
+    service = service_from_args(args)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.max_concurrency, args.max_pending))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"完全一致による高速応答: {service.exact_index.stats}")
+        service.close()
+
+if __name__ == "__main__":
+    main()
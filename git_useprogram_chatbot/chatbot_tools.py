@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import sys
+import time
+from exact_match import normalize_question, rated_answer
+from learndata7 import load_feedback_data
+
+# チャットボットの保守用のツール（フィードバックの書き出し・保存した索引の確認）
+# どちらも torch や transformers を読み込まないので、すぐに起動する
+#   python chatbot_tools.py export-feedback --output feedback_export.json
+#   python chatbot_tools.py inspect-index data/embedding_cache feedback_index.npz
+
+# フィードバックを質問（正規化した質問文）ごとに1件にまとめ、最も評価の高い回答を書き出す
+# 同じ評価なら新しい回答を優先する（exact_match.ExactMatchIndex と同じ規則）
+def export_feedback(feedback_path, output, min_rating=0):
+    best = {}
+    for entry in load_feedback_data(feedback_path):
+        question = entry.get("question", "")
+        key = normalize_question(question)
+        answer, rating = rated_answer(entry)
+        if not key or not answer:
+            continue
+        current = best.get(key)
+        if current is None or rating >= current["rating"]:
+            best[key] = {"question": question, "answer": answer, "rating": rating}
+    exported = [entry for entry in best.values() if entry["rating"] >= min_rating]
+
+    if output == "-":
+        json.dump(exported, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(exported, file, ensure_ascii=False, indent=2)
+        print(f"{len(exported)} 件の質問を {output} に書き出しました")
+    return exported
+
+# 埋め込みキャッシュのディレクトリ（名前空間ごとの manifest.json）の中身を表示する
+def inspect_embedding_cache(path):
+    for namespace in sorted(os.listdir(path)):
+        manifest_path = os.path.join(path, namespace, "manifest.json")
+        if not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        files = {name for name, _ in manifest["entries"].values()}
+        print(f"{namespace}: {len(manifest['entries'])} 件, {manifest['dim']} 次元, ファイル {len(files)} 個")
+        print(f"  モデル: {manifest['key'].get('model')} / トークナイザ: {manifest['key'].get('tokenizer')}")
+
+# 保存したインデックス（ann_index.load_index で読めるもの）の種類・次元・件数を表示する
+def inspect_saved_index(path):
+    from ann_index import load_index
+    index = load_index(path)
+    print(f"{path}: {index.kind}, {index.dim} 次元, {len(index)} 件, {os.path.getsize(path) / 1024 ** 2:.2f} MB")
+    projection = getattr(index, "projection", None)
+    if projection is not None:
+        print(f"  次元削減: {projection} / 内側のインデックス: {index.index.kind}")
+
+def inspect_index(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            inspect_embedding_cache(path)
+        else:
+            inspect_saved_index(path)
+
+def main():
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(description="沼津高専チャットボットの保守用ツール")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export-feedback", help="フィードバックを質問ごとに1件にまとめて書き出す")
+    export.add_argument("--feedback", default="data/feedback.json")
+    export.add_argument("--output", default="-", help="書き出し先 (- なら標準出力)")
+    export.add_argument("--min-rating", type=int, default=0, help="この評価未満の回答は書き出さない")
+    inspect = commands.add_parser("inspect-index", help="埋め込みキャッシュや保存したインデックスの中身を表示する")
+    inspect.add_argument("paths", nargs="+", help="埋め込みキャッシュのディレクトリ、またはインデックスの .npz")
+    args = parser.parse_args()
+
+    if args.command == "export-feedback":
+        export_feedback(args.feedback, args.output, args.min_rating)
+    else:
+        inspect_index(args.paths)
+    print(f"[{time.perf_counter() - start:.2f} 秒]", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
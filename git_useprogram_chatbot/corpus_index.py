@@ -0,0 +1,65 @@
+import numpy as np
+from ann_index import normalize_rows, top_k_batch
+from encoder import DEFAULT_BATCH_SIZE, encode_texts
+
+# セクションのタイトル・内容の埋め込みを起動時に一度だけ計算して保持するインデックス
+# projection (projection.Projection) があれば、行列は次元削減した空間のもので、質問ベクトルも同じ変換を通してから比べる
+class CorpusIndex:
+    def __init__(self, sections, contents, sources, title_matrix, content_matrix, projection=None):
+        self.sections = sections
+        self.contents = contents
+        self.sources = sources
+        self.projection = projection
+        # 正規化済みの連続した行列として保持し、内積だけでコサイン類似度を求める
+        self.title_matrix = np.ascontiguousarray(normalize_rows(title_matrix))
+        self.content_matrix = np.ascontiguousarray(normalize_rows(content_matrix))
+        # (ソース, セクション) から行番号を引く（キーワード検索だけで見つかった候補の類似度を求めるため）
+        self.rows = {(source, section): i for i, (source, section) in enumerate(zip(sources, sections))}
+
+    def __len__(self):
+        return len(self.sections)
+
+    # 質問ベクトルを索引の空間に写して正規化する
+    def _queries(self, question_embeddings):
+        if self.projection is not None:
+            question_embeddings = self.projection.transform(question_embeddings)
+        return normalize_rows(np.reshape(question_embeddings, (-1, self.title_matrix.shape[1])))
+
+    # 同じセクションを次元削減した索引を返す（行列は正規化済みの元の埋め込みとして変換する）
+    def project(self, projection):
+        return CorpusIndex(self.sections, self.contents, self.sources, projection.transform(self.title_matrix),
+                           projection.transform(self.content_matrix), projection)
+
+    # 質問ベクトルとの (タイトル類似度, 内容類似度) を全セクション分まとめて返す
+    def scores(self, question_embedding):
+        query = self._queries(question_embedding)[0]
+        return self.title_matrix @ query, self.content_matrix @ query
+
+    # 1つのセクションについて search と同じスコア（タグ・内容の高い方）を返す。索引にないセクションなら None
+    def similarity(self, question_embedding, source, section):
+        row = self.rows.get((source, section))
+        if row is None:
+            return None
+        query = self._queries(question_embedding)[0]
+        return float(max(self.title_matrix[row] @ query, self.content_matrix[row] @ query))
+
+    # 質問ベクトルの行列 (質問数, 次元) に対し、タグ・内容の高い方をセクションのスコアとして上位 k 件を返す
+    # 戻り値は (スコア, セクション番号) でいずれも (質問数, k)
+    def search(self, question_embeddings, k=5):
+        queries = self._queries(question_embeddings)
+        scores = np.maximum(queries @ self.title_matrix.T, queries @ self.content_matrix.T)
+        return top_k_batch(scores, k)
+
+# 複数のデータソース [(ソース名, {セクション: 内容}), ...] からインデックスを構築する
+def build_corpus_index(sources, tokenizer, model, batch_size=DEFAULT_BATCH_SIZE, report=None, projection=None):
+    sections, contents, source_tags = [], [], []
+    for source, data in sources:
+        for section, content in data.items():
+            sections.append(section)
+            contents.append(content)
+            source_tags.append(source)
+
+    title_matrix = encode_texts(sections, tokenizer, model, batch_size, report, truncation=True)
+    content_matrix = encode_texts(contents, tokenizer, model, batch_size, report, truncation=True, max_length=512)
+    corpus_index = CorpusIndex(sections, contents, source_tags, title_matrix, content_matrix)
+    return corpus_index if projection is None else corpus_index.project(projection)
@@ -0,0 +1,84 @@
+import argparse
+import time
+import numpy as np
+from bench_ann import format_latency
+from student_encoder import DISTILL_EPOCHS, STUDENT_DIM, STUDENT_LAYERS, StudentEncoder, distill, distillation_texts
+
+DEFAULT_STUDENT_PATH = "data/student_encoder.npz"
+
+# 質問を1件ずつベクトル化したときの遅延
+def query_latencies(questions, tokenizer, model):
+    from encoder import encode_texts
+
+    latencies = np.empty(len(questions))
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        encode_texts([question], tokenizer, model)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+# 教師の埋め込みで作ったコーパスの索引を、生徒で質問をベクトル化して検索したときの上位1件の一致率
+def top1_agreement(corpus_index, teacher_embeddings, student_embeddings):
+    _, teacher_top1 = corpus_index.search(teacher_embeddings, 1)
+    _, student_top1 = corpus_index.search(student_embeddings, 1)
+    return float(np.mean(teacher_top1[:, 0] == student_top1[:, 0])) if len(teacher_top1) else 0.0
+
+# 教師（xlm-roberta-base）から質問用の小さなエンコーダを蒸留して保存し、速度と検索結果の一致率を報告する
+# フィードバックの質問の一部 (--holdout) は学習に使わず、未知の質問での一致率も確かめる
+def main():
+    from transformers import AutoModel, AutoTokenizer
+    from corpus_index import build_corpus_index
+    from encoder import encode_texts
+    from learndata7 import load_feedback_data, load_json_data
+
+    parser = argparse.ArgumentParser(description="質問用エンコーダの蒸留")
+    parser.add_argument("--teacher", default="xlm-roberta-base")
+    parser.add_argument("--output", default=DEFAULT_STUDENT_PATH)
+    parser.add_argument("--dim", type=int, default=STUDENT_DIM)
+    parser.add_argument("--layers", type=int, default=STUDENT_LAYERS)
+    parser.add_argument("--epochs", type=int, default=DISTILL_EPOCHS)
+    parser.add_argument("--holdout", type=float, default=0.2, help="学習に使わないフィードバックの質問の割合")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sources = [("Wikipedia", load_json_data("data/wikipedia_sections.json")),
+               ("推薦選抜", load_json_data("data/numazu_recommendation_selection_retry.json"))]
+    questions = list(dict.fromkeys(entry.get("question", "") for entry in load_feedback_data("data/feedback.json")))
+    order = np.random.default_rng(args.seed).permutation(len(questions))
+    holdout_size = int(len(questions) * args.holdout)
+    holdout = [questions[i] for i in order[:holdout_size]]
+    training = [questions[i] for i in order[holdout_size:]]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.teacher, use_fast=False)
+    teacher = AutoModel.from_pretrained(args.teacher).eval()
+    texts = distillation_texts(sources, training)
+    holdout_set = set(holdout)
+    texts = [text for text in texts if text not in holdout_set]
+    student, losses = distill(teacher, tokenizer, texts, args.dim, args.layers, epochs=args.epochs, seed=args.seed)
+    student.save(args.output)
+    student = StudentEncoder.load(args.output)
+    print(f"保存しました: {args.output}")
+
+    corpus_index = build_corpus_index(sources, tokenizer, teacher)
+    teacher_params = sum(parameter.numel() for parameter in teacher.parameters())
+    print(f"\nパラメータ数: 教師 {teacher_params / 1e6:.1f} M / 生徒 {student.parameter_count / 1e6:.1f} M")
+
+    teacher_latencies = query_latencies(questions, tokenizer, teacher)
+    student_latencies = query_latencies(questions, tokenizer, student)
+    print(f"質問のベクトル化  教師 {format_latency(teacher_latencies)}")
+    print(f"                  生徒 {format_latency(student_latencies)}")
+    print(f"高速化: {np.median(teacher_latencies) / np.median(student_latencies):.1f} 倍 (中央値)")
+
+    for name, subset in (("学習に使った質問", training), ("学習に使っていない質問", holdout), ("フィードバック全体", questions)):
+        if not subset:
+            continue
+        teacher_embeddings = encode_texts(subset, tokenizer, teacher)
+        student_embeddings = encode_texts(subset, tokenizer, student)
+        cosine = np.sum(teacher_embeddings * student_embeddings, axis=1) / (
+            np.linalg.norm(teacher_embeddings, axis=1) * np.linalg.norm(student_embeddings, axis=1) + 1e-12)
+        print(f"{name} {len(subset)} 件: 上位1件の一致率 "
+              f"{top1_agreement(corpus_index, teacher_embeddings, student_embeddings):.1%}  "
+              f"教師とのコサイン類似度 平均 {cosine.mean():.4f}")
+
+if __name__ == "__main__":
+    main()
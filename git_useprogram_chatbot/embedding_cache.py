@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# ジャーナルへの追記は fcntl のファイルロックで複数のプロセスの間でも1つずつ行う（fcntl のない Windows ではロックしない）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MANIFEST_NAME = "manifest.json"
+# 追記用のジャーナル（ベクトルは生の float32、キーは1行1件の JSON）
+JOURNAL_VECTORS_NAME = "journal.f32"
+JOURNAL_ENTRIES_NAME = "journal.jsonl"
+JOURNAL_LOCK_NAME = "journal.lock"
+# ジャーナルがこの件数を超えたらガベージコレクション時にシャードへまとめる
+JOURNAL_COMPACT_ROWS = 10000
+
+# テキストのSHA-256ハッシュ（キャッシュのキー）
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# 埋め込みを (モデル名, トークナイザ設定, プーリング方法, テキストのハッシュ) をキーにディスクへ保存するキャッシュ
+# 新しいベクトルはジャーナルに O(1) で追記し、ガベージコレクション時に .npy のシャードへまとめる
+# シャードもジャーナルも読み込み時は mmap で開く
+# 同じディレクトリを複数のプロセス（prefork のワーカーなど）で使ってよい。読み書きはファイルロックの中で行い、
+# 他のプロセスが追記した行も読み込んでから書くので、行番号が重ならず、同じテキストを二重に書かない
+# まとめ直し (compact) のたびにマニフェストの generation を増やし、他のプロセスはそれを見て全体を読み直す
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_name, tokenizer_settings=None, pooling="mean"):
+        self.key = {"model": model_name, "tokenizer": tokenizer_settings or {}, "pooling": pooling}
+        key_json = json.dumps(self.key, sort_keys=True, ensure_ascii=False)
+        namespace = hashlib.sha256(key_json.encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(cache_dir, namespace)
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        self.journal_vectors_path = os.path.join(self.directory, JOURNAL_VECTORS_NAME)
+        self.journal_entries_path = os.path.join(self.directory, JOURNAL_ENTRIES_NAME)
+        self.lock_path = os.path.join(self.directory, JOURNAL_LOCK_NAME)
+        # ファイルロックは同じプロセスの中では入れ子にできないので、取った回数を数える
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        # 最後に読み込んだときのマニフェストのファイルの状態（変わっていたら読み直す）
+        self._manifest_stat = None
+        self.manifest = self._load_manifest()
+        self._shards = {}
+        self.journal_rows = 0
+        # journal.jsonl のどこまでを読み込んだか（バイト数）
+        self.journal_offset = 0
+        self._load_journal()
+
+    # トークナイザとモデルの設定からキャッシュを作る
+    # fp32 以外の精度で推論したベクトルは値が少し異なるので、精度ごとに別の名前空間にする
+    @classmethod
+    def for_model(cls, cache_dir, tokenizer, model, pooling="mean", precision="fp32", **tokenizer_kwargs):
+        tokenizer_settings = {
+            "class": type(tokenizer).__name__,
+            "name": getattr(tokenizer, "name_or_path", ""),
+            **tokenizer_kwargs,
+        }
+        model_name = getattr(model, "name_or_path", type(model).__name__)
+        if precision != "fp32":
+            model_name = f"{model_name} ({precision})"
+        return cls(cache_dir, model_name, tokenizer_settings, pooling)
+
+    def __len__(self):
+        return len(self.manifest["entries"])
+
+    def __contains__(self, text):
+        return text_hash(text) in self.manifest["entries"]
+
+    def _stat_manifest(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load_manifest(self):
+        # 読む前の状態を覚える（読んだ後に置き換えられたら、次の _refresh_journal で読み直す）
+        self._manifest_stat = self._stat_manifest()
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            if manifest.get("key") == self.key:
+                return manifest
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as e:
+            print(f"キャッシュのマニフェストが壊れているため作り直します ({self.manifest_path}):", e)
+        return {"key": self.key, "dim": None, "next_shard": 0, "generation": 0, "entries": {}}
+
+    # 書き込み途中で落ちても壊れないよう、一時ファイルに書いてから置き換える
+    def _save_manifest(self):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, ensure_ascii=False)
+        os.replace(temp_path, self.manifest_path)
+        self._manifest_stat = self._stat_manifest()
+
+    # ジャーナルに記録されたエントリを読み込む（ベクトルが書き切れていない行は無視する）
+    def _load_journal(self):
+        with self._journal_lock():
+            self._refresh_journal()
+            if not self.manifest["dim"]:
+                # マニフェストを作り直した場合、残っているジャーナルは使えない
+                for path in (self.journal_vectors_path, self.journal_entries_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    # 他のプロセスがマニフェストを書き換えていたら読み直す。まとめ直されていた (generation が変わった) ときや、
+    # 自分がまだ次元数を知らないときは、覚えているエントリとジャーナルの位置を捨てて最初から読み直す
+    def _reload_manifest(self):
+        if self._stat_manifest() == self._manifest_stat:
+            return
+        generation, dim = self.manifest.get("generation", 0), self.manifest["dim"]
+        manifest = self._load_manifest()
+        if manifest.get("generation", 0) != generation or dim is None:
+            self.manifest = manifest
+            self._shards = {}
+            self.journal_rows = 0
+            self.journal_offset = 0
+
+    # 前回から journal.jsonl に追記された行（他のプロセスが書いたものを含む）を読み込む。_journal_lock の中で呼ぶ
+    def _refresh_journal(self):
+        self._reload_manifest()
+        dim = self.manifest["dim"]
+        if not dim or not os.path.exists(self.journal_vectors_path):
+            return
+        self.journal_rows = os.path.getsize(self.journal_vectors_path) // (4 * dim)
+        try:
+            with open(self.journal_entries_path, 'rb') as file:
+                file.seek(self.journal_offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        # 書き込み途中の行は次に回す
+        data = data[:data.rfind(b"\n") + 1]
+        self.journal_offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record["row"] < self.journal_rows:
+                self.manifest["entries"][record["hash"]] = [JOURNAL_VECTORS_NAME, record["row"]]
+
+    # キャッシュのファイルを読み書きする間、他のプロセスを待たせる（同じプロセスの中では入れ子にできる）
+    @contextmanager
+    def _journal_lock(self):
+        with self._lock:
+            if fcntl is None or self._lock_depth > 0:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_path, "a") as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _shard(self, name):
+        if name == JOURNAL_VECTORS_NAME:
+            # ジャーナルは追記で伸びるので、行数が変わったら開き直す
+            journal = self._shards.get(name)
+            if journal is None or len(journal) != self.journal_rows:
+                journal = np.memmap(self.journal_vectors_path, dtype=np.float32, mode="r",
+                                    shape=(self.journal_rows, self.manifest["dim"]))
+                self._shards[name] = journal
+            return journal
+        if name not in self._shards:
+            self._shards[name] = np.load(os.path.join(self.directory, name), mmap_mode="r")
+        return self._shards[name]
+
+    # 新しいベクトルをジャーナルの末尾に追記する。既存のデータは読み書きしないので件数によらず O(追加件数)
+    # 行番号は自分が覚えている件数ではなく、ロックを取ってからのファイルの大きさから決める
+    def _append_journal(self, hashes, vectors):
+        with self._journal_lock():
+            # 他のプロセスが先に最初のベクトルを書いていれば、その次元数を使う
+            self._refresh_journal()
+            if self.manifest["dim"] is None:
+                self.manifest["dim"] = int(vectors.shape[1])
+                self._save_manifest()
+            # 他のプロセスが先に書いたテキストは書かない
+            new = [i for i, digest in enumerate(hashes) if digest not in self.manifest["entries"]]
+            if not new:
+                return
+            hashes, vectors = [hashes[i] for i in new], vectors[new]
+            row_bytes = 4 * self.manifest["dim"]
+            # ベクトルを先に書き、キーは後から書く（途中で落ちてもキーが欠けたベクトルが残るだけ）
+            with open(self.journal_vectors_path, "ab") as file:
+                # 書き込み途中で落ちた行の残りは切り捨て、行の区切りから書き始める
+                first_row = file.tell() // row_bytes
+                file.truncate(first_row * row_bytes)
+                file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.journal_entries_path, "a", encoding="utf-8") as file:
+                for offset, digest in enumerate(hashes):
+                    row = first_row + offset
+                    file.write(json.dumps({"hash": digest, "row": row}) + "\n")
+                    self.manifest["entries"][digest] = [JOURNAL_VECTORS_NAME, row]
+            self.journal_rows = first_row + len(hashes)
+            self.journal_offset = os.path.getsize(self.journal_entries_path)
+
+    # 新しいベクトルを1つのシャードとして書き出す（既存のシャードは書き換えない）
+    def _write_shard(self, hashes, vectors):
+        name = f"shard_{self.manifest['next_shard']:06d}.npy"
+        np.save(os.path.join(self.directory, name), vectors)
+        self.manifest["next_shard"] += 1
+        self.manifest["dim"] = int(vectors.shape[1])
+        for row, digest in enumerate(hashes):
+            self.manifest["entries"][digest] = [name, row]
+
+    def _lookup(self, hashes):
+        dim = self.manifest["dim"] or 0
+        matrix = np.empty((len(hashes), dim), dtype=np.float32)
+        for i, digest in enumerate(hashes):
+            name, row = self.manifest["entries"][digest]
+            matrix[i] = self._shard(name)[row]
+        return matrix
+
+    # キャッシュにあるテキストの埋め込みを {テキスト: ベクトル} で返す（ないテキストは含めない）
+    # 他のプロセスが追記したものも返す
+    def get(self, texts):
+        with self._journal_lock():
+            self._refresh_journal()
+            found = [text for text in dict.fromkeys(texts) if text_hash(text) in self.manifest["entries"]]
+            return dict(zip(found, self._lookup([text_hash(text) for text in found])))
+
+    # 計算済みの埋め込みを追記する（キャッシュにあるテキストは書き込まない）
+    def add(self, texts, vectors):
+        new = {}
+        for text, vector in zip(texts, vectors):
+            new.setdefault(text_hash(text), vector)
+        if new:
+            self._append_journal(list(new), np.asarray(list(new.values()), dtype=np.float32))
+
+    # テキストの埋め込みを返す。キャッシュにないテキストだけ encode_fn(テキストのリスト) で計算して追記する
+    # 計算している間はロックを取らない
+    def get_or_encode(self, texts, encode_fn):
+        hashes = [text_hash(text) for text in texts]
+        missing = {}
+        with self._journal_lock():
+            self._refresh_journal()
+            for text, digest in zip(texts, hashes):
+                if digest not in self.manifest["entries"] and digest not in missing:
+                    missing[digest] = text
+
+        if missing:
+            vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            self._append_journal(list(missing), vectors)
+            cached = len(set(hashes)) - len(missing)
+            print(f"埋め込みキャッシュ: {len(missing)} 件を新たに計算しました（キャッシュ済み {cached} 件）")
+        with self._journal_lock():
+            self._refresh_journal()
+            return self._lookup(hashes)
+
+    # 現在のテキスト集合に含まれないエントリを削除し、残りを1つのシャードにまとめ直す
+    def garbage_collect(self, live_texts):
+        live = {text_hash(text) for text in live_texts}
+        with self._journal_lock():
+            self._refresh_journal()
+            stale = [digest for digest in self.manifest["entries"] if digest not in live]
+            if stale or self.journal_rows > JOURNAL_COMPACT_ROWS:
+                self.compact(live)
+        return len(stale)
+
+    # ジャーナルとシャードを1つのシャードにまとめる（live を指定したらそのハッシュだけを残す）
+    # generation を増やし、同じディレクトリを使う他のプロセスに読み直させる
+    def compact(self, live=None):
+        with self._journal_lock():
+            self._refresh_journal()
+            entries = self.manifest["entries"]
+            keep = [digest for digest in entries if live is None or digest in live]
+            vectors = self._lookup(keep)
+            old_files = {name for name, _ in entries.values()} - {JOURNAL_VECTORS_NAME}
+            self._shards = {}
+            self.manifest["entries"] = {}
+            self.manifest["generation"] = self.manifest.get("generation", 0) + 1
+            if keep:
+                self._write_shard(keep, vectors)
+            self._save_manifest()
+
+            # マニフェストを書き換えてからジャーナルと古いシャードを消す
+            self.journal_rows = 0
+            self.journal_offset = 0
+            for name in sorted(old_files) + [JOURNAL_VECTORS_NAME, JOURNAL_ENTRIES_NAME]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"古いファイルを削除できませんでした ({name}):", e)
@@ -0,0 +1,57 @@
+import time
+import numpy as np
+import torch
+
+DEFAULT_BATCH_SIZE = 32
+
+# エンコードのスループット（テキスト数・トークン数・経過時間）を集計する
+class EncodeReport:
+    def __init__(self):
+        self.texts = 0
+        self.tokens = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    @property
+    def texts_per_second(self):
+        return self.texts / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.texts} 件 / {self.batches} バッチ / {self.tokens} トークン: "
+                f"{self.seconds:.2f} 秒 ({self.texts_per_second:.1f} 件/秒)")
+
+# パディング部分を除いたトークンだけで平均を取る
+def masked_mean_pooling(last_hidden_state, attention_mask):
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1)
+    return summed / counts
+
+# テキストのリストをまとめてベクトル化し、(テキスト数, 次元) の float32 行列を返す
+# 長さ順に並べてから batch_size ごとにパディングするので、同じバッチ内の無駄なパディングが少ない
+def encode_texts(texts, tokenizer, model, batch_size=DEFAULT_BATCH_SIZE, report=None, **tokenizer_kwargs):
+    start = time.perf_counter()
+    embeddings = np.empty((len(texts), model.config.hidden_size), dtype=np.float32)
+    if not texts:
+        return embeddings
+
+    # トークナイズは全テキストで一度だけ行い、バッチごとには pad だけをかける
+    encoded = tokenizer(list(texts), **tokenizer_kwargs)["input_ids"]
+    order = sorted(range(len(texts)), key=lambda i: len(encoded[i]), reverse=True)
+
+    batches = 0
+    with torch.inference_mode():
+        for begin in range(0, len(order), batch_size):
+            indices = order[begin:begin + batch_size]
+            batch = tokenizer.pad({"input_ids": [encoded[i] for i in indices]}, return_tensors="pt")
+            outputs = model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"])
+            pooled = masked_mean_pooling(outputs.last_hidden_state, batch["attention_mask"])
+            embeddings[indices] = pooled.float().numpy()
+            batches += 1
+
+    if report is not None:
+        report.texts += len(texts)
+        report.tokens += sum(len(ids) for ids in encoded)
+        report.batches += batches
+        report.seconds += time.perf_counter() - start
+    return embeddings
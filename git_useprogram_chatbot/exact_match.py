@@ -0,0 +1,81 @@
+import unicodedata
+
+# 回答の評価が不明なときの値と、高速パスで返してよい最低評価
+DEFAULT_RATING = 3
+MIN_RATING = 3
+# 人が入力した改善回答は最も信頼できるものとして扱う
+HUMAN_ANSWER_RATING = 5
+
+# 質問文を比較用に正規化する
+# NFKC で全角英数字・半角カナなどを統一し、小文字化した上で空白と句読点・記号を取り除く
+def normalize_question(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        char for char in text
+        if not char.isspace() and not unicodedata.category(char).startswith(("P", "S"))
+    )
+
+# フィードバック1件の (回答, 評価)
+def rated_answer(entry):
+    human_answer = entry.get("human_answer")
+    if human_answer:
+        return human_answer, HUMAN_ANSWER_RATING
+    rating = entry.get("rating")
+    return entry.get("bot_answer"), DEFAULT_RATING if rating is None else rating
+
+# 高速パスのヒット率と、それによって省けたモデルの処理時間の見積もり
+class ExactMatchStats:
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.model_queries = 0
+        self.model_seconds = 0.0
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    # ヒットした質問がモデルを通った場合の平均時間で見積もる
+    @property
+    def saved_seconds(self):
+        if not self.model_queries:
+            return 0.0
+        return self.hits * self.model_seconds / self.model_queries
+
+    def record_model_time(self, seconds):
+        self.model_queries += 1
+        self.model_seconds += seconds
+
+    def __str__(self):
+        return (f"{self.hits}/{self.lookups} 件ヒット (ヒット率 {self.hit_rate:.1%}), "
+                f"省いたモデル処理 約 {self.saved_seconds:.2f} 秒")
+
+# 正規化した質問文から最も評価の高い回答を引くハッシュ索引（トークナイザやモデルより先に参照する）
+class ExactMatchIndex:
+    def __init__(self, feedback_data=()):
+        self.answers = {}
+        self.stats = ExactMatchStats()
+        for entry in feedback_data:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.answers)
+
+    # フィードバックを追加する。同じ評価なら新しい回答を優先する
+    def add(self, entry):
+        key = normalize_question(entry.get("question", ""))
+        answer, rating = rated_answer(entry)
+        if not key or not answer:
+            return
+        current = self.answers.get(key)
+        if current is None or rating >= current[1]:
+            self.answers[key] = (answer, rating)
+
+    # 一致する質問があり、回答の評価が十分なら回答を返す。なければ None
+    def lookup(self, question):
+        self.stats.lookups += 1
+        found = self.answers.get(normalize_question(question))
+        if found is None or found[1] < MIN_RATING:
+            return None
+        self.stats.hits += 1
+        return found[0]
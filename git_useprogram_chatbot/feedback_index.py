@@ -0,0 +1,65 @@
+from ann_index import create_index
+
+# フィードバックの質問ベクトルと回答をまとめて保持し、近傍検索で回答を引くインデックス
+class FeedbackIndex:
+    def __init__(self, dim, expected_size=0, kind="auto", **index_params):
+        self.index = create_index(dim, expected_size, kind, **index_params)
+        self.questions = []
+        self.answers = []
+        self.rows = {}
+        # 内容が変わるたびに増える版数（検索結果のキャッシュの無効化に使う）
+        self.version = 0
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __contains__(self, question):
+        return question in self.rows
+
+    # 質問と回答をまとめて追加する。同じ質問がすでにあれば回答だけを置き換える
+    def add_many(self, questions, embeddings, answers):
+        self.version += 1
+        new_rows = []
+        for i, (question, answer) in enumerate(zip(questions, answers)):
+            row = self.rows.get(question)
+            if row is not None:
+                self.answers[row] = answer
+                continue
+            self.rows[question] = len(self.questions)
+            self.questions.append(question)
+            self.answers.append(answer)
+            new_rows.append(i)
+        if new_rows:
+            self.index.add(embeddings[new_rows])
+
+    def add(self, question, embedding, answer):
+        self.add_many([question], embedding.reshape(1, -1), [answer])
+
+    # 登録済みの質問の回答だけを置き換える（ベクトルは同じなので再計算しない）。未登録なら False
+    def update_answer(self, question, answer):
+        row = self.rows.get(question)
+        if row is None:
+            return False
+        self.answers[row] = answer
+        self.version += 1
+        return True
+
+    # 質問ベクトルに近いフィードバックを [(質問, 回答, 類似度), ...] の降順で返す
+    def search(self, question_embedding, k=5):
+        scores, ids = self.index.search(question_embedding, k)
+        return [(self.questions[i], self.answers[i], float(score)) for score, i in zip(scores, ids)]
+
+    # 複数の質問ベクトルについて search をまとめて行う（厳密検索なら1回の行列積）
+    def search_batch(self, question_embeddings, k=5):
+        if not hasattr(self.index, "search_batch"):
+            return [self.search(embedding, k) for embedding in question_embeddings]
+        scores, ids = self.index.search_batch(question_embeddings, k)
+        return [[(self.questions[i], self.answers[i], float(score)) for score, i in zip(row_scores, row_ids)]
+                for row_scores, row_ids in zip(scores, ids)]
+
+    # 閾値を超える最も類似したフィードバックの (回答, 類似度) を返す。なければ (None, 閾値)
+    def best_answer(self, question_embedding, threshold):
+        for _, answer, score in self.search(question_embedding, k=1):
+            if score > threshold:
+                return answer, score
+        return None, threshold
@@ -0,0 +1,213 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+import numpy as np
+import torch
+from runtime_options import BACKENDS, DEFAULT_BACKEND
+
+# コンパイル済みの推論はこの大きさ（バッチ数・系列長）に切り上げてパディングし、形ごとに1回だけ準備する
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+SEQUENCE_BUCKETS = (16, 32, 64, 128, 256, 384, 512)
+# モデルに渡す入力の順番（トレースやエクスポートでは位置引数になる）
+INPUT_ORDER = ("input_ids", "attention_mask", "token_type_ids")
+
+# value 以上で最小のバケット（どのバケットより大きければ value のまま）
+def bucket_size(value, buckets):
+    for bucket in buckets:
+        if bucket >= value:
+            return bucket
+    return value
+
+# 最大 max_batch 件をまとめて推論するときに通りうるバッチのバケット（micro_batch で質問をまとめるサーバー用）
+def batch_buckets_upto(max_batch, buckets=BATCH_BUCKETS):
+    return tuple(bucket for bucket in buckets if bucket < max_batch) + (bucket_size(max_batch, buckets),)
+
+# そのまま model(**inputs) を呼ぶバックエンド（勾配の記録はしない）
+# どのバックエンドも config を持ち、model と同じ呼び出し方・同じ名前の出力で使える
+class EagerBackend:
+    kind = "eager"
+
+    def __init__(self, model):
+        self.model = model.eval()
+        self.config = model.config
+        self.name_or_path = getattr(model, "name_or_path", type(model).__name__)
+
+    def __call__(self, **inputs):
+        with torch.inference_mode():
+            return self.model(**inputs)
+
+# 位置引数で受け取り、出力をタプルで返すようにモデルを包む（トレース・コンパイル・エクスポート用）
+class _PositionalModel(torch.nn.Module):
+    def __init__(self, model, input_names):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    # None の出力（プーリング層の無いエンコーダの pooler_output など）は除く。ModelOutput.keys() の並びと一致する
+    def forward(self, *args):
+        outputs = self.model(**dict(zip(self.input_names, args)), return_dict=False)
+        return tuple(output for output in outputs if output is not None)
+
+# 入力をバケットの形にパディングし、形ごとに準備した実行関数で推論するバックエンドの共通部分
+# 準備に失敗した形は、その形だけ eager で実行する
+class BucketedBackend:
+    kind = None
+
+    def __init__(self, model, batch_buckets=BATCH_BUCKETS, sequence_buckets=SEQUENCE_BUCKETS):
+        self.model = model.eval()
+        self.config = model.config
+        self.name_or_path = getattr(model, "name_or_path", type(model).__name__)
+        self.batch_buckets = batch_buckets
+        self.sequence_buckets = sequence_buckets
+        self.runners = {}
+        self.output_names = {}
+        self.prepare_seconds = 0.0
+
+    # バッチの末尾にはパディングだけの行を足す（先頭トークンだけ見える行にして softmax の計算を安定させる）
+    def _pad(self, inputs, batch, length):
+        padded = []
+        for name in INPUT_ORDER:
+            if name not in inputs:
+                continue
+            tensor = inputs[name]
+            fill = self.config.pad_token_id if name == "input_ids" else 0
+            result = torch.full((batch, length), fill, dtype=tensor.dtype)
+            result[:tensor.shape[0], :tensor.shape[1]] = tensor
+            if name == "attention_mask":
+                result[tensor.shape[0]:, 0] = 1
+            padded.append(result)
+        return padded
+
+    def _prepare(self, key, args, input_names):
+        raise NotImplementedError
+
+    def __call__(self, **inputs):
+        input_names = tuple(name for name in INPUT_ORDER if inputs.get(name) is not None)
+        inputs = {name: inputs[name] for name in input_names}
+        batch, length = inputs["input_ids"].shape
+        shape = (bucket_size(batch, self.batch_buckets), bucket_size(length, self.sequence_buckets))
+        args = self._pad(inputs, *shape)
+
+        key = (shape, input_names)
+        if key not in self.runners:
+            start = time.perf_counter()
+            with torch.inference_mode():
+                # 出力の名前は eager で1回実行して調べる（タプルの並びと同じ順番になる）
+                self.output_names[input_names] = tuple(self.model(**dict(zip(input_names, args))).keys())
+            try:
+                self.runners[key] = self._prepare(key, args, input_names)
+            except Exception as e:
+                print(f"{self.kind} で形 {shape} を準備できなかったため eager で実行します: {e}")
+                model = _PositionalModel(self.model, input_names)
+                self.runners[key] = lambda *tensors: model(*tensors)
+            self.prepare_seconds += time.perf_counter() - start
+
+        with torch.inference_mode():
+            outputs = self.runners[key](*args)
+        results = {}
+        for name, tensor in zip(self.output_names[input_names], outputs):
+            tensor = tensor[:batch]
+            if tensor.dim() >= 2 and tensor.shape[1] == shape[1]:
+                tensor = tensor[:, :length]
+            results[name] = tensor
+        return SimpleNamespace(**results)
+
+# TorchScript（torch.jit.trace）で形ごとにトレースしたグラフを使う
+class TorchScriptBackend(BucketedBackend):
+    kind = "torchscript"
+
+    def _prepare(self, key, args, input_names):
+        with torch.no_grad():
+            traced = torch.jit.trace(_PositionalModel(self.model, input_names), tuple(args), check_trace=False,
+                                     strict=False)
+        return traced
+
+# torch.compile でコンパイルする。形はバケットに揃えてあるので、再コンパイルはバケットの数までで済む
+class CompileBackend(BucketedBackend):
+    kind = "compile"
+
+    def __init__(self, model, batch_buckets=BATCH_BUCKETS, sequence_buckets=SEQUENCE_BUCKETS):
+        super().__init__(model, batch_buckets, sequence_buckets)
+        import torch._dynamo
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit,
+                                                    len(batch_buckets) * len(sequence_buckets))
+        self.compiled = {}
+
+    def _prepare(self, key, args, input_names):
+        if input_names not in self.compiled:
+            self.compiled[input_names] = torch.compile(_PositionalModel(self.model, input_names), dynamic=False)
+        compiled = self.compiled[input_names]
+        # コンパイルは最初の呼び出しで行われるので、ここで1回実行しておく
+        with torch.inference_mode():
+            compiled(*args)
+        return compiled
+
+# ONNX にエクスポートして onnxruntime で実行する（onnxruntime がインストールされている場合のみ）
+# グラフは可変長で1つだけエクスポートし、入力の形はバケットに揃えて onnxruntime のメモリ計画を使い回す
+class OnnxBackend(BucketedBackend):
+    kind = "onnx"
+
+    def __init__(self, model, batch_buckets=BATCH_BUCKETS, sequence_buckets=SEQUENCE_BUCKETS, export_dir=None):
+        import onnxruntime
+        super().__init__(model, batch_buckets, sequence_buckets)
+        self.onnxruntime = onnxruntime
+        self.export_dir = export_dir or tempfile.mkdtemp(prefix="onnx-")
+        self.sessions = {}
+
+    def _session(self, args, input_names):
+        if input_names not in self.sessions:
+            path = os.path.join(self.export_dir, f"{type(self.model).__name__}-{len(input_names)}.onnx")
+            output_names = list(self.output_names[input_names])
+            axes = {name: {0: "batch", 1: "sequence"} for name in input_names + tuple(output_names)}
+            with torch.no_grad():
+                torch.onnx.export(_PositionalModel(self.model, input_names), tuple(args), path,
+                                  input_names=list(input_names), output_names=output_names, dynamic_axes=axes,
+                                  opset_version=14, dynamo=False)
+            options = self.onnxruntime.SessionOptions()
+            options.graph_optimization_level = self.onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.sessions[input_names] = self.onnxruntime.InferenceSession(path, options,
+                                                                           providers=["CPUExecutionProvider"])
+        return self.sessions[input_names]
+
+    def _prepare(self, key, args, input_names):
+        session = self._session(args, input_names)
+
+        def run(*tensors):
+            feeds = {name: tensor.numpy() for name, tensor in zip(input_names, tensors)}
+            return [torch.from_numpy(np.asarray(output)) for output in session.run(None, feeds)]
+        run(*args)
+        return run
+
+# 名前からバックエンドを作る。onnxruntime が無い環境で "onnx" を選んだときは eager にする
+def create_backend(model, kind=DEFAULT_BACKEND, **kwargs):
+    if kind == "eager":
+        return EagerBackend(model)
+    if kind == "torchscript":
+        return TorchScriptBackend(model, **kwargs)
+    if kind == "compile":
+        return CompileBackend(model, **kwargs)
+    if kind == "onnx":
+        try:
+            return OnnxBackend(model, **kwargs)
+        except ImportError as e:
+            print(f"onnxruntime を利用できないため eager で実行します: {e}")
+            return EagerBackend(model)
+    raise ValueError(f"未対応のバックエンドです: {kind} ({', '.join(BACKENDS)} のいずれか)")
+
+# よく使う形（バッチ数 × 系列長）で1回ずつ推論し、遅延初期化とコンパイルを起動時に済ませておく
+# 最初の質問も 100 回目の質問と同じ速さで答えられるようにするため（128 トークンを超える質問は最初の1回だけ遅い）
+def warm_up(backend, batch_sizes=(1,), lengths=(16, 32, 64, 128), token_type_ids=False):
+    start = time.perf_counter()
+    # 特殊トークン以外の適当な id で埋める（値は結果に関係しない）
+    token_id = (backend.config.pad_token_id or 0) + 4
+    for batch in batch_sizes:
+        for length in lengths:
+            inputs = {
+                "input_ids": torch.full((batch, length), token_id, dtype=torch.long),
+                "attention_mask": torch.ones((batch, length), dtype=torch.long),
+            }
+            if token_type_ids:
+                inputs["token_type_ids"] = torch.zeros((batch, length), dtype=torch.long)
+            backend(**inputs)
+    return time.perf_counter() - start
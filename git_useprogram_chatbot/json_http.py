@@ -0,0 +1,176 @@
+import asyncio
+import json
+import traceback
+from collections import namedtuple
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+# リクエスト本文とヘッダの行数の上限、何も送られてこない接続を閉じるまでの秒数
+MAX_BODY_BYTES = 64 * 1024
+MAX_HEADER_LINES = 100
+IDLE_TIMEOUT = 60.0
+
+# 解析済みのリクエスト（headers のキーは小文字、query は parse_qs の結果）
+Request = namedtuple("Request", ["method", "path", "query", "headers", "body", "keep_alive"])
+
+# ハンドラから投げると、そのステータスと {"error": メッセージ} を返す
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+# リクエスト本文の JSON オブジェクト（本文が無ければ空の dict）
+def request_json(request):
+    if not request.body:
+        return {}
+    try:
+        payload = json.loads(request.body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise HttpError(400, f"JSON を読めません: {e}")
+    if not isinstance(payload, dict):
+        raise HttpError(400, "JSON オブジェクトを送ってください")
+    return payload
+
+# リクエストを1つ読む。接続が閉じられていれば None
+async def read_request(reader, max_body=MAX_BODY_BYTES):
+    try:
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "リクエスト行が不正です")
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HttpError(431)
+    except ValueError:
+        # StreamReader の1行の上限を超えた
+        raise HttpError(431)
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "Content-Length を指定してください")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "Content-Length が不正です")
+    if length > max_body:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length > 0 else b""
+
+    # HTTP/1.1 は明示的に閉じない限り接続を使い回す（HTTP/1.0 は keep-alive を指定したときだけ）
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    url = urlsplit(target)
+    return Request(method.upper(), url.path, parse_qs(url.query), headers, body, keep_alive)
+
+def response_head(status, content_type, keep_alive, content_length=None, headers=()):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}", *headers]
+    if content_length is not None:
+        lines.append(f"Content-Length: {content_length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+def json_response(status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return response_head(status, "application/json; charset=utf-8", keep_alive, len(body)) + body
+
+# ハンドラが (ステータス, EventStream(events)) を返すと、Server-Sent Events (text/event-stream) で1件ずつ送る
+# events は (イベント名, JSON にできる値) を順に返す非同期イテレータ
+# 長さが分からないので Content-Length は付けず、送り終えたら接続を閉じる
+class EventStream:
+    def __init__(self, events):
+        self.events = events
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+# asyncio のストリームで動く、JSON を返すだけの小さな HTTP/1.1 サーバ（外部ライブラリを使わない）
+# handler(request) は (ステータス, JSON にできる値) を返すコルーチン。HttpError を投げるとそのステータスを返す
+# 1つの接続で複数のリクエストを順に処理する（keep-alive）。EventStream を返すと、イベントを届いた順に送る
+class JsonHttpServer:
+    def __init__(self, handler, max_body=MAX_BODY_BYTES, idle_timeout=IDLE_TIMEOUT):
+        self.handler = handler
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self.server = None
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader, self.max_body), self.idle_timeout)
+                except HttpError as e:
+                    writer.write(json_response(e.status, {"error": str(e)}, keep_alive=False))
+                    await writer.drain()
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+
+                try:
+                    status, payload = await self.handler(request)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    traceback.print_exc()
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                if isinstance(payload, EventStream):
+                    await self.write_events(writer, status, payload)
+                    break
+                writer.write(json_response(status, payload, request.keep_alive))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    # イベントを1件ずつ送る。途中で例外が起きたら error イベントを送って終える
+    async def write_events(self, writer, status, stream):
+        writer.write(response_head(status, "text/event-stream; charset=utf-8", False,
+                                   headers=("Cache-Control: no-cache", "X-Accel-Buffering: no")))
+        try:
+            try:
+                async for event, payload in stream.events:
+                    writer.write(sse_event(event, payload))
+                    await writer.drain()
+            except HttpError as e:
+                writer.write(sse_event("error", {"error": str(e), "status": e.status}))
+            except ConnectionError:
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                writer.write(sse_event("error", {"error": f"{type(e).__name__}: {e}", "status": 500}))
+            await writer.drain()
+        finally:
+            # 接続が切れたときも、イベントを作っている側の後始末（finally）を実行させる
+            if hasattr(stream.events, "aclose"):
+                await stream.events.aclose()
+
+    # host, port で待ち受ける。sock（listen 済みのソケット）を渡すと、それで待ち受ける
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, sock=None):
+        if sock is not None:
+            self.server = await asyncio.start_server(self.handle_connection, sock=sock)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def serve_forever(self, host=DEFAULT_HOST, port=DEFAULT_PORT, sock=None):
+        server = await self.start(host, port, sock)
+        async with server:
+            await server.serve_forever()
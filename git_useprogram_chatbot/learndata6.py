@@ -1,8 +1,10 @@
 import json
-import numpy as np
-from transformers import pipeline, AutoTokenizer, AutoModelForQuestionAnswering, AutoModel
-from sklearn.metrics.pairwise import cosine_similarity
-import torch
+from startup_profile import PROFILE, phase
+# torch・transformers を使うモジュールは load_retriever の中で読み込む（入力待ちまでの時間を短くするため）
+from retriever import Retriever
+from precision import DEFAULT_PRECISION
+from runtime_options import DEFAULT_BACKEND, runtime_args
+from background_loader import BackgroundLoader, StartupTimer
 
 # JSONファイルを読み込む
 def load_json_data(file_path):
@@ -18,47 +20,19 @@ def load_json_data(file_path):
         return {}
 
 # 質問とWikipediaタグを比較して最も類似した質問を探す
-def find_similar_question(question, tokenizer, model, data, recommendation_data, threshold=0.7):
-    # 質問の埋め込みを計算
-    inputs = tokenizer(question, return_tensors="pt")
-    question_embedding = model(**inputs).last_hidden_state.mean(dim=1).detach().numpy()
+# 上位 k 件の検索結果のうち、閾値を超える最上位の候補の文章を返す
+def find_similar_question(question, retriever, threshold=0.7, k=5):
+    candidates = retriever.search(question, k)
+
+    print("\n--- 類似度の高い候補 ---")
+    for candidate in candidates:
+        print(f"[{candidate.source}] '{candidate.id}' の類似度: {candidate.score:.4f}")
 
     max_similarity = threshold
     best_answer = None
-
-    # Wikipediaデータ内のタグとコンテンツとの類似度計算
-    print("\n--- Wikipediaデータとの類似度計算 ---")
-    for section, content in data.items():
-        section_inputs = tokenizer(section, return_tensors="pt", truncation=True)
-        section_embedding = model(**section_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        section_similarity = cosine_similarity(question_embedding, section_embedding)[0][0]
-        print(f"タグ '{section}' の類似度: {section_similarity:.4f}")
-
-        content_inputs = tokenizer(content, return_tensors="pt", truncation=True, max_length=512)
-        content_embedding = model(**content_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        content_similarity = cosine_similarity(question_embedding, content_embedding)[0][0]
-        print(f"セクション: '{section}' の内容との類似度: {content_similarity:.4f}")
-
-        if section_similarity > max_similarity or content_similarity > max_similarity:
-            max_similarity = max(section_similarity, content_similarity)
-            best_answer = content
-
-    # 推薦選抜データ内のタグとコンテンツとの類似度計算
-    print("\n--- 推薦選抜データとの類似度計算 ---")
-    for section, content in recommendation_data.items():
-        section_inputs = tokenizer(section, return_tensors="pt", truncation=True)
-        section_embedding = model(**section_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        section_similarity = cosine_similarity(question_embedding, section_embedding)[0][0]
-        print(f"タグ '{section}' の類似度: {section_similarity:.4f}")
-
-        content_inputs = tokenizer(content, return_tensors="pt", truncation=True, max_length=512)
-        content_embedding = model(**content_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        content_similarity = cosine_similarity(question_embedding, content_embedding)[0][0]
-        print(f"セクション: '{section}' の内容との類似度: {content_similarity:.4f}")
-
-        if section_similarity > max_similarity or content_similarity > max_similarity:
-            max_similarity = max(section_similarity, content_similarity)
-            best_answer = content
+    if candidates and candidates[0].score > max_similarity:
+        max_similarity = candidates[0].score
+        best_answer = candidates[0].text
 
     print(f"\n最も高い類似度: {max_similarity:.4f}")
     return best_answer
@@ -76,25 +50,59 @@ def save_feedback(question, bot_answer, rating, human_answer=None, file_path="da
         json.dump(feedback_data, file, ensure_ascii=False)
         file.write("\n")
 
-# チャットボット
-def chatbot():
-    data = load_json_data('data/wikipedia_sections.json')
-    recommendation_data = load_json_data('data/numazu_recommendation_selection_retry.json')
-
-    tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base", use_fast=False)
-    qa_model = AutoModelForQuestionAnswering.from_pretrained("xlm-roberta-base")
-    embedding_model = AutoModel.from_pretrained("xlm-roberta-base")
+# トークナイザ・モデル・セクションの埋め込みを読み込み、検索器を返す（バックグラウンドのスレッドで実行する）
+def load_retriever(data, recommendation_data, precision=DEFAULT_PRECISION, backend=DEFAULT_BACKEND, mmap_weights=False,
+                   log=print):
+    with phase("model", "xlm-roberta-base"):
+        from transformers import AutoTokenizer
+        from shared_model import SharedEncoderModel
+        from inference_backend import create_backend, warm_up
+        tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base", use_fast=False)
+        # 質問応答モデルと埋め込み用のモデルはエンコーダを共有する（重みを2重に読み込まない）
+        shared_model = SharedEncoderModel.from_pretrained("xlm-roberta-base", precision=precision, mmap=mmap_weights)
+        embedding_model = create_backend(shared_model.backbone, backend)
+    with phase("warmup", f"推論の準備 ({backend}, {precision})"):
+        log(f"推論の準備 ({backend}, {precision}): {warm_up(embedding_model):.2f} 秒")
+
+    # セクションの埋め込みは起動時に一度だけ、バッチ単位で計算しておく
+    with phase("index", "コーパスの埋め込み"):
+        from corpus_index import build_corpus_index
+        from encoder import EncodeReport
+        encode_report = EncodeReport()
+        corpus_index = build_corpus_index([("Wikipedia", data), ("推薦選抜", recommendation_data)], tokenizer,
+                                          embedding_model, report=encode_report)
+    log(f"埋め込みの事前計算: {encode_report}")
+    return Retriever(tokenizer, embedding_model, corpus_index)
+
+# チャットボット（モデルはバックグラウンドで読み込み、入力はすぐに受け付ける。mmap_weights なら重みを mmap する）
+def chatbot(precision=DEFAULT_PRECISION, backend=DEFAULT_BACKEND, mmap_weights=False):
+    timer = StartupTimer()
+    with phase("data", "wikipedia_sections.json"):
+        data = load_json_data('data/wikipedia_sections.json')
+    with phase("data", "numazu_recommendation_selection_retry.json"):
+        recommendation_data = load_json_data('data/numazu_recommendation_selection_retry.json')
+    loader = BackgroundLoader(lambda log: load_retriever(data, recommendation_data, precision, backend,
+                                                         mmap_weights, log))
 
     print("沼津高専チャットボットへようこそ！'exit'と入力して終了できます。")
 
     while True:
+        loader.flush()
+        # 起動時間の内訳は、読み込みが終わった時点（途中で終了したときはその時点）で1回だけ表示する
+        if PROFILE.enabled and not PROFILE.reported and loader.ready:
+            PROFILE.report()
+        timer.prompt()
         user_input = input("あなた: ")
         if user_input.lower() == "exit":
+            if PROFILE.enabled and not PROFILE.reported:
+                PROFILE.report()
             break
 
-        bot_answer = find_similar_question(user_input, tokenizer, embedding_model, data, recommendation_data)
+        retriever, waited = loader.wait()
+        bot_answer = find_similar_question(user_input, retriever)
         print(f"あなたの質問: {user_input}")
         print(f"チャットボットの回答: {bot_answer}")
+        timer.answer(waited)
 
         try:
             rating = int(input("評価を1から5で入力してください（1が最低、5が最高）: "))
@@ -110,4 +118,7 @@ def chatbot():
 
 # チャットボットを起動
 if __name__ == "__main__":
-    chatbot()
+    args = runtime_args()
+    if args.profile_startup:
+        PROFILE.enable()
+    chatbot(args.precision, args.backend, args.mmap_weights)
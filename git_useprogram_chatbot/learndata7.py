@@ -1,8 +1,21 @@
 import json
-import numpy as np
-from transformers import AutoTokenizer, AutoModelForQuestionAnswering, AutoModel
-from sklearn.metrics.pairwise import cosine_similarity
-import torch
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+from startup_profile import PROFILE, phase
+# torch・transformers とそれを使うモジュール（encoder, corpus_index, inference_backend）は、
+# 使う関数の中で読み込む。キーワード検索だけで動く部分やツールは torch を読み込まずに起動できる
+from retriever import FEEDBACK_SOURCE, SIMILARITY_THRESHOLD, Retriever
+from query_cache import QueryCache
+from embedding_cache import EmbeddingCache
+from exact_match import MIN_RATING, ExactMatchIndex, rated_answer
+from feedback_index import FeedbackIndex
+from projection import DEFAULT_PROJECTION_MODE, Projection
+from reranker import RERANK_BUDGET_MS, CrossEncoderReranker
+from lexical_index import LEXICAL_THRESHOLD, build_lexical_index
+from precision import DEFAULT_PRECISION, apply_precision
+from runtime_options import DEFAULT_BACKEND, runtime_parser
+from background_loader import BackgroundLoader, StartupTimer
 
 # JSONファイルを読み込む
 def load_json_data(file_path):
@@ -31,74 +44,110 @@ def load_feedback_data(file_path="data/feedback.json"):
         print("フィードバックファイルが見つかりませんでした。")
     return feedback
 
-# フィードバックデータをベクトル化
-def preprocess_feedback_embeddings(feedback_data, tokenizer, model):
-    embeddings = {}
-    for entry in feedback_data:
-        question = entry.get("question", "")
-        bot_answer = entry.get("bot_answer", "")
-        # 'human_answer' が存在しない場合は 'bot_answer' を使用
-        human_answer = entry.get("human_answer", bot_answer)
-        inputs = tokenizer(question, return_tensors="pt")
-        embedding = model(**inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        embeddings[question] = (embedding, human_answer)
-    return embeddings
+# フィードバックの回答。完全一致の高速パスと同じ規則（exact_match.rated_answer）で、
+# 改善回答があればそれを、なければ評価が MIN_RATING 以上のボットの回答を使う。低評価で改善回答もなければ None
+# （None の回答を持つ質問に一致したら回答しない。低評価の回答を埋め込み検索で返し直さないため）
+def feedback_answer(entry):
+    answer, rating = rated_answer(entry)
+    return answer if rating >= MIN_RATING else None
 
-# 質問とフィードバック・Wikipediaタグを比較して最も類似した質問を探す
-def find_similar_question(question, feedback_embeddings, tokenizer, model, data, recommendation_data, threshold=0.7):
-    # 質問の埋め込みを計算
-    inputs = tokenizer(question, return_tensors="pt")
-    question_embedding = model(**inputs).last_hidden_state.mean(dim=1).detach().numpy()
-
-    max_similarity = threshold
-    best_answer = None
-
-    # フィードバックデータ内の類似度計算
-    print("\n--- フィードバックデータとの類似度計算 ---")
-    for feedback_question, (feedback_embedding, feedback_answer) in feedback_embeddings.items():
-        similarity = cosine_similarity(question_embedding, feedback_embedding)[0][0]
-        print(f"フィードバック質問: '{feedback_question}' の類似度: {similarity:.4f}")
-        
-        if similarity > max_similarity:
-            max_similarity = similarity
-            best_answer = feedback_answer
-
-    # Wikipediaデータ内のタグとコンテンツとの類似度計算
-    print("\n--- Wikipediaデータとの類似度計算 ---")
-    for section, content in data.items():
-        section_inputs = tokenizer(section, return_tensors="pt", truncation=True)
-        section_embedding = model(**section_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        section_similarity = cosine_similarity(question_embedding, section_embedding)[0][0]
-        print(f"タグ '{section}' の類似度: {section_similarity:.4f}")
-
-        content_inputs = tokenizer(content, return_tensors="pt", truncation=True, max_length=512)
-        content_embedding = model(**content_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        content_similarity = cosine_similarity(question_embedding, content_embedding)[0][0]
-        print(f"セクション: '{section}' の内容との類似度: {content_similarity:.4f}")
-
-        if section_similarity > max_similarity or content_similarity > max_similarity:
-            max_similarity = max(section_similarity, content_similarity)
-            best_answer = content
-
-    # 推薦選抜データ内のタグとコンテンツとの類似度計算
-    print("\n--- 推薦選抜データとの類似度計算 ---")
-    for section, content in recommendation_data.items():
-        section_inputs = tokenizer(section, return_tensors="pt", truncation=True)
-        section_embedding = model(**section_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        section_similarity = cosine_similarity(question_embedding, section_embedding)[0][0]
-        print(f"タグ '{section}' の類似度: {section_similarity:.4f}")
-
-        content_inputs = tokenizer(content, return_tensors="pt", truncation=True, max_length=512)
-        content_embedding = model(**content_inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        content_similarity = cosine_similarity(question_embedding, content_embedding)[0][0]
-        print(f"セクション: '{section}' の内容との類似度: {content_similarity:.4f}")
-
-        if section_similarity > max_similarity or content_similarity > max_similarity:
-            max_similarity = max(section_similarity, content_similarity)
-            best_answer = content
+# フィードバックの質問をベクトル化する（キャッシュがあれば未計算の質問だけをエンコードする）
+def encode_feedback(feedback_data, tokenizer, model, cache=None, report=None):
+    from encoder import encode_texts
+    questions = [entry.get("question", "") for entry in feedback_data]
+    encode = lambda texts: encode_texts(texts, tokenizer, model, report=report)
+    if cache is None:
+        return encode(questions)
+    matrix = cache.get_or_encode(questions, encode)
+    # フィードバックから消えた質問の埋め込みは削除する
+    cache.garbage_collect(questions)
+    return matrix
+
+# フィードバックデータをベクトル化して検索インデックスを作る（matrix があればベクトル化は省く）
+# index_kind に "int8" / "pq" を指定すると、圧縮したコードで検索して全精度ベクトルはディスクに置く
+# projection (projection.Projection) を渡すと、次元削減した空間で検索する
+def preprocess_feedback_embeddings(feedback_data, tokenizer, model, cache=None, report=None, index_kind="auto",
+                                   projection=None, matrix=None):
+    questions = [entry.get("question", "") for entry in feedback_data]
+    if matrix is None:
+        matrix = encode_feedback(feedback_data, tokenizer, model, cache, report)
+    answers = [feedback_answer(entry) for entry in feedback_data]
+
+    # 件数が多いときは近似最近傍（IVF）インデックスになる
+    feedback_index = FeedbackIndex(model.config.hidden_size, expected_size=len(questions), kind=index_kind,
+                                   projection=projection)
+    feedback_index.add_many(questions, matrix, answers)
+    return feedback_index
+
+# モデルを使わずに答えられる質問の (回答, 出典, スコア)。なければ (None, None, 0.0)
+# exact_index があれば、正規化した質問文が一致するフィードバックを返す（出典 "exact"）
+# lexical_index があり、キーワードだけで候補が1つに絞れるときはその回答を返す（出典 "lexical"、スコアは BM25）
+def quick_match(question, exact_index=None, lexical_index=None):
+    if exact_index is not None:
+        exact_answer = exact_index.lookup(question)
+        if exact_answer is not None:
+            return exact_answer, "exact", 1.0
+
+    if lexical_index is not None:
+        lexical_answer, lexical_score = lexical_index.best_answer(question)
+        if lexical_answer is not None:
+            return lexical_answer, "lexical", lexical_score
+    return None, None, 0.0
+
+# モデルを使わずに答えられる質問の回答（なければ None）
+def quick_answer(question, exact_index=None, lexical_index=None):
+    answer, source, score = quick_match(question, exact_index, lexical_index)
+    if source == "exact":
+        print("\n--- フィードバックの質問と完全一致しました ---")
+    elif source == "lexical":
+        print(f"\n--- キーワード検索で回答しました (BM25: {score:.4f}) ---")
+    return answer
+
+# 埋め込みの検索結果（best は閾値を超えた最上位の候補、なければ None。threshold は判定に使った閾値）
+SearchResult = namedtuple("SearchResult", ["best", "candidates", "threshold", "reranked"])
+
+# 埋め込みで検索し、上位 k 件の候補と、そのうち閾値を超える最上位の候補を返す
+# threshold を省くと retriever の閾値（次元削減した空間ならその空間に合わせた値）を使う
+# retriever の代わりに LexicalIndex を渡すと、キーワード検索だけで同じように答える（--lexical-only）
+# reranker (CrossEncoderReranker) があれば上位の候補だけを採点し直し、その関連度と reranker の閾値で判定する
+# stats (ExactMatchStats) があれば、モデルの処理時間を記録する
+def search_match(question, retriever, threshold=None, k=5, reranker=None, stats=None):
+    if threshold is None:
+        threshold = getattr(retriever, "threshold", SIMILARITY_THRESHOLD)
+    start = time.perf_counter()
+    candidates = retriever.search(question, k)
+    if stats is not None:
+        stats.record_model_time(time.perf_counter() - start)
+    reranked = False
+    if reranker is not None:
+        candidates, reranked = reranker.rerank(question, candidates, start)
+        if reranked:
+            threshold = reranker.threshold
+    # 最上位が回答を持たない（低評価の）フィードバックなら答えない
+    best = candidates[0] if candidates and candidates[0].score > threshold and candidates[0].text is not None else None
+    return SearchResult(best, candidates, threshold, reranked)
 
+# search_match の結果を表示し、閾値を超える最上位の候補の文章を返す（なければ None）
+def search_answer(question, retriever, threshold=None, k=5, reranker=None, stats=None):
+    result = search_match(question, retriever, threshold, k, reranker, stats)
+    if result.reranked:
+        print("\n--- クロスエンコーダで再ランキングしました ---")
+
+    print("\n--- 類似度の高い候補 ---")
+    for candidate in result.candidates:
+        print(f"[{candidate.source}] '{candidate.id}' の類似度: {candidate.score:.4f}")
+
+    max_similarity = result.best.score if result.best is not None else result.threshold
     print(f"\n最も高い類似度: {max_similarity:.4f}")
-    return best_answer
+    return result.best.text if result.best is not None else None
+
+# 質問とフィードバック・Wikipediaタグを比較して最も類似した質問を探す
+# モデルを使わない回答（完全一致・キーワード検索）を先に試し、なければ埋め込みで検索する
+def find_similar_question(question, retriever, threshold=None, k=5, exact_index=None, reranker=None):
+    answer = quick_answer(question, exact_index, retriever.lexical_index)
+    if answer is not None:
+        return answer
+    return search_answer(question, retriever, threshold, k, reranker, exact_index.stats if exact_index else None)
 
 # フィードバックを保存する関数
 def save_feedback(question, bot_answer, rating, human_answer=None, file_path="data/feedback.json"):
@@ -109,31 +158,190 @@ def save_feedback(question, bot_answer, rating, human_answer=None, file_path="da
         "human_answer": human_answer
     }
 
+    # 1行を1回で書き込み、複数のプロセスが同時に追記しても行が混ざらないようにする
     with open(file_path, "a", encoding="utf-8") as file:
-        json.dump(feedback_data, file, ensure_ascii=False)
-        file.write("\n")
+        file.write(json.dumps(feedback_data, ensure_ascii=False) + "\n")
+    return feedback_data
+
+# 保存したフィードバックを再起動せずに検索インデックスへ反映する（feedback_index が None なら完全一致と BM25 だけ）
+# 同じ質問がすでにあれば回答を置き換え、新しい質問ならベクトルを1件だけ計算して追記する
+def update_feedback_index(entry, feedback_index, tokenizer, model, cache=None, exact_index=None, lexical_index=None):
+    if exact_index is not None:
+        exact_index.add(entry)
+    question = entry.get("question", "")
+    answer = feedback_answer(entry)
+    if lexical_index is not None:
+        lexical_index.add(question, FEEDBACK_SOURCE, question, answer)
+    # モデルの読み込み前は、モデルを使わない索引だけを更新する
+    if feedback_index is None:
+        return
+    if feedback_index.update_answer(question, answer):
+        return
 
-# チャットボット
-def chatbot():
-    data = load_json_data('data/wikipedia_sections.json')
-    recommendation_data = load_json_data('data/numazu_recommendation_selection_retry.json')
-    feedback_data = load_feedback_data("data/feedback.json")
+    from encoder import encode_texts
+    encode = lambda texts: encode_texts(texts, tokenizer, model)
+    embedding = cache.get_or_encode([question], encode) if cache is not None else encode([question])
+    feedback_index.add(question, embedding[0], answer)
 
-    tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base", use_fast=False)
-    embedding_model = AutoModel.from_pretrained("xlm-roberta-base")
+# トークナイザ・モデル・埋め込みの索引を読み込む（バックグラウンドのスレッドで実行する）
+# 引数は chatbot と同じ。qa_reader なら質問応答モデルとパッセージも読み込む（chatbot_server の --qa-reader）
+# 進み具合のメッセージは log に渡す（qa_reader・max_batch・log はキーワードで渡すこと）
+# max_batch は質問をまとめてベクトル化する最大件数（chatbot_server の --max-batch）。その件数までのバッチの形も準備しておく
+def load_models(data, recommendation_data, feedback_data, lexical_index, precision=DEFAULT_PRECISION,
+                backend=DEFAULT_BACKEND, query_encoder=None, projection_dim=0, projection_mode=DEFAULT_PROJECTION_MODE,
+                reranker_name=None, rerank_budget_ms=RERANK_BUDGET_MS, mmap_weights=False, *, qa_reader=False,
+                max_batch=1, log=print):
+    reader_model = None
+    with phase("model", "xlm-roberta-base"):
+        from transformers import AutoTokenizer, AutoModel
+        from inference_backend import batch_buckets_upto, create_backend, warm_up
+        tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base", use_fast=False)
+        if qa_reader:
+            # 質問応答モデルのエンコーダを埋め込みにも使う（重みを2重に読み込まない）
+            from shared_model import SharedEncoderModel
+            shared_model = SharedEncoderModel.from_pretrained("xlm-roberta-base", precision=precision, mmap=mmap_weights)
+            embedding_model = create_backend(shared_model.backbone, backend)
+            reader_model = create_backend(shared_model.qa_model, backend)
+        else:
+            # --mmap-weights なら重みをコピーせずに safetensors を mmap したまま使い、同じホストのプロセス間で共有する
+            if mmap_weights:
+                from mapped_weights import mmap_pretrained
+                model = mmap_pretrained(AutoModel, "xlm-roberta-base", log=log)
+            else:
+                model = AutoModel.from_pretrained("xlm-roberta-base")
+            # 推論の精度とバックエンドは起動時に選ぶ（--precision fp32 / int8 / bf16, --backend eager / torchscript / compile / onnx）
+            embedding_model = create_backend(apply_precision(model, precision), backend)
+    # 質問の形（max_batch 件までのバッチ）で先に推論しておき、最初の質問で遅延初期化やコンパイルの時間がかからないようにする
+    batch_sizes = batch_buckets_upto(max_batch)
+    with phase("warmup", f"推論の準備 ({backend}, {precision})"):
+        warm_up_seconds = warm_up(embedding_model, batch_sizes=batch_sizes)
+        if reader_model is not None:
+            warm_up_seconds += warm_up(reader_model, batch_sizes=(1, 2, 4), lengths=(128, 256, 384))
+        log(f"推論の準備 ({backend}, {precision}): {warm_up_seconds:.2f} 秒")
 
-    feedback_embeddings = preprocess_feedback_embeddings(feedback_data, tokenizer, embedding_model)
+    # セクションの埋め込みは起動時に一度だけ、バッチ単位で計算しておく
+    with phase("index", "コーパスの埋め込み"):
+        from corpus_index import build_corpus_index
+        from encoder import EncodeReport
+        encode_report = EncodeReport()
+        corpus_index = build_corpus_index([("Wikipedia", data), ("推薦選抜", recommendation_data)], tokenizer,
+                                          embedding_model, report=encode_report)
+
+    # フィードバックの埋め込みはディスクにキャッシュし、再起動時は新しい質問だけを計算する
+    with phase("index", "フィードバックの埋め込み"):
+        feedback_cache = EmbeddingCache.for_model("data/embedding_cache", tokenizer, embedding_model, precision=precision)
+        feedback_matrix = encode_feedback(feedback_data, tokenizer, embedding_model, feedback_cache, encode_report)
+    log(f"埋め込みの事前計算: {encode_report}")
+    # 次元削減はコーパスとフィードバックの埋め込みから求め、両方の索引と質問ベクトルに同じ変換を使う
+    projection, threshold = None, SIMILARITY_THRESHOLD
+    if projection_dim > 0:
+        with phase("index", "次元削減"):
+            projection = Projection.fit([corpus_index.title_matrix, corpus_index.content_matrix, feedback_matrix],
+                                        projection_dim, projection_mode, threshold=SIMILARITY_THRESHOLD)
+            corpus_index = corpus_index.project(projection)
+            threshold = projection.answer_threshold(threshold)
+        log(f"次元削減: {projection}")
+    with phase("index", "フィードバックの索引"):
+        feedback_index = preprocess_feedback_embeddings(feedback_data, tokenizer, embedding_model, projection=projection,
+                                                        matrix=feedback_matrix)
+    # 質問のベクトル化だけは小さな生徒モデルに任せられる（索引は教師の埋め込みのまま）
+    query_model = embedding_model
+    if query_encoder is not None:
+        with phase("model", f"質問用エンコーダ {query_encoder}"):
+            from student_encoder import StudentEncoder
+            query_model = create_backend(StudentEncoder.load(query_encoder), backend)
+            log(f"質問用エンコーダ: {query_encoder} (準備 {warm_up(query_model, batch_sizes=batch_sizes):.2f} 秒)")
+    # 同じ質問の埋め込みと検索結果は上限付きの LRU キャッシュで使い回す
+    retriever = Retriever(tokenizer, query_model, corpus_index, feedback_index, QueryCache(), lexical_index,
+                          threshold=threshold)
+    reranker = None
+    if reranker_name is not None:
+        with phase("model", f"再ランキング {reranker_name}"):
+            reranker = CrossEncoderReranker.from_pretrained(reranker_name, precision, backend, budget_ms=rerank_budget_ms)
+            log(f"再ランキング: {reranker_name} (準備 {reranker.warm_up():.2f} 秒, 上限 {rerank_budget_ms:.0f} ms)")
+    # qa_reader なら、BM25 で選んだパッセージから答えの範囲を読み取れるようにしておく（パッセージは起動時にトークン化する）
+    reader = None
+    if reader_model is not None:
+        with phase("index", "パッセージ"):
+            from passage_reader import PassageReader
+            reader = PassageReader({**data, **recommendation_data}, None, tokenizer, cache_dir="data/reader_cache",
+                                   qa_model=reader_model)
+        log(f"パッセージ数: {len(reader)}")
+    return SimpleNamespace(tokenizer=tokenizer, embedding_model=embedding_model, feedback_cache=feedback_cache,
+                           feedback_index=feedback_index, retriever=retriever, reranker=reranker, reader=reader)
+
+# チャットボット（precision は推論の精度、backend は推論バックエンド、query_encoder は質問用の生徒モデルのパス、
+# projection_dim が 0 より大きければコーパスとフィードバックの埋め込みをその次元に削減して検索する）
+# reranker_name を指定すると、上位の候補をそのクロスエンコーダで rerank_budget_ms 以内に採点し直す
+# モデルはバックグラウンドで読み込み、その間も完全一致とキーワード検索で答えられる質問にはすぐに答える
+# lexical_only なら埋め込みのモデルは読み込まず、完全一致とキーワード検索だけで答える（torch も読み込まない）
+# mmap_weights なら重みを safetensors から読み取り専用で mmap する
+def chatbot(precision=DEFAULT_PRECISION, backend=DEFAULT_BACKEND, query_encoder=None, projection_dim=0,
+            projection_mode=DEFAULT_PROJECTION_MODE, reranker_name=None, rerank_budget_ms=RERANK_BUDGET_MS,
+            lexical_only=False, mmap_weights=False):
+    timer = StartupTimer()
+    with phase("data", "wikipedia_sections.json"):
+        data = load_json_data('data/wikipedia_sections.json')
+    with phase("data", "numazu_recommendation_selection_retry.json"):
+        recommendation_data = load_json_data('data/numazu_recommendation_selection_retry.json')
+    with phase("data", "feedback.json"):
+        feedback_data = load_feedback_data("data/feedback.json")
+
+    # セクションとフィードバックの質問は BM25 でも引けるようにし、キーワード検索と類似度を組み合わせる
+    with phase("index", "キーワード索引"):
+        lexical_index = build_lexical_index([("Wikipedia", data), ("推薦選抜", recommendation_data)], feedback_data,
+                                            answer_fn=feedback_answer)
+    print(f"キーワード索引: {len(lexical_index)} 件 ({lexical_index.tokenizer_name})")
+    with phase("index", "完全一致索引"):
+        exact_index = ExactMatchIndex(feedback_data)
+    loader = None
+    if not lexical_only:
+        loader = BackgroundLoader(lambda log: load_models(data, recommendation_data, feedback_data, lexical_index,
+                                                          precision, backend, query_encoder, projection_dim,
+                                                          projection_mode, reranker_name, rerank_budget_ms,
+                                                          mmap_weights, log=log))
+    # 埋め込みの索引にまだ反映していないフィードバック（モデルの読み込みが終わっていれば次の入力の前に反映する）
+    pending_feedback = []
 
     print("沼津高専チャットボットへようこそ！'exit'と入力して終了できます。")
 
     while True:
+        models = None
+        if loader is not None:
+            loader.flush()
+            models = loader.result_if_ready()
+        if models is not None and pending_feedback:
+            for entry in pending_feedback:
+                update_feedback_index(entry, models.feedback_index, models.tokenizer, models.embedding_model,
+                                      models.feedback_cache)
+            pending_feedback = []
+        # 起動時間の内訳は、すべての読み込みが終わった時点で1回だけ表示する
+        if PROFILE.enabled and not PROFILE.reported and (loader is None or models is not None):
+            PROFILE.report()
+
+        timer.prompt()
         user_input = input("あなた: ")
         if user_input.lower() == "exit":
+            print(f"完全一致による高速応答: {exact_index.stats}")
+            if models is not None:
+                print(f"質問キャッシュ: {models.retriever.query_cache}")
+                if models.reranker is not None:
+                    print(f"再ランキング: {models.reranker.stats}")
+            # 読み込みの途中で終了した場合も、そこまでの内訳を表示する
+            if PROFILE.enabled and not PROFILE.reported:
+                PROFILE.report()
             break
 
-        bot_answer = find_similar_question(user_input, feedback_embeddings, tokenizer, embedding_model, data, recommendation_data)
+        waited = 0.0
+        bot_answer = quick_answer(user_input, exact_index, lexical_index)
+        if bot_answer is None and loader is None:
+            bot_answer = search_answer(user_input, lexical_index, threshold=LEXICAL_THRESHOLD)
+        elif bot_answer is None:
+            models, waited = loader.wait()
+            bot_answer = search_answer(user_input, models.retriever, reranker=models.reranker, stats=exact_index.stats)
         print(f"あなたの質問: {user_input}")
         print(f"チャットボットの回答: {bot_answer}")
+        timer.answer(waited)
 
         try:
             rating = int(input("評価を1から5で入力してください（1が最低、5が最高）: "))
@@ -145,8 +353,18 @@ def chatbot():
         if rating < 3:
             human_answer = input("改善された回答を入力してください: ")
         
-        save_feedback(user_input, bot_answer, rating, human_answer)
+        feedback_entry = save_feedback(user_input, bot_answer, rating, human_answer)
+        update_feedback_index(feedback_entry, None, None, None, exact_index=exact_index, lexical_index=lexical_index)
+        if loader is not None:
+            pending_feedback.append(feedback_entry)
 
 # チャットボットを起動
 if __name__ == "__main__":
-    chatbot()
+    parser = runtime_parser()
+    parser.add_argument("--lexical-only", action="store_true",
+                        help="埋め込みのモデルを読み込まず、完全一致とキーワード検索だけで答える")
+    args = parser.parse_args()
+    if args.profile_startup:
+        PROFILE.enable()
+    chatbot(args.precision, args.backend, args.query_encoder, args.projection_dim, args.projection, args.reranker,
+            args.rerank_budget_ms, args.lexical_only, args.mmap_weights)
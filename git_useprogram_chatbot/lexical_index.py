@@ -0,0 +1,190 @@
+import math
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+from ann_index import GrowableRows, top_k
+from retriever import FEEDBACK_SOURCE, Candidate
+
+# BM25 のパラメータ
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 正規化した BM25 スコアがこれを超え、2位との差が LEXICAL_MARGIN 以上ならモデルを使わずに回答する
+LEXICAL_THRESHOLD = 0.5
+LEXICAL_MARGIN = 0.15
+# 自動選択で試す形態素解析器の順番
+TOKENIZER_PREFERENCE = ("fugashi", "sudachi", "janome")
+
+def _fugashi_tokenizer():
+    import fugashi
+    tagger = fugashi.Tagger()
+    return lambda text: [word.surface for word in tagger(text)]
+
+def _sudachi_tokenizer():
+    from sudachipy import dictionary, tokenizer
+    sudachi = dictionary.Dictionary().create()
+    mode = tokenizer.Tokenizer.SplitMode.A
+    return lambda text: [morpheme.surface() for morpheme in sudachi.tokenize(text, mode)]
+
+def _janome_tokenizer():
+    from janome.tokenizer import Tokenizer
+    janome = Tokenizer()
+    return lambda text: list(janome.tokenize(text, wakati=True))
+
+# 形態素解析器が1つも入っていない環境向けの文字 bigram
+def _bigram_tokenizer():
+    def tokenize(text):
+        text = "".join(text.split())
+        return [text[i:i + 2] for i in range(len(text) - 1)] or ([text] if text else [])
+    return tokenize
+
+TOKENIZERS = {
+    "fugashi": _fugashi_tokenizer,
+    "sudachi": _sudachi_tokenizer,
+    "janome": _janome_tokenizer,
+    "bigram": _bigram_tokenizer,
+}
+
+# 名前から分かち書き関数を作る。"auto" ならインストールされている形態素解析器を順に試す
+def create_tokenizer(name="auto"):
+    if name != "auto":
+        return name, TOKENIZERS[name]()
+    for candidate in TOKENIZER_PREFERENCE:
+        try:
+            return candidate, TOKENIZERS[candidate]()
+        except (ImportError, RuntimeError) as e:
+            print(f"{candidate} を利用できません: {e}")
+    return "bigram", _bigram_tokenizer()
+
+# 句読点・記号・空白だけでできた語か（同じ語が何度も現れるので結果を覚えておく）
+@lru_cache(maxsize=65536)
+def is_symbol(token):
+    return all(unicodedata.category(char).startswith(("P", "S", "Z")) for char in token)
+
+# 文章を NFKC と小文字化で正規化してから分かち書きし、句読点・記号だけの語を取り除く
+def text_terms(text, tokenize):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return [token for token in (token.strip() for token in tokenize(text)) if token and not is_symbol(token)]
+
+# 文書数と出現文書数から求める BM25 の idf
+def bm25_idf(count, document_frequency):
+    return math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+# セクションとフィードバックの質問に対する BM25 の転置インデックス
+# 語ごとに (文書番号, 出現回数) の配列を持ち、質問に含まれる語の分だけを足し合わせる
+# idf と長さの正規化項は文書数に依存するので、追加のたびではなく検索時に必要な分だけ求める
+class LexicalIndex:
+    def __init__(self, tokenizer="auto", k1=BM25_K1, b=BM25_B):
+        self.tokenizer_name, self.tokenize = create_tokenizer(tokenizer)
+        self.k1 = k1
+        self.b = b
+        self.documents = []
+        self.keys = {}
+        self.postings = {}
+        self.doc_lengths = GrowableRows(dtype=np.float32)
+        self._length_norms = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def terms(self, text):
+        return text_terms(text, self.tokenize)
+
+    # 文書を追加する。documents は (id, ソース名, 検索対象の文章, 回答として返す文章) のリスト
+    # 同じソース・同じ id の文書がすでにあれば、回答だけを置き換える
+    def add_many(self, documents):
+        new_postings = {}
+        lengths = []
+        for doc_key, source, text, answer in documents:
+            existing = self.keys.get((source, doc_key))
+            if existing is not None:
+                self.documents[existing] = (doc_key, source, text, answer)
+                continue
+            doc_id = len(self.documents)
+            self.keys[(source, doc_key)] = doc_id
+            self.documents.append((doc_key, source, text, answer))
+            counts = Counter(self.terms(text))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                doc_ids, term_counts = new_postings.setdefault(term, ([], []))
+                doc_ids.append(doc_id)
+                term_counts.append(count)
+
+        for term, (doc_ids, term_counts) in new_postings.items():
+            doc_ids = np.array(doc_ids, dtype=np.int64)
+            term_counts = np.array(term_counts, dtype=np.float32)
+            if term in self.postings:
+                old_ids, old_counts = self.postings[term]
+                doc_ids, term_counts = np.concatenate([old_ids, doc_ids]), np.concatenate([old_counts, term_counts])
+            self.postings[term] = (doc_ids, term_counts)
+        if lengths:
+            self.doc_lengths.extend(np.array(lengths, dtype=np.float32))
+            self._length_norms = None
+        return self
+
+    def add(self, doc_key, source, text, answer):
+        return self.add_many([(doc_key, source, text, answer)])
+
+    # 文書ごとの長さの正規化項 k1 * (1 - b + b * 文書長 / 平均文書長)
+    @property
+    def length_norms(self):
+        if self._length_norms is None:
+            lengths = self.doc_lengths.view
+            average_length = max(float(lengths.mean()), 1e-9) if len(lengths) else 1.0
+            self._length_norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        return self._length_norms
+
+    # 質問に対する全文書の BM25 スコアと、質問の語の idf の合計（正規化用）
+    # どの文書にも現れない語も出現文書数 0 の idf で合計に含める（一致しない語ほど情報が多いので、
+    # それを除くと一部の語が一致しただけの文書のスコアが高くなりすぎる）
+    def scores(self, question):
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        ideal = 0.0
+        length_norms = self.length_norms
+        for term, query_count in Counter(self.terms(question)).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                ideal += query_count * bm25_idf(len(self.documents), 0)
+                continue
+            doc_ids, counts = posting
+            idf = bm25_idf(len(self.documents), len(doc_ids))
+            scores[doc_ids] += query_count * idf * counts * (self.k1 + 1) / (counts + length_norms[doc_ids])
+            ideal += query_count * idf
+        return scores, ideal
+
+    # 上位 k 件を Candidate のリストで返す
+    # score は BM25 を質問の語の idf の合計 × (k1 + 1)（各語の寄与の上限）で割り、0〜1 に収めたもの
+    def search(self, question, k=5):
+        scores, ideal = self.scores(question)
+        if ideal <= 0:
+            return []
+        best_scores, ids = top_k(scores, k)
+        candidates = []
+        for score, doc_id in zip(best_scores, ids):
+            if score <= 0:
+                break
+            doc_key, source, _, answer = self.documents[doc_id]
+            candidates.append(Candidate(doc_key, source, float(score) / (ideal * (self.k1 + 1)), answer))
+        return candidates
+
+    # 最上位の候補が閾値を超え、2位との差も十分なら (回答, スコア) を返す。なければ (None, 閾値)
+    # 語が一致するだけの曖昧な質問はモデルに回すため、差 margin を条件に加えている
+    def best_answer(self, question, threshold=LEXICAL_THRESHOLD, margin=LEXICAL_MARGIN):
+        candidates = self.search(question, k=2)
+        if not candidates or candidates[0].score <= threshold:
+            return None, threshold
+        if len(candidates) > 1 and candidates[0].score - candidates[1].score < margin:
+            return None, threshold
+        return candidates[0].text, candidates[0].score
+
+# セクション（タグ + 内容）とフィードバックの質問から BM25 インデックスを作る
+def build_lexical_index(sources, feedback_data=(), tokenizer="auto", answer_fn=None):
+    documents = []
+    for source, data in sources:
+        for section, content in data.items():
+            documents.append((section, source, f"{section}\n{content}", content))
+    for entry in feedback_data:
+        question = entry.get("question", "")
+        answer = answer_fn(entry) if answer_fn is not None else entry.get("bot_answer")
+        documents.append((question, FEEDBACK_SOURCE, question, answer))
+    return LexicalIndex(tokenizer).add_many(documents)
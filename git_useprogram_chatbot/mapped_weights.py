@@ -0,0 +1,138 @@
+import json
+import mmap
+import struct
+import warnings
+
+# safetensors のデータ型（torch は読み込むときに初めて import する）
+SAFETENSORS_DTYPES = {"F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16", "I64": "int64",
+                      "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool"}
+SAFETENSORS_NAME = "model.safetensors"
+SAFETENSORS_INDEX_NAME = "model.safetensors.index.json"
+# 古いチェックポイントの LayerNorm の名前
+LEGACY_NAMES = (("LayerNorm.gamma", "LayerNorm.weight"), ("LayerNorm.beta", "LayerNorm.bias"))
+
+# safetensors ファイルを読み取り専用で mmap し、ファイル上のデータをそのまま指すテンソルを作る
+# テンソルのページはファイルのページキャッシュなので、同じファイルを開いたプロセス（fork したワーカーを含む）の間で共有される
+# 書き込むとプロセスが落ちる（読み取り専用の領域）ので、重みをその場で書き換える処理（学習など）には使えない
+class MappedSafetensors:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_size = struct.unpack("<Q", self.map[:8])[0]
+        self.header = json.loads(self.map[8:8 + header_size])
+        self.metadata = self.header.pop("__metadata__", {})
+        self.data_start = 8 + header_size
+
+    def __len__(self):
+        return len(self.header)
+
+    # ファイル全体を先読みするようカーネルに伝える（親プロセスで一度だけ呼べば、ワーカーは読み込み済みのページを使う）
+    def prefetch(self):
+        if hasattr(self.map, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            self.map.madvise(mmap.MADV_WILLNEED)
+
+    def tensors(self):
+        import torch
+        tensors = {}
+        # 読み取り専用のバッファから作ったテンソルには警告が出るが、書き込まないので問題ない
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            for name, info in self.header.items():
+                dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+                begin, end = info["data_offsets"]
+                if end == begin:
+                    tensors[name] = torch.empty(info["shape"], dtype=dtype)
+                    continue
+                count = (end - begin) // dtype.itemsize
+                tensors[name] = torch.frombuffer(self.map, dtype=dtype, count=count,
+                                                 offset=self.data_start + begin).reshape(info["shape"])
+        return tensors
+
+# モデル名（ローカルのディレクトリまたはダウンロード済みのキャッシュ）から safetensors ファイルのパスを探す
+# 分割されたチェックポイント（model.safetensors.index.json）にも対応する
+def safetensors_files(name):
+    from transformers.utils import cached_file
+    index_path = cached_file(name, SAFETENSORS_INDEX_NAME, _raise_exceptions_for_missing_entries=False)
+    if index_path is None:
+        return [cached_file(name, SAFETENSORS_NAME)]
+    with open(index_path, 'r', encoding='utf-8') as file:
+        shards = sorted(set(json.load(file)["weight_map"].values()))
+    return [cached_file(name, shard) for shard in shards]
+
+# チェックポイントの重みの名前をモデルの state_dict の名前に合わせる
+# AutoModel で保存した重み（接頭辞なし）を質問応答モデルに読み込む場合や、その逆の場合に接頭辞を付け外しする
+def match_names(model, names):
+    expected = set(model.state_dict())
+    prefix = model.base_model_prefix + "."
+    mapping = {}
+    for name in names:
+        key = name
+        for old, new in LEGACY_NAMES:
+            key = key.replace(old, new)
+        for candidate in (key, prefix + key, key[len(prefix):] if key.startswith(prefix) else None):
+            if candidate in expected:
+                mapping[name] = candidate
+                break
+    return mapping
+
+# model_class (AutoModel / AutoModelForQuestionAnswering など) のモデルを、重みを mmap したまま組み立てる
+# 重みの領域は確保・初期化せずにモデルを作り、mmap したテンソルをそのままパラメータとして差し込む（コピーしない）
+# チェックポイントに無い重み（ベースモデルに付けた質問応答ヘッドなど）だけは from_pretrained と同じく初期化する
+# mmap はテンソルが参照している間は開いたままになる
+def mmap_pretrained(model_class, name, log=print, **config_kwargs):
+    from transformers import AutoConfig
+    from transformers.modeling_utils import no_init_weights
+
+    config = AutoConfig.from_pretrained(name, **config_kwargs)
+    with no_init_weights():
+        model = model_class.from_config(config)
+    state_dict = {}
+    for path in safetensors_files(name):
+        weights = MappedSafetensors(path)
+        weights.prefetch()
+        tensors = weights.tensors()
+        for name_in_file, key in match_names(model, tensors).items():
+            state_dict[key] = tensors[name_in_file]
+
+    missing, _ = model.load_state_dict(state_dict, strict=False, assign=True)
+    if missing:
+        log(f"チェックポイントに無い重みを初期化しました: {', '.join(missing)}")
+        for module_name in sorted({key.rpartition(".")[0] for key in missing}):
+            model._init_weights(model.get_submodule(module_name))
+    model.tie_weights()
+    model.requires_grad_(False)
+    return model.eval()
+
+# プロセスのメモリ使用量（バイト）。Linux の /proc/<pid>/smaps_rollup から求める（読めない環境では None）
+#   rss:    常駐メモリ全体（共有しているページも含む）
+#   pss:    共有しているページを共有しているプロセス数で割って数えたもの（全プロセスの合計がホストの使用量になる）
+#   uss:    そのプロセスだけが持つページ（ワーカーを1つ増やすと増えるメモリ）
+#   shared: 他のプロセスと共有しているページ
+def process_memory(pid="self"):
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+# ホストで新たに使えるメモリ（バイト、/proc/meminfo の MemAvailable）。読めない環境では None
+def available_memory():
+    try:
+        with open("/proc/meminfo", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
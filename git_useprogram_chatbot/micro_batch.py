@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import Future
+
+# 1回のモデル呼び出しにまとめる要求の最大数と、要求が揃うのを待つ最大時間
+DEFAULT_MAX_BATCH = 16
+DEFAULT_MAX_WAIT_MS = 5.0
+
+# 複数のスレッドから同時に届いた要求を集め、まとめて batch_fn(要求のリスト) に渡して1回で処理する
+# 最初の要求から max_wait_ms 経つか max_batch 件集まったら処理を始め、結果は要求ごとの Future で返す
+# batch_fn は要求と同じ順番・同じ数の結果を返すこと（例外を投げたときは、そのバッチの全員に例外を返す）
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS, name="micro-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pending = []
+        self.condition = threading.Condition()
+        self.closed = False
+        self.batches = 0
+        self.items = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    # 要求を登録して Future を返す
+    def submit(self, item):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("MicroBatcher は既に閉じられています")
+            self.pending.append((item, future))
+            self.condition.notify()
+        return future
+
+    # 要求を登録し、結果が出るまで待つ
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    # 1バッチ分の要求を取り出す（閉じられていて要求も残っていなければ空のリスト）
+    def _take(self):
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self.pending) < self.max_batch and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            # 取り消された要求は処理しない（処理を始めた要求は取り消せなくなるので、結果を必ず設定できる）
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    # 1回のモデル呼び出しにまとめられた要求の平均数
+    @property
+    def average_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    # 受け付けを止め、残っている要求を処理してからスレッドを終了する
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# 質問文を1件ずつ受け取り、同時に届いた質問をまとめてベクトル化する（結果は1件分の埋め込み）
+def batched_encoder(tokenizer, model, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    from encoder import encode_texts
+    return MicroBatcher(lambda questions: encode_texts(questions, tokenizer, model), max_batch, max_wait_ms,
+                        name="query-encoder")
+
+# (質問, 読むパッセージ) を受け取り、同時に届いた質問のウィンドウをまとめて読み取る
+# reader は TokenizedReader（read_batch を持つもの）
+def batched_reader(reader, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    return MicroBatcher(lambda requests: reader.read_batch([question for question, _ in requests],
+                                                           [passages for _, passages in requests]),
+                        max_batch, max_wait_ms, name="qa-reader")
@@ -0,0 +1,117 @@
+import re
+from collections import namedtuple
+import numpy as np
+from ann_index import normalize_rows, top_k
+from encoder import encode_texts
+from lexical_index import LexicalIndex
+from retriever import Candidate, combine_scores
+from tokenized_context import TokenizedReader
+
+# 1つのパッセージのトークン数の上限と、前のパッセージと重ねるトークン数
+# 質問と合わせて質問応答モデルの1ウィンドウ（384 トークン）に収まる長さにしている
+PASSAGE_MAX_TOKENS = 256
+PASSAGE_OVERLAP_TOKENS = 64
+# 読み取りモデルに渡すパッセージの数
+DEFAULT_TOP_K = 3
+
+# 読み取り対象の文章の断片（section は元のタグ、text は「タグ: 本文の一部」）
+Passage = namedtuple("Passage", ["section", "text"])
+
+# 文末（。！？ と改行）で区切る。区切り文字は前の文に残す
+def split_sentences(text):
+    return [sentence for sentence in re.split(r"(?<=[。！？!?\n])", text) if sentence.strip()]
+
+# 1文がそれだけで上限を超えるときは、トークン数が上限に収まるよう文字数で等分する
+def _fit_sentence(sentence, length, max_tokens):
+    if length <= max_tokens:
+        return [(sentence, length)]
+    parts = -(-length // max_tokens)
+    size = -(-len(sentence) // parts)
+    return [(sentence[i:i + size], -(-length // parts)) for i in range(0, len(sentence), size)]
+
+# セクションごとに、文単位で上限トークン数までまとめたパッセージに分ける
+# 隣り合うパッセージは末尾の文を overlap トークン分ほど重ね、境界をまたぐ答えも読めるようにする
+def split_passages(data, tokenizer, max_tokens=PASSAGE_MAX_TOKENS, overlap=PASSAGE_OVERLAP_TOKENS):
+    passages = []
+    for section, content in data.items():
+        prefix = f"{section}: "
+        budget = max_tokens - len(tokenizer.tokenize(prefix))
+        sentences = []
+        for sentence in split_sentences(content):
+            sentences.extend(_fit_sentence(sentence, len(tokenizer.tokenize(sentence)), budget))
+
+        window, window_tokens = [], 0
+        for sentence, length in sentences:
+            if window and window_tokens + length > budget:
+                passages.append(Passage(section, prefix + "".join(text for text, _ in window)))
+                # 末尾から overlap トークン分の文を次のパッセージへ持ち越す
+                carried, carried_tokens = [], 0
+                for text, text_length in reversed(window):
+                    if carried_tokens + text_length > overlap or carried_tokens + text_length + length > budget:
+                        break
+                    carried.insert(0, (text, text_length))
+                    carried_tokens += text_length
+                window, window_tokens = carried, carried_tokens
+            window.append((sentence, length))
+            window_tokens += length
+        if window:
+            passages.append(Passage(section, prefix + "".join(text for text, _ in window)))
+    return passages
+
+# 全文を読む代わりに、BM25 で選んだ上位 k 件のパッセージだけを質問応答モデルに読ませる
+# パッセージは起動時にトークン化しておき（cache_dir があればディスクにも保存する）、質問ごとには質問文だけをトークン化する
+# embedding_model があればパッセージの埋め込みも計算しておき、フィードバック検索で求めた質問ベクトルを
+# そのままパッセージの順位付けにも使う（BM25 とのハイブリッド。エンコーダを質問ごとに2回通さない）
+# 候補が1つもない質問は、すべてのパッセージを読む
+# qa_model を渡すと、パイプラインのモデルの代わりにそれ（推論バックエンドなど）で読み取る
+class PassageReader:
+    def __init__(self, data, qa_pipeline, tokenizer, top_k=DEFAULT_TOP_K, lexical_tokenizer="auto",
+                 max_tokens=PASSAGE_MAX_TOKENS, overlap=PASSAGE_OVERLAP_TOKENS, cache_dir=None, embedding_model=None,
+                 qa_model=None):
+        self.qa_pipeline = qa_pipeline
+        self.top_k = top_k
+        self.passages = split_passages(data, tokenizer, max_tokens, overlap)
+        self.context = "".join([f"{section}: {content}\n" for section, content in data.items()])
+        self.index = LexicalIndex(lexical_tokenizer).add_many(
+            (i, passage.section, passage.text, passage.text) for i, passage in enumerate(self.passages))
+        self.reader = TokenizedReader(qa_model or qa_pipeline.model, tokenizer, [passage.text for passage in self.passages],
+                                      cache_dir)
+        self.passage_matrix = None
+        if embedding_model is not None:
+            self.passage_matrix = normalize_rows(encode_texts([passage.text for passage in self.passages], tokenizer,
+                                                              embedding_model, truncation=True))
+
+    def __len__(self):
+        return len(self.passages)
+
+    # 質問に関係するパッセージの番号を返す（question_embedding があれば類似度と BM25 を組み合わせる）
+    def retrieve(self, question, k=None, question_embedding=None):
+        k = k or self.top_k
+        candidates = self.index.search(question, k)
+        if question_embedding is not None and self.passage_matrix is not None:
+            query = normalize_rows(np.reshape(question_embedding, (1, -1)))[0]
+            scores, ids = top_k(self.passage_matrix @ query, k)
+            dense = [Candidate(int(i), self.passages[i].section, float(score), self.passages[i].text)
+                     for score, i in zip(scores, ids)]
+            candidates = combine_scores(dense, candidates, k=k,
+                                        dense_score_fn=lambda candidate: float(self.passage_matrix[candidate.id] @ query))
+        return [candidate.id for candidate in candidates]
+
+    # 全文をそのまま質問応答パイプラインに読ませる（従来の動作）
+    def read_all(self, question):
+        return self.qa_pipeline(question=question, context=self.context)
+
+    # 上位のパッセージを読み、スコアが最も高い答えを返す（パイプラインの結果と同じ形の辞書）
+    def read(self, question, k=None, question_embedding=None):
+        return self.reader.read(question, self.retrieve(question, k, question_embedding) or None)
+
+    # 複数の質問をまとめて読む（同時に届いた質問のウィンドウを一緒にモデルへ通す）
+    def read_batch(self, questions, k=None, question_embeddings=None):
+        if question_embeddings is None:
+            question_embeddings = [None] * len(questions)
+        passages = [self.retrieve(question, k, embedding) or None
+                    for question, embedding in zip(questions, question_embeddings)]
+        return self.reader.read_batch(questions, passages)
+
+    def answer(self, question, k=None, question_embedding=None):
+        return self.read(question, k, question_embedding)["answer"]
@@ -0,0 +1,66 @@
+import functools
+import sys
+# torch は使う関数の中で読み込む（起動時に精度の選択肢だけを参照するときは読み込まない）
+
+# 推論の精度モード
+#   fp32: そのまま
+#   int8: Linear 層の重みを int8 に動的量子化する（活性は実行時に量子化）
+#   bf16: bfloat16 の autocast で実行する（CPU が対応している場合のみ）
+PRECISION_MODES = ("fp32", "int8", "bf16")
+DEFAULT_PRECISION = "fp32"
+
+# CPU が bfloat16 の行列演算（AVX512-BF16 / AMX）に対応しているか
+def bf16_supported():
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def _autocast_forward(forward):
+    import torch
+
+    @functools.wraps(forward)
+    def wrapped(*args, **kwargs):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return forward(*args, **kwargs)
+    return wrapped
+
+# モデルを指定した精度で推論するように変換する（モデルをその場で書き換えて返す）
+# 質問応答モデルとエンコーダが重みを共有している場合は、質問応答モデルに適用すれば両方に反映される
+def apply_precision(model, mode=DEFAULT_PRECISION):
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"未対応の精度モードです: {mode} ({', '.join(PRECISION_MODES)} のいずれか)")
+    model.eval()
+    if mode == "int8":
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if mode == "bf16":
+        if not bf16_supported():
+            print("この CPU は bfloat16 に対応していないため fp32 で実行します")
+            return model
+        # 子モジュールの forward は autocast の内側で呼ばれるので、外側の forward を包めば十分
+        # ただしエンコーダ部分（base_model）を単独で埋め込みに使う場合に備えて、そちらも包んでおく
+        model.forward = _autocast_forward(model.forward)
+        base_model = getattr(model, "base_model", model)
+        if base_model is not model:
+            base_model.forward = _autocast_forward(base_model.forward)
+    return model
+
+# 現在のプロセスの常駐メモリ（バイト）。/proc が読めない環境では最大常駐メモリを返す（Windows では 0）
+def current_rss():
+    try:
+        with open("/proc/self/status", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux はキロバイト単位
+    return rss if sys.platform == "darwin" else rss * 1024
@@ -0,0 +1,178 @@
+import asyncio
+import gc
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import time
+from chatbot_server import serve, server_parser, service_from_args
+
+# ワーカーの数の既定値（CPU 数）と、ワーカーが起動後すぐに落ちたときに作り直すまでの待ち時間
+DEFAULT_WORKERS = os.cpu_count() or 1
+MIN_UPTIME = 5.0
+RESTART_DELAY = 1.0
+# 停止を頼んでから強制終了するまでの秒数
+STOP_TIMEOUT = 10.0
+LISTEN_BACKLOG = 1024
+# ワーカーの中で後から初期化されるライブラリのスレッド数もそろえる
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# ワーカー1つあたりの推論スレッド数（ワーカー数 × スレッド数が CPU 数を超えないようにする）
+def threads_per_worker(workers, threads=0):
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+# 推論スレッド数を固定する。torch は読み込み済みのときだけ設定する
+# numpy の BLAS は起動後に環境変数を変えても効かないので、threadpoolctl があればそれで制限する
+def pin_threads(threads):
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(threads)
+
+# 複数のプロセスが accept する待ち受けソケット（親で作り、fork したワーカーが引き継ぐ）
+def listening_socket(host, port, backlog=LISTEN_BACKLOG):
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.setblocking(False)
+    return sock
+
+# target(番号) を実行するワーカーを workers 個 fork し、終了したワーカーを作り直す
+# ワーカーは親のメモリ（読み込んだモデルと索引）をコピーオンライトで共有する
+class WorkerPool:
+    def __init__(self, target, workers, log=print):
+        self.context = multiprocessing.get_context("fork")
+        self.target = target
+        self.workers = workers
+        self.log = log
+        self.processes = {}
+        self.started = {}
+        self.restarts = 0
+        self.stopping = False
+
+    def _start_worker(self, slot):
+        process = self.context.Process(target=self.target, args=(slot,), name=f"chatbot-worker-{slot}", daemon=True)
+        process.start()
+        self.processes[slot] = process
+        self.started[slot] = time.monotonic()
+
+    def start(self):
+        # 親の Python オブジェクトを GC の対象から外し、ワーカーの GC が共有しているページに書き込まないようにする
+        gc.collect()
+        gc.freeze()
+        for slot in range(self.workers):
+            self._start_worker(slot)
+        return self
+
+    @property
+    def pids(self):
+        return [process.pid for process in self.processes.values()]
+
+    # ワーカーを見張り、落ちたものを作り直す。stop() が呼ばれるまで戻らない
+    def supervise(self):
+        while not self.stopping:
+            sentinels = {process.sentinel: slot for slot, process in self.processes.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=1.0):
+                if self.stopping:
+                    break
+                slot = sentinels[sentinel]
+                process = self.processes[slot]
+                process.join()
+                self.log(f"ワーカー {process.pid} が終了しました (終了コード {process.exitcode})。作り直します")
+                # 起動してすぐに落ち続ける場合は間を空ける
+                if time.monotonic() - self.started[slot] < MIN_UPTIME:
+                    time.sleep(RESTART_DELAY)
+                self.restarts += 1
+                self._start_worker(slot)
+
+    # ワーカーに SIGTERM を送って終了を待つ（timeout 秒で終わらなければ強制終了する）
+    def stop(self, timeout=STOP_TIMEOUT):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        gc.unfreeze()
+
+# ワーカーの中で実行する。親が読み込んだ service を使い、共有のソケットで accept する
+# Ctrl-C は親が受け取ってワーカーに SIGTERM を送るので、ワーカーでは SIGINT を無視する
+def run_worker(service, sock, threads, max_concurrency, max_pending, log=None):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    pin_threads(threads)
+    service.after_fork()
+    if log is None:
+        log = lambda message: print(f"[ワーカー {os.getpid()}] {message}", flush=True)
+
+    async def run():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await serve(service, sock=sock, max_concurrency=max_concurrency, max_pending=max_pending, log=log)
+
+    try:
+        asyncio.run(run())
+    except asyncio.CancelledError:
+        pass
+    finally:
+        service.close()
+
+# 親でモデルと索引を読み込み、ワーカーを fork するまでの準備をする
+# 親が複数のスレッドで推論すると、fork したワーカーで複数のスレッドを使う推論が止まる（OpenMP のスレッドプールは
+# fork を越えて引き継げない）。ワーカーが2スレッド以上を使うときは、親の推論を1スレッドにしておく
+def load_for_workers(args, threads, log=print):
+    if not args.lexical_only and threads > 1:
+        import torch
+        torch.set_num_threads(1)
+        log("ワーカーで複数スレッドを使うため、親では1スレッドで読み込みます")
+    service = service_from_args(args)
+    if service.loader is not None:
+        service.loader.wait()
+        # 読み込みのスレッド（完了時のコールバックを含む）が終わってから fork する
+        service.loader.thread.join()
+        if service.models_status == "failed":
+            raise service.loader.future.exception()
+    # 親は質問に答えないので、micro_batch のスレッドを止めてから fork する（ワーカーで作り直す）
+    service.close()
+    return service
+
+# 親でモデルと索引を1回だけ読み込み、共有の待ち受けソケットで accept するワーカーを fork して見張る
+# 例: python prefork_server.py --workers 4 --port 8000 --mmap-weights
+def main():
+    parser = server_parser("沼津高専チャットボットの HTTP サーバ (prefork)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="fork するワーカーの数")
+    parser.add_argument("--threads", type=int, default=0, help="ワーカーごとの推論スレッド数 (0 なら CPU 数 / ワーカー数)")
+    args = parser.parse_args()
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("この環境では fork が使えないため、chatbot_server.py を使ってください")
+        return
+
+    threads = threads_per_worker(args.workers, args.threads)
+    service = load_for_workers(args, threads)
+    sock = listening_socket(args.host, args.port)
+    pool = WorkerPool(lambda slot: run_worker(service, sock, threads, args.max_concurrency, args.max_pending),
+                      args.workers)
+    # SIGTERM でも Ctrl-C と同じく、ワーカーを止めてから終了する
+    signal.signal(signal.SIGTERM, lambda signum, frame: setattr(pool, "stopping", True))
+    pool.start()
+    print(f"http://{args.host}:{args.port} でワーカー {args.workers} 個 (各 {threads} スレッド) が待ち受けています: "
+          f"{', '.join(map(str, pool.pids))}")
+    try:
+        pool.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        sock.close()
+        print(f"ワーカーを停止しました (作り直し {pool.restarts} 回)")
+
+if __name__ == "__main__":
+    main()
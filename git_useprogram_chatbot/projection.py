@@ -0,0 +1,135 @@
+import io
+import numpy as np
+from ann_index import load_index, normalize_rows
+
+# 次元削減の方式
+#   pca:    中心化せずに主成分へ射影する。全ベクトルに共通する向き（xlm-roberta の平均プーリングで強い成分）を残すので、
+#           類似度の値は元の 768 次元とほぼ同じになり、回答の閾値をそのまま使える
+#   whiten: 平均を引いて主成分ごとに分散を 1 に揃える（白色化）。偏りが消えて順位付けは良くなりやすいが、
+#           類似度の値全体が下がるので、回答の閾値は calibrate_threshold で写した空間のものに置き換える
+PROJECTION_MODES = ("pca", "whiten")
+DEFAULT_PROJECTION_MODE = "pca"
+
+# 元の空間で threshold を超えるペアの割合が、写した空間でも同じになる閾値を返す
+# ペアはサンプル（最大 sample_size 件）の全組み合わせで、コーパスやフィードバックどうしの類似度の分布を質問との分布の代わりに使う
+def calibrate_threshold(vectors, projected, threshold, sample_size=1000, seed=0):
+    rows = np.random.default_rng(seed).choice(len(vectors), min(len(vectors), sample_size), replace=False)
+    pairs = np.triu_indices(len(rows), k=1)
+    if len(pairs[0]) == 0:
+        return threshold
+    original = normalize_rows(vectors[rows])
+    mapped = normalize_rows(projected[rows])
+    share = np.mean((original @ original.T)[pairs] > threshold)
+    return float(np.quantile((mapped @ mapped.T)[pairs], 1 - share))
+
+# 埋め込みを低次元に写す線形変換（入力は単位ベクトルに正規化してから写す）
+# インデックスを作るときと質問を検索するときで同じ変換を使うため、インデックスと一緒に保存する
+# threshold は写した空間での回答の閾値（None なら元の空間の閾値をそのまま使う）
+class Projection:
+    def __init__(self, mean, components, mode=DEFAULT_PROJECTION_MODE, threshold=None):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.mode = mode
+        self.threshold = threshold
+
+    # 元の次元
+    @property
+    def input_dim(self):
+        return self.components.shape[0]
+
+    # 写した後の次元
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    def __str__(self):
+        if self.threshold is None:
+            return f"{self.mode} {self.input_dim} -> {self.dim} 次元"
+        return f"{self.mode} {self.input_dim} -> {self.dim} 次元, 閾値 {self.threshold:.4f}"
+
+    # 元の空間の閾値 threshold の代わりに使う閾値
+    def answer_threshold(self, threshold):
+        return threshold if self.threshold is None else self.threshold
+
+    def transform(self, vectors):
+        vectors = normalize_rows(np.reshape(vectors, (-1, self.input_dim)))
+        return (vectors - self.mean) @ self.components
+
+    # コーパスやフィードバックの埋め込みの行列（複数可）から dim 次元への変換を求める
+    # 次元はサンプル数を超えられないので、サンプルが少ないときは小さくなる
+    # whiten で threshold（元の空間の回答の閾値）を渡すと、同じ行列から写した空間の閾値も求めておく
+    @classmethod
+    def fit(cls, matrices, dim, mode=DEFAULT_PROJECTION_MODE, eps=1e-6, threshold=None):
+        if mode not in PROJECTION_MODES:
+            raise ValueError(f"未対応の次元削減です: {mode} ({', '.join(PROJECTION_MODES)} のいずれか)")
+        vectors = normalize_rows(np.concatenate([np.reshape(matrix, (len(matrix), -1)) for matrix in matrices]))
+        mean = vectors.mean(axis=0) if mode == "whiten" else np.zeros(vectors.shape[1], dtype=np.float32)
+        _, singular_values, components = np.linalg.svd(vectors - mean, full_matrices=False)
+        dim = min(dim, len(singular_values))
+        components = components[:dim].T
+        if mode == "whiten":
+            components = components / (singular_values[:dim] / np.sqrt(max(len(vectors) - 1, 1)) + eps)
+        projection = cls(mean, components, mode)
+        if mode == "whiten" and threshold is not None:
+            projection.threshold = calibrate_threshold(vectors, projection.transform(vectors), threshold)
+        return projection
+
+    # 閾値がなければ NaN として保存する（閾値を保存していない古いファイルも読める）
+    def to_arrays(self):
+        return {"projection_mean": self.mean, "projection_components": self.components,
+                "projection_mode": self.mode,
+                "projection_threshold": np.nan if self.threshold is None else self.threshold}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        threshold = float(arrays["projection_threshold"]) if "projection_threshold" in arrays else np.nan
+        return cls(arrays["projection_mean"], arrays["projection_components"], str(arrays["projection_mode"]),
+                   None if np.isnan(threshold) else threshold)
+
+    def save(self, path):
+        np.savez(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls.from_arrays(arrays)
+
+# 次元削減してから内側のインデックス（厳密検索・IVF・量子化）に入れるインデックス
+# 追加も検索も同じ変換を通し、保存するときは変換と内側のインデックスを1つのファイルにまとめる
+class ProjectedIndex:
+    kind = "projected"
+
+    def __init__(self, projection, index):
+        self.projection = projection
+        self.index = index
+
+    # 受け付けるベクトルの次元（変換前）
+    @property
+    def dim(self):
+        return self.projection.input_dim
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, vectors):
+        return self.index.add(self.projection.transform(vectors))
+
+    def search(self, query, k=1, **kwargs):
+        return self.index.search(self.projection.transform(query)[0], k, **kwargs)
+
+    def search_batch(self, queries, k=1):
+        queries = self.projection.transform(queries)
+        if not hasattr(self.index, "search_batch"):
+            results = [self.index.search(query, k) for query in queries]
+            return np.stack([scores for scores, _ in results]), np.stack([ids for _, ids in results])
+        return self.index.search_batch(queries, k)
+
+    def save(self, path):
+        buffer = io.BytesIO()
+        self.index.save(buffer)
+        np.savez(path, kind=self.kind, dim=self.dim, index=np.frombuffer(buffer.getvalue(), dtype=np.uint8),
+                 **self.projection.to_arrays())
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(Projection.from_arrays(arrays), load_index(io.BytesIO(arrays["index"].tobytes())))
@@ -0,0 +1,197 @@
+import json
+import os
+import tempfile
+import numpy as np
+from ann_index import GrowableRows, kmeans, nearest_centroids, normalize_rows, top_k
+
+# 圧縮コードでの概算スコアは一度にこの行数ずつ計算する（float への展開を小さく保つ）
+SCORE_CHUNK_SIZE = 65536
+# PQ の各部分空間のコードブック数（uint8 に収まる）
+PQ_CENTROIDS = 256
+
+# 全精度ベクトルを追記専用の float32 ファイルに置き、mmap で読み出す
+class DiskVectors:
+    def __init__(self, path, dim, truncate=True):
+        self.path = path
+        self.dim = dim
+        if truncate or not os.path.exists(path):
+            open(path, "wb").close()
+        self.size = os.path.getsize(path) // (4 * dim)
+        self._map = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with open(self.path, "ab") as file:
+            file.write(vectors.tobytes())
+        self.size += len(vectors)
+        self._map = None
+
+    @property
+    def matrix(self):
+        if self._map is None:
+            if self.size == 0:
+                return np.empty((0, self.dim), dtype=np.float32)
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.size, self.dim))
+        return self._map
+
+    # mmap を閉じる（Windows ではファイルを削除する前に必要）
+    def close(self):
+        self._map = None
+
+# 圧縮したコードで候補を絞り込み、上位だけをディスク上の全精度ベクトルで再ランキングするインデックス
+# mode="int8": 各ベクトルを最大絶対値で割って int8 に丸める（1件あたり 次元数 + 4 バイト）
+# mode="pq":   直積量子化。次元を pq_subspaces 個に分け、それぞれ 256 個の代表ベクトルの番号で表す（1件あたり pq_subspaces バイト）
+class QuantizedIndex:
+    kind = "quantized"
+
+    def __init__(self, dim, mode="int8", vectors_path=None, rerank=50, pq_subspaces=48, seed=0, truncate=True):
+        if mode not in ("int8", "pq"):
+            raise ValueError(f"未対応の量子化モードです: {mode}")
+        if mode == "pq" and dim % pq_subspaces != 0:
+            raise ValueError(f"次元数 {dim} は部分空間数 {pq_subspaces} で割り切れる必要があります")
+        # 保存先が指定されなければ一時ファイルを作り、close() で削除する
+        self.owns_vectors = vectors_path is None
+        if self.owns_vectors:
+            handle, vectors_path = tempfile.mkstemp(suffix=".f32")
+            os.close(handle)
+        self.dim = dim
+        self.mode = mode
+        self.rerank = rerank
+        self.pq_subspaces = pq_subspaces
+        self.seed = seed
+        self.full = DiskVectors(vectors_path, dim, truncate)
+        self.codes = GrowableRows(pq_subspaces if mode == "pq" else dim, dtype=np.uint8 if mode == "pq" else np.int8)
+        self.scales = GrowableRows(dtype=np.float32)
+        self.codebooks = None
+
+    def __len__(self):
+        return len(self.full)
+
+    def close(self):
+        self.full.close()
+        if self.owns_vectors:
+            self.owns_vectors = False
+            try:
+                os.remove(self.full.path)
+            except OSError:
+                pass
+
+    def __del__(self):
+        # __init__ の途中で例外になったときは full がない
+        if hasattr(self, "full"):
+            self.close()
+
+    # 圧縮後の1件あたりのメモリ使用量（バイト）
+    @property
+    def bytes_per_vector(self):
+        if self.mode == "int8":
+            return self.dim + 4
+        return self.pq_subspaces
+
+    @property
+    def is_trained(self):
+        return self.mode == "int8" or self.codebooks is not None
+
+    # PQ のコードブックを学習するのに必要な件数
+    @property
+    def min_train_size(self):
+        return PQ_CENTROIDS * 4
+
+    # 部分空間ごとに k-means を行い、PQ のコードブックを作る
+    def train(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), PQ_CENTROIDS * 64), replace=False)]
+        sub_dim = self.dim // self.pq_subspaces
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(sample[:, j * sub_dim:(j + 1) * sub_dim]), PQ_CENTROIDS, 10, rng, spherical=False)
+            for j in range(self.pq_subspaces)
+        ])
+        # 学習前に追加されていたベクトルをまとめて符号化する
+        self._encode(np.asarray(self.full.matrix))
+
+    def _encode(self, vectors):
+        if self.mode == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes.extend(np.rint(vectors / scales[:, None]).astype(np.int8))
+            self.scales.extend(scales)
+            return
+
+        sub_dim = self.dim // self.pq_subspaces
+        codes = np.empty((len(vectors), self.pq_subspaces), dtype=np.uint8)
+        for j in range(self.pq_subspaces):
+            sub_vectors = np.ascontiguousarray(vectors[:, j * sub_dim:(j + 1) * sub_dim])
+            codes[:, j] = nearest_centroids(sub_vectors, self.codebooks[j], spherical=False)
+        self.codes.extend(codes)
+
+    # ベクトルを追加し、割り当てた id を返す。全精度ベクトルはディスクへ追記する
+    def add(self, vectors):
+        vectors = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        first = len(self.full)
+        self.full.append(vectors)
+        if self.is_trained:
+            self._encode(vectors)
+        elif len(self.full) >= self.min_train_size:
+            self.train(np.asarray(self.full.matrix))
+        return np.arange(first, len(self.full))
+
+    # 圧縮コードだけで求めた概算の内積
+    def approximate_scores(self, query):
+        codes = self.codes.view
+        scores = np.empty(len(codes), dtype=np.float32)
+        if self.mode == "pq":
+            sub_dim = self.dim // self.pq_subspaces
+            tables = np.einsum("md,mkd->mk", query.reshape(self.pq_subspaces, sub_dim), self.codebooks)
+            subspaces = np.arange(self.pq_subspaces)
+        for begin in range(0, len(codes), SCORE_CHUNK_SIZE):
+            chunk = codes[begin:begin + SCORE_CHUNK_SIZE]
+            if self.mode == "int8":
+                scores[begin:begin + len(chunk)] = (chunk.astype(np.float32) @ query) * self.scales.view[begin:begin + len(chunk)]
+            else:
+                scores[begin:begin + len(chunk)] = tables[subspaces, chunk].sum(axis=1)
+        return scores
+
+    # 概算スコアで k * rerank 件に絞り、全精度ベクトルで並べ直す（rerank=0 なら概算スコアのまま返す）
+    def search(self, query, k=1, rerank=None):
+        query = normalize_rows(np.reshape(query, (1, self.dim)))[0]
+        if not self.is_trained:
+            return top_k(np.asarray(self.full.matrix) @ query, k)
+
+        rerank = self.rerank if rerank is None else rerank
+        if rerank <= 0:
+            return top_k(self.approximate_scores(query), k)
+        _, candidates = top_k(self.approximate_scores(query), k * rerank)
+        candidates = np.sort(candidates)
+        exact_scores = self.full.matrix[candidates] @ query
+        scores, positions = top_k(exact_scores, k)
+        return scores, candidates[positions]
+
+    # 全精度ベクトルが一時ファイル（close() で消える）にあるときは、ベクトルも npz に入れて保存し、
+    # 読み込むときに新しい一時ファイルへ書き戻す。保存先のファイルを指定したインデックスはそのファイルを参照する
+    def save(self, path):
+        np.savez(
+            path,
+            kind=self.kind,
+            dim=self.dim,
+            params=json.dumps({"mode": self.mode, "vectors_path": None if self.owns_vectors else self.full.path,
+                               "rerank": self.rerank, "pq_subspaces": self.pq_subspaces, "seed": self.seed},
+                              ensure_ascii=False),
+            codes=self.codes.view,
+            scales=self.scales.view,
+            codebooks=self.codebooks if self.codebooks is not None else np.empty(0, dtype=np.float32),
+            vectors=np.asarray(self.full.matrix) if self.owns_vectors else np.empty((0, self.dim), dtype=np.float32),
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls(int(arrays["dim"]), truncate=False, **json.loads(str(arrays["params"])))
+        if "vectors" in arrays.files and len(arrays["vectors"]):
+            index.full.append(arrays["vectors"])
+        index.codes.extend(arrays["codes"])
+        index.scales.extend(arrays["scales"])
+        if arrays["codebooks"].size:
+            index.codebooks = arrays["codebooks"]
+        return index
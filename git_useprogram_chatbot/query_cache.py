@@ -0,0 +1,83 @@
+import sys
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# 検索結果1件あたりのおおよそのメモリ使用量
+def _result_bytes(results):
+    return sum(sys.getsizeof(candidate) + sys.getsizeof(candidate.id) + sys.getsizeof(candidate.text)
+               for candidate in results)
+
+# キャッシュの利用状況
+class QueryCacheStats:
+    def __init__(self):
+        self.lookups = 0
+        self.embedding_hits = 0
+        self.result_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __str__(self):
+        return (f"{self.lookups} 件中 埋め込みヒット {self.embedding_hits} 件 / 検索結果ヒット {self.result_hits} 件, "
+                f"追い出し {self.evictions} 件, 結果の無効化 {self.invalidations} 件")
+
+# 正規化した質問文 → (質問ベクトル, 上位 k 件の検索結果) の LRU キャッシュ
+# 件数と合計バイト数の両方に上限を持ち、超えたら最も古く使われたものから追い出す
+# 検索結果はインデックスの版数と一緒に保存し、版数が変わっていたら結果だけを捨てる
+class QueryCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.stats = QueryCacheStats()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # キーに対応する (質問ベクトル, 検索結果) を返す。検索結果は版数と k が合うときだけ返す
+    def get(self, key, version, k):
+        self.stats.lookups += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        self.entries.move_to_end(key)
+        self.stats.embedding_hits += 1
+
+        embedding, results, results_version, results_k = entry
+        if results is not None and results_version != version:
+            self._replace(key, embedding, None, None, 0)
+            self.stats.invalidations += 1
+            return embedding, None
+        if results is None or results_k < k:
+            return embedding, None
+        self.stats.result_hits += 1
+        return embedding, results[:k]
+
+    def put(self, key, embedding, results=None, version=None, k=0):
+        self._replace(key, embedding, results, version, k)
+        self.entries.move_to_end(key)
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= self._entry_bytes(evicted)
+            self.stats.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def _entry_bytes(self, entry):
+        embedding, results, _, _ = entry
+        return embedding.nbytes + (_result_bytes(results) if results is not None else 0)
+
+    def _replace(self, key, embedding, results, version, k):
+        old = self.entries.get(key)
+        if old is not None:
+            self.bytes -= self._entry_bytes(old)
+        entry = (embedding, results, version, k)
+        self.entries[key] = entry
+        self.bytes += self._entry_bytes(entry)
+
+    def __str__(self):
+        return f"{len(self.entries)} 件 / {self.bytes / 1024:.1f} KiB ({self.stats})"
@@ -0,0 +1,98 @@
+import time
+import numpy as np
+from precision import DEFAULT_PRECISION, apply_precision
+
+# 多言語（日本語を含む）のクロスエンコーダ。質問と候補を1つの入力として読み、関連度を直接求める
+DEFAULT_RERANKER = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+# 再ランキングする候補の数と、1質問あたりの時間の上限（検索を含む）
+RERANK_TOP_K = 5
+RERANK_BUDGET_MS = 300.0
+RERANK_MAX_LENGTH = 256
+# 再ランキングした場合の回答の閾値（クロスエンコーダの関連度 0〜1 に対するもの）
+RERANK_THRESHOLD = 0.5
+
+# 再ランキングの実行回数・時間切れで省いた回数・合計時間
+class RerankStats:
+    def __init__(self):
+        self.reranked = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        average = self.seconds / self.reranked * 1000 if self.reranked else 0.0
+        return f"再ランキング {self.reranked} 回 (平均 {average:.1f} ms) / 時間切れで省略 {self.skipped} 回"
+
+# 検索で得た上位の候補だけを、質問と候補を組にしてクロスエンコーダで採点し直す
+# 候補はまとめて1回の推論で採点する。1質問の時間が budget_ms を超えそうなときは採点せず、元の順位のまま返す
+# model は AutoModelForSequenceClassification（または推論バックエンド）
+class CrossEncoderReranker:
+    def __init__(self, model, tokenizer, top_k=RERANK_TOP_K, budget_ms=RERANK_BUDGET_MS,
+                 max_length=RERANK_MAX_LENGTH, threshold=RERANK_THRESHOLD):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.top_k = top_k
+        self.budget = budget_ms / 1000
+        self.max_length = max_length
+        self.threshold = threshold
+        self.stats = RerankStats()
+        # 候補1件あたりの採点時間の見積もり（指数移動平均）。時間切れになるかの判定に使う
+        self.pair_seconds = None
+
+    @classmethod
+    def from_pretrained(cls, name=DEFAULT_RERANKER, precision=DEFAULT_PRECISION, backend=None, **kwargs):
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        model = apply_precision(AutoModelForSequenceClassification.from_pretrained(name), precision)
+        if backend is not None:
+            from inference_backend import create_backend
+            model = create_backend(model, backend)
+        return cls(model, AutoTokenizer.from_pretrained(name), **kwargs)
+
+    # 候補を採点する文章（タグやフィードバックの質問を先頭に付ける）
+    @staticmethod
+    def candidate_text(candidate):
+        return f"{candidate.id}: {candidate.text or ''}"
+
+    # (質問, 文章) の組をまとめて採点し、0〜1 の関連度を返す
+    def scores(self, question, texts):
+        import torch
+        inputs = self.tokenizer([question] * len(texts), list(texts), padding=True, truncation="only_second",
+                                max_length=self.max_length, return_tensors="pt")
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits.float()
+        if logits.shape[-1] == 1:
+            return torch.sigmoid(logits[:, 0]).numpy()
+        return torch.softmax(logits, dim=-1)[:, -1].numpy()
+
+    # 起動時に候補 top_k 件分の形でよく使う長さを推論してモデルの準備を済ませ、採点時間の見積もりも作っておく
+    def warm_up(self, lengths=(64, 128, 256)):
+        from inference_backend import warm_up
+        start = time.perf_counter()
+        warm_up(self.model, batch_sizes=(self.top_k,), lengths=[length for length in lengths if length <= self.max_length])
+        scoring = time.perf_counter()
+        self.scores("沼津高専", ["沼津高専: 静岡県沼津市にある高等専門学校"] * self.top_k)
+        self.pair_seconds = (time.perf_counter() - scoring) / self.top_k
+        return time.perf_counter() - start
+
+    # 上位 top_k 件の候補を関連度の順に並べ直し、(候補のリスト, 再ランキングしたか) を返す
+    # started は質問の処理を始めた時刻 (time.perf_counter())。検索にかかった時間も時間の上限に含める
+    # 再ランキングした候補の score はクロスエンコーダの関連度になる
+    def rerank(self, question, candidates, started=None):
+        head, tail = list(candidates[:self.top_k]), list(candidates[self.top_k:])
+        if not head:
+            return candidates, False
+        start = time.perf_counter()
+        elapsed = start - started if started is not None else 0.0
+        estimate = (self.pair_seconds or 0.0) * len(head)
+        if elapsed + estimate > self.budget:
+            self.stats.skipped += 1
+            return candidates, False
+
+        scores = self.scores(question, [self.candidate_text(candidate) for candidate in head])
+        seconds = time.perf_counter() - start
+        pair_seconds = seconds / len(head)
+        self.pair_seconds = pair_seconds if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * pair_seconds
+        self.stats.reranked += 1
+        self.stats.seconds += seconds
+
+        order = np.argsort(-scores, kind="stable")
+        return [head[i]._replace(score=float(scores[i])) for i in order] + tail, True
@@ -0,0 +1,137 @@
+from collections import namedtuple
+from contextlib import nullcontext
+import numpy as np
+from exact_match import normalize_question
+
+FEEDBACK_SOURCE = "フィードバック"
+
+# 検索結果の1件（id はフィードバックなら質問文、セクションならタグ。text は回答として返す文章）
+Candidate = namedtuple("Candidate", ["id", "source", "score", "text"])
+
+# ハイブリッド検索で BM25 のスコアに掛ける重み（残りが埋め込みの類似度）
+DEFAULT_LEXICAL_WEIGHT = 0.3
+
+# 埋め込みの類似度で回答とみなす閾値（元の 768 次元の空間での値）
+SIMILARITY_THRESHOLD = 0.7
+
+# 埋め込みの候補と BM25 の候補を (1 - weight) * 類似度 + weight * BM25 で並べ直す
+# BM25 にしか現れない候補の類似度は dense_score_fn(候補) で実際に計算する。計算できない（None を返す、
+# または dense_score_fn がない）候補は類似度 0 とみなし、search_match の閾値を超えないようにする
+# 埋め込みにしか現れない候補の BM25 は 0 とみなす
+# 混ぜたスコアは並べ替えにだけ使い、score には類似度を残す（search_match の閾値は類似度で判定する）
+def combine_scores(dense, lexical, weight=DEFAULT_LEXICAL_WEIGHT, k=5, dense_score_fn=None):
+    dense_scores = {(candidate.source, candidate.id): candidate for candidate in dense}
+    lexical_scores = {(candidate.source, candidate.id): candidate for candidate in lexical}
+    combined = []
+    for key in list(dense_scores) + [key for key in lexical_scores if key not in dense_scores]:
+        if key in dense_scores:
+            dense_score = dense_scores[key].score
+        else:
+            dense_score = dense_score_fn(lexical_scores[key]) if dense_score_fn is not None else None
+            dense_score = 0.0 if dense_score is None else dense_score
+        lexical_score = lexical_scores[key].score if key in lexical_scores else 0.0
+        candidate = (dense_scores.get(key) or lexical_scores[key])._replace(score=dense_score)
+        combined.append(((1 - weight) * dense_score + weight * lexical_score, candidate))
+    combined.sort(key=lambda item: -item[0])
+    return [candidate for _, candidate in combined[:k]]
+
+# フィードバックとセクションをまとめて検索し、上位 k 件の候補を返す
+# query_cache (QueryCache) があれば、同じ質問の再エンコードと再検索を省く
+# lexical_index (LexicalIndex) があれば、BM25 のスコアを lexical_weight の重みで類似度に混ぜる
+# encode_fn(質問のリスト) を渡すと、質問のベクトル化をそれに任せる（micro_batch でまとめて推論する場合など）
+# 複数のスレッドから検索する場合は lock (threading.Lock) を渡す。キャッシュと索引を参照する間だけロックし、
+# ベクトル化はロックの外で行う。索引を更新する側も同じロックを取ること
+# threshold は search_match が回答とみなす類似度の閾値（次元削減で類似度の値が変わる場合はその空間の値）
+class Retriever:
+    def __init__(self, tokenizer, model, corpus_index=None, feedback_index=None, query_cache=None,
+                 lexical_index=None, lexical_weight=DEFAULT_LEXICAL_WEIGHT, encode_fn=None, lock=None,
+                 threshold=SIMILARITY_THRESHOLD):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.corpus_index = corpus_index
+        self.feedback_index = feedback_index
+        self.query_cache = query_cache
+        self.lexical_index = lexical_index
+        self.lexical_weight = lexical_weight
+        self.encode_fn = encode_fn
+        self.lock = lock if lock is not None else nullcontext()
+        self.threshold = threshold
+
+    # 検索対象の版数（フィードバックが更新されると変わる）
+    @property
+    def version(self):
+        return getattr(self.feedback_index, "version", 0)
+
+    # encoder (torch) は質問をベクトル化するときに読み込む。Candidate だけを使うキーワード検索は torch なしで動く
+    def encode(self, questions):
+        if self.encode_fn is not None:
+            return self.encode_fn(questions)
+        from encoder import encode_texts
+        return encode_texts(questions, self.tokenizer, self.model)
+
+    # 質問ベクトルの行列 (質問数, 次元) から、質問ごとの上位 k 件の候補リストを返す
+    def search_embeddings(self, question_embeddings, k=5):
+        question_embeddings = np.reshape(question_embeddings, (-1, self.model.config.hidden_size))
+        results = [[] for _ in range(len(question_embeddings))]
+
+        if self.feedback_index is not None and len(self.feedback_index) > 0:
+            for candidates, hits in zip(results, self.feedback_index.search_batch(question_embeddings, k)):
+                candidates.extend(Candidate(question, FEEDBACK_SOURCE, score, answer) for question, answer, score in hits)
+
+        if self.corpus_index is not None and len(self.corpus_index) > 0:
+            corpus = self.corpus_index
+            scores, ids = corpus.search(question_embeddings, k)
+            for candidates, row_scores, row_ids in zip(results, scores, ids):
+                candidates.extend(Candidate(corpus.sections[i], corpus.sources[i], float(score), corpus.contents[i])
+                                  for score, i in zip(row_scores, row_ids))
+
+        # 安定ソートなので、同点のときはフィードバック → セクションの順（従来の判定と同じ）になる
+        return [sorted(candidates, key=lambda candidate: -candidate.score)[:k] for candidates in results]
+
+    # BM25 だけが見つけた候補の類似度を返す関数（セクションなら索引の行列から計算し、フィードバックは None）
+    def _dense_score_fn(self, question_embedding):
+        corpus = self.corpus_index
+        if corpus is None or len(corpus) == 0:
+            return None
+        return lambda candidate: corpus.similarity(question_embedding, candidate.source, candidate.id)
+
+    # 質問文とそのベクトルから検索する（BM25 があれば質問文でも検索してスコアを混ぜる）
+    def _search(self, questions, question_embeddings, k):
+        results = self.search_embeddings(question_embeddings, k)
+        if self.lexical_index is None or len(self.lexical_index) == 0:
+            return results
+        return [combine_scores(dense, self.lexical_index.search(question, k), self.lexical_weight, k,
+                               self._dense_score_fn(embedding))
+                for question, embedding, dense in zip(questions, question_embeddings, results)]
+
+    # 複数の質問をまとめてベクトル化し、1回の行列積で検索する
+    def search_batch(self, questions, k=5):
+        if self.query_cache is None:
+            question_embeddings = self.encode(questions)
+            with self.lock:
+                return self._search(questions, question_embeddings, k)
+
+        keys = [normalize_question(question) for question in questions]
+        embeddings, results = [None] * len(questions), [None] * len(questions)
+        with self.lock:
+            for i, key in enumerate(keys):
+                embeddings[i], results[i] = self.query_cache.get(key, self.version, k)
+
+        # キャッシュにない質問だけをまとめてエンコードする
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, self.encode([questions[i] for i in missing])):
+                embeddings[i] = embedding
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            with self.lock:
+                version = self.version
+                searched = self._search([questions[i] for i in pending], np.stack([embeddings[i] for i in pending]), k)
+                for i, result in zip(pending, searched):
+                    results[i] = result
+                    self.query_cache.put(keys[i], embeddings[i], result, version, k)
+        return results
+
+    def search(self, question, k=5):
+        return self.search_batch([question], k)[0]
@@ -0,0 +1,29 @@
+import argparse
+from precision import DEFAULT_PRECISION, PRECISION_MODES
+from projection import DEFAULT_PROJECTION_MODE, PROJECTION_MODES
+from reranker import DEFAULT_RERANKER, RERANK_BUDGET_MS
+
+# 起動時の設定はここにまとめ、torch や transformers を読み込まずに引数を解釈できるようにしておく
+BACKENDS = ("eager", "torchscript", "compile", "onnx")
+DEFAULT_BACKEND = "eager"
+
+# チャットボット共通のコマンドライン引数（各スクリプトは必要なら引数を足してから解釈する）
+def runtime_parser(description="沼津高専チャットボット"):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--precision", choices=PRECISION_MODES, default=DEFAULT_PRECISION, help="推論の精度")
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND, help="推論バックエンド")
+    parser.add_argument("--projection-dim", type=int, default=0, help="埋め込みを次元削減するときの次元数 (0 なら削減しない)")
+    parser.add_argument("--projection", choices=PROJECTION_MODES, default=DEFAULT_PROJECTION_MODE, help="次元削減の方式")
+    parser.add_argument("--reranker", nargs="?", const=DEFAULT_RERANKER, default=None,
+                        help=f"上位の候補をクロスエンコーダで採点し直す (モデル名を省略すると {DEFAULT_RERANKER})")
+    parser.add_argument("--rerank-budget-ms", type=float, default=RERANK_BUDGET_MS, help="再ランキングを含む1質問の時間の上限")
+    parser.add_argument("--query-encoder", default=None, help="質問のベクトル化に使う蒸留済みの生徒モデル (distill_student.py で作成)")
+    parser.add_argument("--mmap-weights", action="store_true",
+                        help="safetensors の重みを読み取り専用で mmap して読み込む (同じホストのプロセス間でページを共有する)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="起動時間の内訳 (import・データ・索引・モデル) を記録し、読み込みが終わったら表示する")
+    return parser
+
+# 起動時のコマンドライン引数から推論の精度とバックエンドを選ぶ（例: python learndata7.py --precision int8 --backend torchscript）
+def runtime_args(argv=None):
+    return runtime_parser().parse_args(argv)
@@ -0,0 +1,42 @@
+import torch
+from transformers import AutoModelForQuestionAnswering
+from precision import DEFAULT_PRECISION, apply_precision
+
+# state_dict に含まれるテンソルの合計バイト数（量子化した Linear の重みはタプルに入っている）
+def state_dict_bytes(model):
+    seen, total = set(), 0
+    pending = list(model.state_dict().values())
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (tuple, list)):
+            pending.extend(value)
+        elif isinstance(value, torch.Tensor) and value.data_ptr() not in seen:
+            seen.add(value.data_ptr())
+            total += value.numel() * value.element_size()
+    return total
+
+# 1つのエンコーダ（xlm-roberta-base）に、埋め込み（平均プーリング）と質問応答（開始・終了位置）の2つのヘッドを載せたモデル
+# AutoModel と AutoModelForQuestionAnswering を別々に読み込むとエンコーダの重みが2重にメモリに載るので、
+# 質問応答モデルのエンコーダ部分をそのまま埋め込み用に使う
+# precision で推論の精度（fp32 / int8 / bf16）を選ぶ。エンコーダは共有なので両方のヘッドに同じ精度が適用される
+class SharedEncoderModel:
+    def __init__(self, qa_model, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.qa_model = apply_precision(qa_model, precision)
+        # 埋め込み用のエンコーダ（質問応答モデルと重みを共有している）
+        self.backbone = qa_model.base_model
+        self.config = qa_model.config
+
+    # mmap=True なら safetensors の重みを読み取り専用で mmap したまま使う（mapped_weights.mmap_pretrained）
+    # int8 では量子化した Linear の重みが新しく作られるので、mmap のまま共有できるのは埋め込み層などに限られる
+    @classmethod
+    def from_pretrained(cls, name, precision=DEFAULT_PRECISION, mmap=False, **kwargs):
+        if mmap:
+            from mapped_weights import mmap_pretrained
+            return cls(mmap_pretrained(AutoModelForQuestionAnswering, name, **kwargs), precision)
+        return cls(AutoModelForQuestionAnswering.from_pretrained(name, **kwargs), precision)
+
+    # 重みの合計バイト数（共有している重みは1回だけ数える。int8 に量子化した重みも含む）
+    @property
+    def parameter_bytes(self):
+        return state_dict_bytes(self.qa_model)
@@ -0,0 +1,108 @@
+import builtins
+import threading
+import time
+from contextlib import contextmanager
+
+# 起動時間の内訳の種類（phase() の kind）
+PHASE_KINDS = {"import": "import", "data": "データ", "index": "索引", "model": "モデル", "warmup": "準備"}
+# import の時間を表示するパッケージの数と、表示する最小の時間（読み込み済みのモジュールの import は除く）
+TOP_IMPORTS = 15
+MIN_IMPORT_SECONDS = 0.001
+
+# 起動時間の内訳（モジュールの import・データの読み込み・索引の構築・モデルの読み込み）を記録して表示する
+# enable() を呼ぶまでは何も記録しないので、普段の起動には影響しない
+# import の時間は builtins.__import__ を包んでトップレベルのパッケージごとに集計する（中で import したものの時間は除く）
+class StartupProfile:
+    def __init__(self):
+        # このモジュールを読み込んだ時刻を起点にする（起動スクリプトが最初に import する）
+        self.start = time.perf_counter()
+        self.enabled = False
+        self.reported = False
+        self.phases = []
+        self.imports = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self._import = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        # ここまでの import（起動スクリプトの先頭で読み込んだ軽いモジュール）はまとめて1つの項目にする
+        self.phases.append(["import", "起動スクリプトの import", threading.current_thread().name, 0.0,
+                            time.perf_counter() - self.start])
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def disable(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+        self.enabled = False
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # 相対 import は呼び出し元のパッケージの時間に含める
+        if level:
+            return self._import(name, globals, locals, fromlist, level)
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            seconds = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += seconds
+            package = name.partition(".")[0]
+            with self.lock:
+                self.imports[package] = self.imports.get(package, 0.0) + seconds - children
+
+    # with profile.phase("model", "xlm-roberta-base"): ... の形で、ブロックにかかった時間を記録する
+    # バックグラウンドのスレッドからも使える（スレッド名も記録する）
+    @contextmanager
+    def phase(self, kind, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        record = [kind, name, threading.current_thread().name, start - self.start, None]
+        with self.lock:
+            self.phases.append(record)
+        try:
+            yield
+        finally:
+            record[4] = time.perf_counter() - start
+
+    def report(self):
+        self.reported = True
+        with self.lock:
+            phases = [list(record) for record in self.phases]
+            imports = sorted(((package, seconds) for package, seconds in self.imports.items()
+                              if seconds >= MIN_IMPORT_SECONDS), key=lambda item: -item[1])
+        print(f"\n=== 起動時間の内訳 (計測開始から {time.perf_counter() - self.start:.2f} 秒) ===")
+        totals = {}
+        for kind, name, thread, offset, seconds in phases:
+            label = PHASE_KINDS.get(kind, kind)
+            if seconds is None:
+                print(f"[{label}] {name:<32} 実行中          (+{offset:6.2f} 秒, {thread})")
+                continue
+            totals[label] = totals.get(label, 0.0) + seconds
+            print(f"[{label}] {name:<32} {seconds:8.3f} 秒  (+{offset:6.2f} 秒, {thread})")
+        imported = sum(seconds for _, seconds in imports)
+        totals[PHASE_KINDS["import"]] = totals.get(PHASE_KINDS["import"], 0.0) + imported
+        print("--- 種類ごとの合計 (import はモデルの読み込みなどの途中のものも含む) ---")
+        print(" / ".join(f"{label} {seconds:.2f} 秒" for label, seconds in totals.items()))
+        if imports:
+            print(f"--- import の時間 (上位 {TOP_IMPORTS} パッケージ, 中で import したものを除く) ---")
+            for package, seconds in imports[:TOP_IMPORTS]:
+                print(f"{package:<24} {seconds:8.3f} 秒")
+
+# プロセス全体で1つの記録を共有する
+PROFILE = StartupProfile()
+
+def phase(kind, name):
+    return PROFILE.phase(kind, name)
+
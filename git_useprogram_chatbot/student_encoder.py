@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import time
+from types import SimpleNamespace
+import numpy as np
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+from encoder import encode_texts, masked_mean_pooling
+from passage_reader import split_sentences
+
+# 生徒モデル（質問のベクトル化だけに使う小さなエンコーダ）の既定の大きさ
+STUDENT_DIM = 256
+STUDENT_LAYERS = 2
+STUDENT_HEADS = 4
+STUDENT_MAX_LENGTH = 64
+# 蒸留の学習設定
+DISTILL_EPOCHS = 30
+DISTILL_BATCH_SIZE = 32
+DISTILL_LEARNING_RATE = 5e-4
+
+# セクションのタイトルから作る言い換えの質問
+TITLE_TEMPLATES = ("{}について教えてください", "{}とは何ですか", "{}はどうなっていますか", "{}を知りたいです", "{}")
+# フィードバックの質問の言い回しを置き換えて作る言い換え
+SUBSTITUTIONS = (("教えてください", "教えて"), ("ですか", "？"), ("は何ですか", "とは"), ("ありますか", "ある？"),
+                 ("どこにありますか", "どこ"), ("ください", ""), ("？", ""), ("?", ""))
+# 本文から取り出す文の最大文字数（質問に近い短い文だけを使う）
+MAX_SENTENCE_CHARS = 80
+
+# 教師（xlm-roberta-base）と同じトークナイザの出力をそのまま受け取り、教師と同じ次元の埋め込みを返す小さなエンコーダ
+# 語彙は蒸留に使った文章に現れたサブワードだけに絞り（それ以外は <unk> にする）、埋め込み層を小さくしている
+# 出力は教師の last_hidden_state と同じ形なので、encode_texts や推論バックエンドにそのまま渡せる
+class StudentEncoder(torch.nn.Module):
+    def __init__(self, id_map, vocab_size, hidden_size, pad_token_id, dim=STUDENT_DIM, layers=STUDENT_LAYERS,
+                 heads=STUDENT_HEADS, max_length=STUDENT_MAX_LENGTH, name_or_path="student"):
+        super().__init__()
+        self.max_length = max_length
+        self.name_or_path = name_or_path
+        self.config = SimpleNamespace(hidden_size=hidden_size, pad_token_id=pad_token_id, vocab_size=vocab_size,
+                                      dim=dim, layers=layers, heads=heads, max_length=max_length)
+        # 教師のトークン id → 生徒の語彙の id
+        self.register_buffer("id_map", torch.as_tensor(id_map, dtype=torch.long))
+        self.embeddings = torch.nn.Embedding(vocab_size, dim)
+        self.positions = torch.nn.Embedding(max_length, dim)
+        layer = torch.nn.TransformerEncoderLayer(dim, heads, dim * 4, dropout=0.1, activation="gelu",
+                                                 batch_first=True, norm_first=True)
+        self.encoder = torch.nn.TransformerEncoder(layer, layers, enable_nested_tensor=False)
+        self.norm = torch.nn.LayerNorm(dim)
+        self.projection = torch.nn.Linear(dim, hidden_size)
+
+    # max_length を超える位置は最後の位置の埋め込みを使い回す（出力の長さは入力と同じにする）
+    def forward(self, input_ids, attention_mask=None, return_dict=True, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        positions = torch.arange(input_ids.shape[1], device=input_ids.device).clamp(max=self.max_length - 1)
+        hidden = self.embeddings(self.id_map[input_ids]) + self.positions(positions)
+        hidden = self.encoder(hidden, src_key_padding_mask=attention_mask == 0)
+        # 平均プーリングは線形なので、トークンごとに教師の次元へ写してから平均しても結果は同じ
+        last_hidden_state = self.projection(self.norm(hidden))
+        if not return_dict:
+            return (last_hidden_state,)
+        return BaseModelOutput(last_hidden_state=last_hidden_state)
+
+    @property
+    def parameter_count(self):
+        return sum(parameter.numel() for parameter in self.parameters())
+
+    def save(self, path):
+        arrays = {f"state/{name}": tensor.numpy() for name, tensor in self.state_dict().items()}
+        params = {name: getattr(self.config, name) for name in ("hidden_size", "pad_token_id", "vocab_size", "dim",
+                                                                "layers", "heads", "max_length")}
+        np.savez(path, params=json.dumps(params), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            params = json.loads(str(arrays["params"]))
+            state = {name[len("state/"):]: torch.from_numpy(arrays[name]) for name in arrays.files
+                     if name.startswith("state/")}
+        model = cls(state["id_map"], name_or_path=os.path.abspath(path), **params)
+        model.load_state_dict(state)
+        return model.eval()
+
+# 蒸留に使う文章の語彙だけを残した、教師の id → 生徒の id の対応表と、残した教師の id のリスト
+# 特殊トークンは必ず残し、現れなかったサブワードは <unk> に寄せる
+def build_vocabulary(token_ids, tokenizer):
+    kept = sorted(set(tokenizer.all_special_ids) | {token for ids in token_ids for token in ids})
+    id_map = np.full(len(tokenizer), kept.index(tokenizer.unk_token_id), dtype=np.int64)
+    id_map[kept] = np.arange(len(kept))
+    return id_map, kept
+
+# 教師の単語埋め込みのうち残したサブワードの行を、主成分分析で dim 次元に縮めて生徒の埋め込みの初期値にする
+def init_embeddings(teacher, kept, dim):
+    weight = teacher.get_input_embeddings().weight.detach()[kept].float()
+    centered = weight - weight.mean(dim=0)
+    _, _, components = torch.linalg.svd(centered, full_matrices=False)
+    reduced = centered @ components[:dim].T
+    return reduced / reduced.std() * 0.02
+
+# フィードバックの質問の言い換え（言い回しを1つずつ置き換えたもの）
+def paraphrases(question):
+    variants = []
+    for old, new in SUBSTITUTIONS:
+        if old in question:
+            variant = question.replace(old, new).strip()
+            if variant and variant != question:
+                variants.append(variant)
+    return variants
+
+# 蒸留に使う文章: フィードバックの質問とその言い換え、セクションのタイトルとそこから作った質問、本文の短い文
+def distillation_texts(sources, questions=()):
+    texts = []
+    for question in questions:
+        texts.append(question)
+        texts.extend(paraphrases(question))
+    for _, data in sources:
+        for section, content in data.items():
+            texts.extend(template.format(section) for template in TITLE_TEMPLATES)
+            texts.extend(sentence.strip() for sentence in split_sentences(content)
+                         if len(sentence.strip()) <= MAX_SENTENCE_CHARS)
+    return list(dict.fromkeys(text for text in texts if text))
+
+# 教師の平均プーリング埋め込みに生徒の埋め込みを近づける（コサイン類似度の損失）
+# 生徒は CPU で数分程度で学習できる大きさにしている。戻り値は (生徒モデル, エポックごとの平均損失)
+def distill(teacher, tokenizer, texts, dim=STUDENT_DIM, layers=STUDENT_LAYERS, heads=STUDENT_HEADS,
+            max_length=STUDENT_MAX_LENGTH, epochs=DISTILL_EPOCHS, batch_size=DISTILL_BATCH_SIZE,
+            learning_rate=DISTILL_LEARNING_RATE, seed=0, log=print):
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    targets = torch.from_numpy(encode_texts(texts, tokenizer, teacher, truncation=True))
+    log(f"教師の埋め込み: {len(texts)} 件 {time.perf_counter() - start:.1f} 秒")
+
+    token_ids = tokenizer(list(texts), truncation=True, max_length=max_length)["input_ids"]
+    id_map, kept = build_vocabulary(token_ids, tokenizer)
+    student = StudentEncoder(id_map, len(kept), teacher.config.hidden_size, tokenizer.pad_token_id, dim, layers,
+                             heads, max_length)
+    with torch.no_grad():
+        student.embeddings.weight.copy_(init_embeddings(teacher, kept, dim))
+    log(f"生徒モデル: 語彙 {len(kept)} / パラメータ {student.parameter_count / 1e6:.1f} M")
+
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate)
+    steps = epochs * math.ceil(len(texts) / batch_size)
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, learning_rate, total_steps=steps)
+    losses = []
+    student.train()
+    for epoch in range(epochs):
+        order = rng.permutation(len(texts))
+        total = 0.0
+        for begin in range(0, len(order), batch_size):
+            indices = order[begin:begin + batch_size]
+            batch = tokenizer.pad({"input_ids": [token_ids[i] for i in indices]}, return_tensors="pt")
+            hidden = student(batch["input_ids"], batch["attention_mask"]).last_hidden_state
+            pooled = masked_mean_pooling(hidden, batch["attention_mask"])
+            loss = (1 - torch.nn.functional.cosine_similarity(pooled, targets[indices], dim=1)).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total += loss.item() * len(indices)
+        losses.append(total / len(texts))
+        log(f"エポック {epoch + 1}/{epochs}: 損失 {losses[-1]:.4f}")
+    return student.eval(), losses
@@ -0,0 +1,51 @@
+import io
+import numpy as np
+from ann_index import ExactIndex, IVFIndex, load_index, top_k, top_k_batch
+
+# 各行の上位 k 件をスコアの降順で返し、同点なら位置の小さい方を先にする
+def test_top_k_batch_order_and_ties():
+    scores = np.array([[0.1, 0.9, 0.5, 0.9, 0.2],
+                       [0.3, 0.3, 0.3, 0.3, 0.3]], dtype=np.float32)
+    values, positions = top_k_batch(scores, 3)
+    assert positions.tolist() == [[1, 3, 2], [0, 1, 2]]
+    assert np.allclose(values, [[0.9, 0.9, 0.5], [0.3, 0.3, 0.3]])
+
+# 全件のソート（安定ソート）と同じ結果になる
+def test_top_k_batch_matches_stable_sort():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, size=(50, 40)).astype(np.float32)
+    for k in (1, 5, 40):
+        _, positions = top_k_batch(scores, k)
+        assert positions.tolist() == np.argsort(-scores, axis=1, kind="stable")[:, :k].tolist()
+
+# k が件数を超えても、空でも壊れない
+def test_top_k_edge_cases():
+    values, positions = top_k(np.array([0.2, 0.8], dtype=np.float32), 5)
+    assert positions.tolist() == [1, 0]
+    values, positions = top_k_batch(np.empty((2, 0), dtype=np.float32), 3)
+    assert values.shape == (2, 0) and positions.shape == (2, 0)
+
+def round_trip(index):
+    buffer = io.BytesIO()
+    index.save(buffer)
+    buffer.seek(0)
+    return load_index(buffer)
+
+# 保存して読み込んだ索引は、同じ質問に同じ結果を返す
+def test_exact_and_ivf_round_trip():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(600, 16)).astype(np.float32)
+    queries = rng.normal(size=(10, 16)).astype(np.float32)
+    untrained = IVFIndex(16, nlist=64)
+    untrained.add(vectors[:100])
+    trained = IVFIndex(16, nlist=4, nprobe=2)
+    trained.add(vectors)
+    exact = ExactIndex(16)
+    exact.add(vectors)
+    assert trained.is_trained and not untrained.is_trained
+    for index in (exact, untrained, trained):
+        loaded = round_trip(index)
+        assert type(loaded) is type(index) and len(loaded) == len(index)
+        for query in queries:
+            expected, loaded_result = index.search(query, 5), loaded.search(query, 5)
+            assert np.allclose(expected[0], loaded_result[0]) and expected[1].tolist() == loaded_result[1].tolist()
@@ -0,0 +1,62 @@
+import os
+from types import SimpleNamespace
+import pytest
+import chatbot_server
+from chatbot_server import ChatbotService
+from inference_backend import batch_buckets_upto, warm_up
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# --lexical-only のサービス（モデルを読み込まないので torch なしで動く）
+@pytest.fixture(scope="module")
+def lexical_service():
+    previous = os.getcwd()
+    os.chdir(PACKAGE_DIR)
+    try:
+        service = ChatbotService(lexical_only=True)
+    finally:
+        os.chdir(previous)
+    yield service
+    service.close()
+
+# 索引にない語（量子・コンピュータ）を含む質問に、「とは」だけが一致する定義を答えない
+def test_lexical_only_rejects_unrelated_question(lexical_service):
+    answer, source, _ = lexical_service.quick("量子コンピュータとは")
+    assert answer is None
+    result, source = lexical_service.search("量子コンピュータとは")
+    assert source == "lexical"
+    assert result.best is None
+
+def test_lexical_only_answers_known_question(lexical_service):
+    result, _ = lexical_service.search("制服はありますか")
+    assert result.best is not None and result.best.id == "制服はありますか？"
+
+# 形だけを記録するバックエンド（warm_up が通すバッチ数 × 系列長を調べる）
+class RecordingBackend:
+    def __init__(self):
+        self.config = SimpleNamespace(pad_token_id=1)
+        self.shapes = []
+
+    def __call__(self, input_ids, attention_mask):
+        self.shapes.append(tuple(input_ids.shape))
+
+# --max-batch 8 のサーバーは 2〜8 件のバッチも起動時に準備し、最初のまとめた推論でコンパイルしない
+def test_server_warms_every_batch_bucket(monkeypatch):
+    calls = []
+
+    # 引数だけを記録して、モデルは読み込まない
+    def load_models(*args, **kwargs):
+        calls.append(kwargs)
+        raise RuntimeError("読み込まない")
+
+    monkeypatch.setattr(chatbot_server, "load_models", load_models)
+    service = SimpleNamespace(lexical_index=None, max_batch=8)
+    with pytest.raises(RuntimeError):
+        ChatbotService._load_models(service, {}, {}, [], {"backend": "compile"}, print)
+    assert calls[0]["max_batch"] == 8
+
+    backend = RecordingBackend()
+    warm_up(backend, batch_sizes=batch_buckets_upto(calls[0]["max_batch"]))
+    assert {batch for batch, _ in backend.shapes} == {1, 2, 4, 8}
+    assert max(length for _, length in backend.shapes) > 64
+    assert batch_buckets_upto(1) == (1,)
@@ -0,0 +1,53 @@
+import numpy as np
+from corpus_index import CorpusIndex
+
+# 変更前の find_similar_question と同じ判定（ソースごと・セクション順に走査し、閾値を超えて初めて上回ったものを残す）
+def loop_best_answer(question, sources, threshold):
+    max_similarity, best_answer = threshold, None
+    for data in sources:
+        for content, title_vector, content_vector in data:
+            cosine = lambda vector: float(vector @ question / (np.linalg.norm(vector) * np.linalg.norm(question)))
+            section_similarity, content_similarity = cosine(title_vector), cosine(content_vector)
+            if section_similarity > max_similarity or content_similarity > max_similarity:
+                max_similarity = max(section_similarity, content_similarity)
+                best_answer = content
+    return best_answer
+
+def index_best_answer(index, question, threshold):
+    scores, ids = index.search(question[None, :], k=1)
+    return index.contents[ids[0][0]] if scores[0][0] > threshold else None
+
+def build(sources):
+    sections, contents, tags, titles, bodies = [], [], [], [], []
+    for tag, data in enumerate(sources):
+        for i, (content, title_vector, content_vector) in enumerate(data):
+            sections.append(f"{tag}-{i}")
+            contents.append(content)
+            tags.append(str(tag))
+            titles.append(title_vector)
+            bodies.append(content_vector)
+    return CorpusIndex(sections, contents, tags, np.array(titles), np.array(bodies))
+
+# ランダムな質問で、従来のセクションごとのループと同じ回答を選ぶ
+def test_same_best_answer_as_section_loops():
+    rng = np.random.default_rng(0)
+    sources = [[(f"wiki{i}", rng.normal(size=8), rng.normal(size=8)) for i in range(20)],
+               [(f"rec{i}", rng.normal(size=8), rng.normal(size=8)) for i in range(10)]]
+    index = build(sources)
+    for _ in range(200):
+        question = rng.normal(size=8).astype(np.float32)
+        for threshold in (-1.0, 0.3, 0.7):
+            assert index_best_answer(index, question, threshold) == loop_best_answer(question, sources, threshold)
+
+# 同点なら先に現れたセクション（Wikipedia → 推薦選抜の順）を選ぶ
+def test_tie_prefers_first_section():
+    vector = np.array([1.0, 0.0], dtype=np.float32)
+    other = np.array([0.0, 1.0], dtype=np.float32)
+    sources = [[("first-other", other, other), ("first", other, vector)], [("second", vector, other)]]
+    index = build(sources)
+    assert loop_best_answer(vector, sources, 0.7) == "first"
+    assert index_best_answer(index, vector, 0.7) == "first"
+
+    # 同点が多くても（argpartition が後ろの方を選びうる場合でも）最初のセクションになる
+    sources = [[(f"same{i}", vector, vector) for i in range(64)], [("second", vector, vector)]]
+    assert index_best_answer(build(sources), vector, 0.7) == loop_best_answer(vector, sources, 0.7) == "same0"
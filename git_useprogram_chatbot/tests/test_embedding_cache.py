@@ -0,0 +1,85 @@
+import multiprocessing
+import numpy as np
+import pytest
+from embedding_cache import EmbeddingCache
+
+DIM = 8
+WORKERS = 4
+TEXTS_PER_WORKER = 20
+
+# テキストごとに決まったベクトル（別のテキストの行を返したら分かる）
+def vector(text):
+    return np.full(DIM, sum(map(ord, text)) % 997, dtype=np.float32) + np.arange(DIM, dtype=np.float32)
+
+def encode(texts):
+    return np.stack([vector(text) for text in texts])
+
+# 各ワーカーは共通の質問と自分だけの質問を1件ずつ追記する（prefork のワーカーが評価を反映するのと同じ）
+def worker(cache, slot):
+    for text in [f"共通の質問 {i}" for i in range(5)] + [f"ワーカー {slot} の質問 {i}" for i in range(TEXTS_PER_WORKER)]:
+        cache.get_or_encode([text], encode)
+
+# fork したワーカーが親の EmbeddingCache を引き継いで同時に追記しても、行が重ならない
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="fork が使えない")
+def test_forked_workers_append_to_one_journal(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "tiny")
+    cache.get_or_encode(["起動時の質問"], encode)
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=worker, args=(cache, slot)) for slot in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    reopened = EmbeddingCache(str(tmp_path), "tiny")
+    texts = (["起動時の質問"] + [f"共通の質問 {i}" for i in range(5)]
+             + [f"ワーカー {slot} の質問 {i}" for slot in range(WORKERS) for i in range(TEXTS_PER_WORKER)])
+    # 共通の質問も1回だけ書かれている
+    assert len(reopened) == len(texts)
+    assert reopened.journal_rows == len(texts)
+    found = reopened.get(texts)
+    for text in texts:
+        np.testing.assert_array_equal(found[text], vector(text))
+
+# 別のインスタンスが追記したベクトルも get で読める
+def test_get_sees_rows_appended_by_another_instance(tmp_path):
+    first = EmbeddingCache(str(tmp_path), "tiny")
+    second = EmbeddingCache(str(tmp_path), "tiny")
+    first.add(["a", "b"], encode(["a", "b"]))
+    second.add(["b", "c"], encode(["b", "c"]))
+    assert second.journal_rows == 3
+    found = first.get(["a", "b", "c"])
+    for text in "abc":
+        np.testing.assert_array_equal(found[text], vector(text))
+
+# 他のプロセスがまとめ直した後も、古い行番号でジャーナルを読まない
+@pytest.mark.parametrize("added", [["d", "e", "f", "g"], []])
+def test_get_after_another_instance_compacts(tmp_path, added):
+    first = EmbeddingCache(str(tmp_path), "tiny")
+    first.add(["a", "b", "c"], encode(["a", "b", "c"]))
+    second = EmbeddingCache(str(tmp_path), "tiny")
+    assert second.garbage_collect(["b", "c"]) == 1
+    if added:
+        second.add(added, encode(added))
+
+    found = first.get(["a", "b", "c"] + added)
+    assert "a" not in found
+    for text in ["b", "c"] + added:
+        np.testing.assert_array_equal(found[text], vector(text))
+    # まとめ直した後に first が追記しても、second の行を上書きしない
+    first.add(["h"], encode(["h"]))
+    found = second.get(["b", "c", "h"] + added)
+    for text in ["b", "c", "h"] + added:
+        np.testing.assert_array_equal(found[text], vector(text))
+
+# まとめ直しの後に作ったインスタンスは、シャードとジャーナルの両方から読む
+def test_reopen_after_compact(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "tiny")
+    cache.add(["a", "b"], encode(["a", "b"]))
+    cache.compact()
+    cache.add(["c"], encode(["c"]))
+    reopened = EmbeddingCache(str(tmp_path), "tiny")
+    found = reopened.get(["a", "b", "c"])
+    for text in "abc":
+        np.testing.assert_array_equal(found[text], vector(text))
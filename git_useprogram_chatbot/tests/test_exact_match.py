@@ -0,0 +1,31 @@
+from exact_match import HUMAN_ANSWER_RATING, ExactMatchIndex, normalize_question, rated_answer
+
+# 全角・半角、大文字・小文字、空白、句読点・記号の違いは同じ質問とみなす
+def test_normalize_question():
+    assert normalize_question("ＡＩとは？") == normalize_question("ai とは") == "aiとは"
+    assert normalize_question(" 学費は、いくら！ ") == "学費はいくら"
+    assert normalize_question("ｶﾞｸﾋ") == "ガクヒ"
+    assert normalize_question("？！") == ""
+
+# 改善回答があればそれを最高評価で使い、なければボットの回答と評価（不明なら既定値）を使う
+def test_rated_answer():
+    assert rated_answer({"bot_answer": "a", "human_answer": "b", "rating": 1}) == ("b", HUMAN_ANSWER_RATING)
+    assert rated_answer({"bot_answer": "a", "human_answer": "", "rating": 1}) == ("a", 1)
+    assert rated_answer({"bot_answer": "a"}) == ("a", 3)
+
+# 評価の低い回答は返さず、同じ質問なら評価の高い回答（同じ評価なら新しい回答）を残す
+def test_exact_match_rating_rules():
+    index = ExactMatchIndex([
+        {"question": "制服はありますか？", "bot_answer": "古い回答", "rating": 4},
+        {"question": "制服は ありますか", "bot_answer": "新しい回答", "rating": 4},
+        {"question": "制服はありますか", "bot_answer": "低い評価", "rating": 2},
+        {"question": "寮はありますか", "bot_answer": "だめな回答", "rating": 1},
+        {"question": "校歌は？", "bot_answer": "だめな回答", "rating": 1, "human_answer": "直した回答"},
+        {"question": "？", "bot_answer": "空の質問"},
+    ])
+    assert len(index) == 3
+    assert index.lookup("制服はありますか") == "新しい回答"
+    assert index.lookup("寮はありますか？") is None
+    assert index.lookup("校歌は") == "直した回答"
+    assert index.lookup("知らない質問") is None
+    assert (index.stats.hits, index.stats.lookups) == (2, 4)
@@ -0,0 +1,58 @@
+import inspect
+import os
+from types import SimpleNamespace
+import learndata7
+from retriever import FEEDBACK_SOURCE, Candidate
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOAD_MODELS = inspect.signature(learndata7.load_models)
+
+# BackgroundLoader の代わりに、渡された読み込み関数を覚えておくだけのもの
+class RecordingLoader:
+    instances = []
+
+    def __init__(self, load_fn, name="model-loader"):
+        self.load_fn = load_fn
+        RecordingLoader.instances.append(self)
+
+    def flush(self):
+        pass
+
+    def result_if_ready(self):
+        return None
+
+# chatbot() の読み込みのスレッドは log を log に渡し、qa_reader は既定の False のままにする
+def test_chatbot_loader_binds_log(monkeypatch, capsys):
+    calls = []
+    monkeypatch.chdir(PACKAGE_DIR)
+    monkeypatch.setattr(learndata7, "BackgroundLoader", RecordingLoader)
+    monkeypatch.setattr(learndata7, "load_models", lambda *args, **kwargs: calls.append((args, kwargs)))
+    monkeypatch.setattr("builtins.input", lambda prompt="": "exit")
+    RecordingLoader.instances.clear()
+    learndata7.chatbot(precision="int8", mmap_weights=True)
+
+    log = object()
+    RecordingLoader.instances[0].load_fn(log)
+    args, kwargs = calls[0]
+    bound = LOAD_MODELS.bind(*args, **kwargs)
+    bound.apply_defaults()
+    assert bound.arguments["log"] is log
+    assert bound.arguments["qa_reader"] is False
+    assert bound.arguments["precision"] == "int8"
+    assert bound.arguments["mmap_weights"] is True
+
+# フィードバックの回答は完全一致の高速パスと同じ評価の規則で選ぶ
+def test_feedback_answer_rating_rule():
+    assert learndata7.feedback_answer({"bot_answer": "a", "human_answer": "b", "rating": 1}) == "b"
+    assert learndata7.feedback_answer({"bot_answer": "a", "human_answer": None, "rating": 4}) == "a"
+    assert learndata7.feedback_answer({"bot_answer": "a"}) == "a"
+    assert learndata7.feedback_answer({"bot_answer": "a", "human_answer": "", "rating": 2}) is None
+
+# 低評価で改善回答のないフィードバックが最上位なら、埋め込み検索でもその回答を返さない
+def test_search_match_skips_unrated_feedback():
+    entry = {"question": "寮はありますか", "bot_answer": "間違った回答", "rating": 1, "human_answer": None}
+    candidate = Candidate(entry["question"], FEEDBACK_SOURCE, 0.95, learndata7.feedback_answer(entry))
+    retriever = SimpleNamespace(search=lambda question, k: [candidate])
+    assert learndata7.search_match("寮はありますか？", retriever, threshold=0.7).best is None
+    retriever = SimpleNamespace(search=lambda question, k: [candidate._replace(text="正しい回答")])
+    assert learndata7.search_match("寮はありますか？", retriever, threshold=0.7).best.text == "正しい回答"
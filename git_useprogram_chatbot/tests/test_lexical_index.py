@@ -0,0 +1,41 @@
+import os
+import pytest
+from learndata7 import feedback_answer, load_feedback_data, load_json_data, quick_answer, search_match
+from lexical_index import LEXICAL_THRESHOLD, LexicalIndex, build_lexical_index
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def data_path(name):
+    return os.path.join(PACKAGE_DIR, "data", name)
+
+@pytest.fixture(scope="module", params=["auto", "bigram"])
+def lexical_index(request):
+    data = load_json_data(data_path("wikipedia_sections.json"))
+    recommendation_data = load_json_data(data_path("numazu_recommendation_selection_retry.json"))
+    feedback_data = load_feedback_data(data_path("feedback.json"))
+    return build_lexical_index([("Wikipedia", data), ("推薦選抜", recommendation_data)], feedback_data,
+                               tokenizer=request.param, answer_fn=feedback_answer)
+
+# 索引にない語（学費）を無視すると「寮の費用はいくらですか？」の回答を返してしまう
+def test_unseen_term_blocks_quick_answer(lexical_index):
+    assert quick_answer("学費はいくら？", lexical_index=lexical_index) is None
+
+# --lexical-only の検索でも、「とは」だけが一致する文書は答えにしない
+def test_unseen_terms_block_lexical_search(lexical_index):
+    result = search_match("量子コンピュータとは", lexical_index, threshold=LEXICAL_THRESHOLD)
+    assert result.best is None
+
+# すべての語が一致する質問は、これまでどおりモデルを使わずに答える
+def test_matching_question_is_answered(lexical_index):
+    answer, score = lexical_index.best_answer("制服はありますか")
+    assert answer == feedback_answer(next(entry for entry in load_feedback_data(data_path("feedback.json"))
+                                          if entry.get("question") == "制服はありますか？"))
+    assert score > LEXICAL_THRESHOLD
+
+# 一致しない語は出現文書数 0 の idf で正規化の合計に入る
+def test_unseen_term_counts_in_ideal():
+    index = LexicalIndex("bigram").add_many([(0, "s", "りんご", "a"), (1, "s", "みかん", "b")])
+    _, seen = index.scores("りんご")
+    _, mixed = index.scores("りんごぶどう")
+    assert mixed > seen
+    assert index.search("りんご")[0].score > index.search("りんごぶどう")[0].score
@@ -0,0 +1,39 @@
+import threading
+import pytest
+from micro_batch import MicroBatcher
+
+# 待っている間に取り消された要求は飛ばし、残りの要求を処理し続ける
+def test_cancelled_request_is_skipped():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def batch_fn(items):
+        calls.append(items)
+        if items == ["block"]:
+            started.set()
+            release.wait(5)
+        return [item.upper() for item in items]
+
+    with MicroBatcher(batch_fn, max_batch=1, max_wait_ms=0) as batcher:
+        blocking = batcher.submit("block")
+        assert started.wait(5)
+        cancelled = batcher.submit("cancel")
+        assert cancelled.cancel()
+        kept = batcher.submit("keep")
+        release.set()
+        assert blocking.result(5) == "BLOCK"
+        assert kept.result(5) == "KEEP"
+    assert ["cancel"] not in calls
+    assert not batcher.thread.is_alive()
+
+# 例外はそのバッチの全員に返し、スレッドは止まらない
+def test_exception_is_returned_to_batch():
+    def batch_fn(items):
+        if "bad" in items:
+            raise ValueError("bad")
+        return items
+
+    with MicroBatcher(batch_fn, max_batch=1, max_wait_ms=0) as batcher:
+        with pytest.raises(ValueError):
+            batcher("bad")
+        assert batcher("good") == "good"
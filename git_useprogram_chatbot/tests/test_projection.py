@@ -0,0 +1,57 @@
+import io
+import numpy as np
+from ann_index import create_index, load_index
+from projection import Projection
+
+# 共通の向きが強い（平均プーリングの埋め込みに似た）ベクトル
+def biased_vectors(count=300, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    common = np.zeros(dim, dtype=np.float32)
+    common[0] = 8.0
+    return (common + rng.normal(size=(count, dim))).astype(np.float32)
+
+def pair_similarities(vectors):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors @ vectors.T)[np.triu_indices(len(vectors), k=1)]
+
+# whiten は類似度の値全体を下げるので、元の閾値を超えていたペアと同じ割合が超える閾値を求めて保存する
+def test_whiten_calibrates_threshold():
+    vectors = biased_vectors()
+    projection = Projection.fit([vectors], 16, "whiten", threshold=0.7)
+    original = np.mean(pair_similarities(vectors) > 0.7)
+    projected = np.mean(pair_similarities(projection.transform(vectors)) > projection.answer_threshold(0.7))
+    assert projection.threshold < 0.7
+    assert abs(projected - original) < 0.01
+
+    buffer = io.BytesIO()
+    projection.save(buffer)
+    buffer.seek(0)
+    assert Projection.load(buffer).answer_threshold(0.7) == projection.threshold
+
+# pca は類似度の値が元とほぼ同じなので、元の閾値をそのまま使う
+def test_pca_keeps_threshold():
+    projection = Projection.fit([biased_vectors()], 16, "pca", threshold=0.7)
+    assert projection.threshold is None
+    buffer = io.BytesIO()
+    projection.save(buffer)
+    buffer.seek(0)
+    assert Projection.load(buffer).answer_threshold(0.7) == 0.7
+
+# 次元削減した索引は、変換と内側の索引（厳密検索・IVF）をまとめて保存し、読み込んでも同じ結果を返す
+def test_projected_index_round_trip():
+    vectors = biased_vectors()
+    queries = biased_vectors(count=10, seed=1)
+    projection = Projection.fit([vectors], 8, "whiten", threshold=0.7)
+    for kind, params in (("exact", {}), ("ivf", {"nlist": 4, "nprobe": 2})):
+        index = create_index(32, kind=kind, projection=projection, **params)
+        index.add(vectors)
+        if kind == "ivf":
+            index.index.train(index.projection.transform(vectors))
+        buffer = io.BytesIO()
+        index.save(buffer)
+        buffer.seek(0)
+        loaded = load_index(buffer)
+        assert loaded.kind == "projected" and loaded.index.kind == kind and len(loaded) == len(index)
+        assert loaded.projection.threshold == projection.threshold
+        expected, found = index.search_batch(queries, 5), loaded.search_batch(queries, 5)
+        assert np.allclose(expected[0], found[0]) and expected[1].tolist() == found[1].tolist()
@@ -0,0 +1,45 @@
+import gc
+import os
+import numpy as np
+import pytest
+from ann_index import create_index, load_index
+
+def random_vectors(count, dim, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+# 一時ファイルを使うインデックス（create_index の既定）を保存し、元のインデックスを捨ててから読み込んでも検索できる
+@pytest.mark.parametrize("kind, count, params", [("int8", 300, {}), ("pq", 1100, {"pq_subspaces": 4})])
+def test_save_gc_load_search(tmp_path, kind, count, params):
+    vectors = random_vectors(count, 16)
+    queries = random_vectors(5, 16, seed=1)
+    index = create_index(16, kind=kind, **params)
+    index.add(vectors)
+    expected = [index.search(query, 5) for query in queries]
+    temp_path = index.full.path
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    del index
+    gc.collect()
+    assert not os.path.exists(temp_path)
+
+    loaded = load_index(path)
+    assert len(loaded) == count
+    for query, (scores, ids) in zip(queries, expected):
+        loaded_scores, loaded_ids = loaded.search(query, 5)
+        np.testing.assert_array_equal(loaded_ids, ids)
+        np.testing.assert_allclose(loaded_scores, scores, rtol=1e-6)
+    loaded_path = loaded.full.path
+    loaded.close()
+    assert not os.path.exists(loaded_path)
+
+# 保存先のファイルを指定したインデックスは、そのファイルを参照したまま保存・読み込みし、close() でも消さない
+def test_named_vectors_file_is_kept(tmp_path):
+    vectors_path = str(tmp_path / "vectors.f32")
+    index = create_index(16, kind="int8", vectors_path=vectors_path)
+    index.add(random_vectors(50, 16))
+    index.save(str(tmp_path / "index.npz"))
+    index.close()
+    assert os.path.exists(vectors_path)
+    loaded = load_index(str(tmp_path / "index.npz"))
+    assert loaded.full.path == vectors_path
+    assert len(loaded) == 50
@@ -0,0 +1,42 @@
+import numpy as np
+from query_cache import QueryCache
+from retriever import Candidate
+
+def embedding(value):
+    return np.full(4, value, dtype=np.float32)
+
+def results(count):
+    return [Candidate(f"q{i}", "s", 1.0 - i / 10, "answer") for i in range(count)]
+
+# 件数の上限を超えたら、最も古く使われたものから追い出す
+def test_evicts_least_recently_used():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", embedding(1))
+    cache.put("b", embedding(2))
+    assert cache.get("a", 0, 1)[0] is not None
+    cache.put("c", embedding(3))
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b", 0, 1) == (None, None)
+    assert cache.stats.evictions == 1
+
+# バイト数の上限も守り、追い出したら使用量を減らす
+def test_evicts_by_bytes():
+    cache = QueryCache(max_bytes=3 * embedding(0).nbytes)
+    for i in range(5):
+        cache.put(str(i), embedding(i))
+    assert len(cache) == 3 and cache.bytes == 3 * embedding(0).nbytes
+
+# 版数が変わったら検索結果だけを捨て、質問ベクトルは使い回す
+def test_version_invalidates_results():
+    cache = QueryCache()
+    cache.put("a", embedding(1), results(5), version=1, k=5)
+    found, cached = cache.get("a", 1, 3)
+    assert [candidate.id for candidate in cached] == ["q0", "q1", "q2"]
+    # 保存した件数より多く求められたら検索し直す
+    assert cache.get("a", 1, 10)[1] is None
+
+    found, cached = cache.get("a", 2, 3)
+    assert np.array_equal(found, embedding(1)) and cached is None
+    assert cache.stats.invalidations == 1
+    assert cache.bytes == embedding(1).nbytes
+    assert cache.get("a", 1, 3)[1] is None
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+import numpy as np
+from corpus_index import CorpusIndex
+from learndata7 import search_match
+from lexical_index import LexicalIndex
+from retriever import FEEDBACK_SOURCE, Candidate, Retriever, combine_scores
+
+# 2次元の埋め込みを返すだけのモデルで、質問ごとのベクトルを決めておく
+def tiny_retriever(query_vectors, lexical_index, feedback_index=None):
+    sections = ["りんご", "みかん", "ぶどう"]
+    matrix = np.array([[1.0, 0.0], [0.8, 0.6], [0.0, 1.0]], dtype=np.float32)
+    corpus = CorpusIndex(sections, [f"{section}の説明" for section in sections], ["s"] * 3, matrix, matrix)
+    model = SimpleNamespace(config=SimpleNamespace(hidden_size=2))
+    return Retriever(None, model, corpus, feedback_index, lexical_index=lexical_index,
+                     encode_fn=lambda questions: np.stack([query_vectors[question] for question in questions]))
+
+# BM25 だけが見つけたセクションは、埋め込み側の最下位ではなく実際の類似度を score に持つ
+def test_lexical_only_section_gets_real_similarity():
+    lexical = LexicalIndex("bigram").add_many([("ぶどう", "s", "ぶどう", "ぶどうの説明")])
+    query = np.array([1.0, 0.1], dtype=np.float32)
+    retriever = tiny_retriever({"ぶどう": query}, lexical)
+    candidates = retriever.search("ぶどう", k=3)
+    grape = next(candidate for candidate in candidates if candidate.id == "ぶどう")
+    assert np.isclose(grape.score, query[1] / np.linalg.norm(query))
+    # 最下位の類似度（0.7 を超える）とみなすと、計算していない類似度で閾値を超えて最上位になってしまう
+    assert search_match("ぶどう", retriever, threshold=0.7, k=2).best.id == "りんご"
+
+# 類似度を計算できない候補は 0 とみなし、閾値を超えない
+def test_unscored_lexical_candidate_is_not_accepted():
+    dense = [Candidate("りんご", "s", 0.9, "a"), Candidate("みかん", "s", 0.8, "b")]
+    lexical = [Candidate("ぶどう", FEEDBACK_SOURCE, 1.0, "c")]
+    combined = combine_scores(dense, lexical, weight=0.3, k=3, dense_score_fn=lambda candidate: None)
+    assert [candidate.id for candidate in combined] == ["りんご", "みかん", "ぶどう"]
+    assert combined[-1].score == 0.0
+    assert combine_scores(dense, lexical, weight=0.3, k=3)[-1].score == 0.0
+
+# 両方に現れる候補は、埋め込みの類似度を残したまま混ぜたスコアで並べ替える
+def test_lexical_score_reorders_dense_candidates():
+    dense = [Candidate("りんご", "s", 0.9, "a"), Candidate("みかん", "s", 0.85, "b")]
+    lexical = [Candidate("みかん", "s", 1.0, "b")]
+    combined = combine_scores(dense, lexical, weight=0.3, k=2)
+    assert [(candidate.id, candidate.score) for candidate in combined] == [("みかん", 0.85), ("りんご", 0.9)]
+
+# 閾値を省くと、retriever の閾値（次元削減した空間に合わせた値）で判定する
+def test_search_match_uses_retriever_threshold():
+    lexical = LexicalIndex("bigram")
+    retriever = tiny_retriever({"りんご": np.array([1.0, 0.1], dtype=np.float32)}, lexical)
+    assert search_match("りんご", retriever).best.id == "りんご"
+    retriever.threshold = 0.999
+    result = search_match("りんご", retriever)
+    assert result.best is None and result.threshold == 0.999
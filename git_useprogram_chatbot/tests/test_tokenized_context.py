@@ -0,0 +1,61 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+sentencepiece = pytest.importorskip("sentencepiece")
+
+from tokenized_context import TokenizedReader
+
+CONTEXTS = [
+    "Numazu College is a national college of technology in Numazu, Shizuoka. It was founded in 1962.",
+    "The dormitory is open to first year students. Students who live far away may also apply.",
+    "沼津高専は 静岡県 沼津市 にある 高等専門学校 です。 1962年 に 設立 されました。",
+]
+QUESTIONS = ["When was Numazu College founded?", "Who can live in the dormitory?", "沼津高専 は どこ に ありますか"]
+
+# その場で学習した SentencePiece と乱数の重みの小さなモデル（ネットワークに接続せずに作る）
+@pytest.fixture(scope="module")
+def qa_model(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tiny_qa")
+    vocab_file = str(directory / "sentencepiece.bpe.model")
+    sentencepiece.SentencePieceTrainer.train(sentence_iterator=iter(CONTEXTS + QUESTIONS), model_prefix=vocab_file[:-6],
+                                             vocab_size=120, character_coverage=1.0, hard_vocab_limit=False)
+    tokenizer = transformers.XLMRobertaTokenizerFast(vocab_file=vocab_file)
+    config = transformers.XLMRobertaConfig(vocab_size=len(tokenizer), hidden_size=32, num_hidden_layers=2,
+                                           num_attention_heads=2, intermediate_size=64, max_position_embeddings=520)
+    torch.manual_seed(0)
+    model = transformers.XLMRobertaForQuestionAnswering(config).eval()
+    return model, tokenizer
+
+# パイプラインの答えの範囲から前後の空白を除く（高速トークナイザの "▁" の位置は直前の空白を含むが、
+# token_offsets は空白を含めない）
+def strip_span(context, start, end):
+    while start < end and context[start].isspace():
+        start += 1
+    while end > start and context[end - 1].isspace():
+        end -= 1
+    return start, end
+
+# 1つのウィンドウに収まるパッセージなら、答えの範囲（前後の空白を除く）もスコアも質問応答パイプラインと一致する
+@pytest.mark.parametrize("align_words", [True, False])
+def test_matches_pipeline(qa_model, align_words):
+    model, tokenizer = qa_model
+    qa = transformers.pipeline("question-answering", model=model, tokenizer=tokenizer, framework="pt")
+    reader = TokenizedReader(model, tokenizer, CONTEXTS, align_words=align_words)
+    for question in QUESTIONS:
+        for passage, context in enumerate(CONTEXTS):
+            expected = qa(question=question, context=context, align_to_words=align_words)
+            result = reader.read(question, [passage])
+            assert (result["start"], result["end"]) == strip_span(context, expected["start"], expected["end"])
+            assert result["answer"] == expected["answer"].strip()
+            assert result["score"] == pytest.approx(expected["score"], rel=1e-4)
+
+# まとめて読んでも1質問ずつ読んだ結果と変わらない
+def test_read_batch_matches_read(qa_model):
+    model, tokenizer = qa_model
+    reader = TokenizedReader(model, tokenizer, CONTEXTS, batch_size=4)
+    batch = reader.read_batch(QUESTIONS)
+    for question, result in zip(QUESTIONS, batch):
+        single = reader.read(question)
+        assert (result["passage"], result["start"], result["end"]) == (single["passage"], single["start"], single["end"])
+        assert result["score"] == pytest.approx(single["score"], rel=1e-4)
@@ -0,0 +1,254 @@
+import json
+import os
+import unicodedata
+import numpy as np
+import torch
+from embedding_cache import text_hash
+
+# 質問応答パイプラインの既定値に合わせた長さ
+MAX_SEQ_LEN = 384
+MAX_QUESTION_TOKENS = 64
+DOC_STRIDE = 128
+MAX_ANSWER_TOKENS = 15
+# 一度にモデルへ渡すウィンドウ数
+READ_BATCH_SIZE = 16
+# token_offsets の求め方を変えたら上げる（ディスクのキャッシュを作り直す）
+OFFSETS_VERSION = 2
+
+# サブワードの表層（SentencePiece の "▁" や WordPiece の "##" を除いたもの）
+def _piece_surface(piece):
+    return piece.replace("▁", "").removeprefix("##")
+
+# 各トークンが元の文章のどの文字範囲にあたるかを求める
+# トークナイザは NFKC・小文字化した文字列を分割するので、1文字ずつ正規化した文字列の上で照合して元の位置に戻す
+# 一致しないトークン（未知語など）は長さ 0 の範囲にする。単独の "▁" はパイプラインと同じく次の語の一部とみなし、
+# 次の語の先頭に長さ 0 で置く
+def token_offsets(text, pieces):
+    normalized, positions = [], []
+    for i, char in enumerate(text):
+        for normalized_char in unicodedata.normalize("NFKC", char).lower():
+            normalized.append(normalized_char)
+            positions.append(i)
+    normalized = "".join(normalized)
+    positions.append(len(text))
+
+    offsets = np.empty((len(pieces), 2), dtype=np.int32)
+    cursor = 0
+    for i, piece in enumerate(pieces):
+        surface = _piece_surface(piece).lower()
+        if not surface and piece.startswith("▁"):
+            while cursor < len(normalized) and normalized[cursor].isspace():
+                cursor += 1
+        found = normalized.find(surface, cursor, cursor + len(surface) + 16) if surface else -1
+        if found < 0:
+            offsets[i] = positions[cursor]
+            continue
+        offsets[i] = (positions[found], positions[found + len(surface)])
+        cursor = found + len(surface)
+    return offsets
+
+# パッセージを一度だけトークン化し、トークン id・文字位置・読み取りウィンドウを保持する
+# ウィンドウは (パッセージ番号, 開始トークン, 終了トークン) で、長いパッセージは stride ずつずらして重ねる
+class TokenizedPassages:
+    def __init__(self, texts, ids, offsets, starts, windows, key=""):
+        self.texts = texts
+        self.ids = ids
+        self.offsets = offsets
+        self.starts = starts
+        self.windows = windows
+        self.key = key
+
+    def __len__(self):
+        return len(self.texts)
+
+    def passage_ids(self, passage):
+        return self.ids[self.starts[passage]:self.starts[passage + 1]]
+
+    def passage_offsets(self, passage):
+        return self.offsets[self.starts[passage]:self.starts[passage + 1]]
+
+    # 指定したパッセージ（None なら全部）のウィンドウの番号
+    def window_indices(self, passages=None):
+        if passages is None:
+            return np.arange(len(self.windows))
+        return np.flatnonzero(np.isin(self.windows[:, 0], np.asarray(list(passages), dtype=np.int64)))
+
+    @classmethod
+    def build(cls, texts, tokenizer, max_context_tokens, stride=DOC_STRIDE, key=""):
+        ids, offsets, starts, windows = [], [], [0], []
+        for passage, text in enumerate(texts):
+            pieces = tokenizer.tokenize(text)
+            ids.append(np.asarray(tokenizer.convert_tokens_to_ids(pieces), dtype=np.int32))
+            offsets.append(token_offsets(text, pieces))
+            starts.append(starts[-1] + len(pieces))
+            begin = 0
+            while True:
+                end = min(begin + max_context_tokens, len(pieces))
+                windows.append((passage, begin, end))
+                if end >= len(pieces):
+                    break
+                begin += max(1, max_context_tokens - stride)
+        return cls(
+            list(texts),
+            np.concatenate(ids) if ids else np.empty(0, dtype=np.int32),
+            np.concatenate(offsets) if offsets else np.empty((0, 2), dtype=np.int32),
+            np.asarray(starts, dtype=np.int64),
+            np.asarray(windows, dtype=np.int64).reshape(-1, 3),
+            key,
+        )
+
+    def save(self, path):
+        np.savez(path, key=self.key, texts=json.dumps(self.texts, ensure_ascii=False), ids=self.ids,
+                 offsets=self.offsets, starts=self.starts, windows=self.windows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(json.loads(str(arrays["texts"])), arrays["ids"], arrays["offsets"], arrays["starts"],
+                       arrays["windows"], str(arrays["key"]))
+
+    # ディスクに同じ設定で作ったものがあれば読み込み、なければ作って保存する
+    # キーはトークナイザ・ウィンドウの設定とパッセージ本文のハッシュなので、どれかが変われば作り直す
+    @classmethod
+    def cached(cls, cache_dir, texts, tokenizer, max_context_tokens, stride=DOC_STRIDE):
+        settings = {"class": type(tokenizer).__name__, "name": getattr(tokenizer, "name_or_path", ""),
+                    "vocab_size": len(tokenizer), "max_context_tokens": max_context_tokens, "stride": stride,
+                    "offsets": OFFSETS_VERSION}
+        key = text_hash(json.dumps([settings, texts], ensure_ascii=False))
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, f"passages-{key[:16]}.npz")
+            if os.path.exists(path):
+                tokenized = cls.load(path)
+                if tokenized.key == key:
+                    return tokenized
+        tokenized = cls.build(texts, tokenizer, max_context_tokens, stride, key)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tokenized.save(path)
+        return tokenized
+
+# 答えの範囲をウィンドウ内 [lower, upper) で前後の空白まで広げる（パイプラインの align_to_words と同じ動作）
+def align_to_words(text, start, end, lower=0, upper=None):
+    upper = len(text) if upper is None else upper
+    while start > lower and not text[start - 1].isspace():
+        start -= 1
+    while end < upper and not text[end].isspace():
+        end += 1
+    return start, end
+
+# パッセージの位置の logits の softmax。extra（CLS のロジット）があれば分母にだけ加える
+def context_softmax(logits, extra=None):
+    shift = logits.max() if extra is None else max(logits.max(), extra)
+    weights = np.exp(logits - shift)
+    total = weights.sum() if extra is None else weights.sum() + np.exp(extra - shift)
+    return weights / total
+
+# トークン化済みのウィンドウに質問だけを付け足して質問応答モデルで読み取る
+# 1質問あたりのトークン化は質問文だけで、パッセージの SentencePiece 処理は繰り返さない
+class TokenizedReader:
+    def __init__(self, model, tokenizer, texts, cache_dir=None, max_seq_len=MAX_SEQ_LEN,
+                 max_question_tokens=MAX_QUESTION_TOKENS, stride=DOC_STRIDE, max_answer_tokens=MAX_ANSWER_TOKENS,
+                 batch_size=READ_BATCH_SIZE, align_words=True):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_question_tokens = max_question_tokens
+        self.max_answer_tokens = max_answer_tokens
+        self.batch_size = batch_size
+        self.align_words = align_words
+        max_context_tokens = max_seq_len - max_question_tokens - tokenizer.num_special_tokens_to_add(pair=True)
+        self.passages = TokenizedPassages.cached(cache_dir, texts, tokenizer, max_context_tokens, stride)
+        # 質問とパッセージの間に入る特殊トークンの数（パッセージの先頭位置を求めるのに使う）
+        probe = tokenizer.build_inputs_with_special_tokens([-1], [-2])
+        self.context_shift = probe.index(-2) - 1
+        # CLS トークンの位置（パイプラインは答えの確率の分母に CLS を含める。CLS のないモデルなら None）
+        cls_token_id = tokenizer.cls_token_id
+        self.cls_index = probe.index(cls_token_id) if cls_token_id is not None and cls_token_id in probe else None
+        self.use_token_type_ids = "token_type_ids" in tokenizer.model_input_names
+
+    # (質問のトークン id, ウィンドウ番号) の組を連結したモデル入力と、各ウィンドウのトークンが入力のどこから始まるか
+    def _inputs(self, pairs):
+        rows, context_starts = [], []
+        for question_ids, window in pairs:
+            passage, begin, end = self.passages.windows[window]
+            context_ids = self.passages.passage_ids(passage)[begin:end].tolist()
+            rows.append((self.tokenizer.build_inputs_with_special_tokens(question_ids, context_ids),
+                         self.tokenizer.create_token_type_ids_from_sequences(question_ids, context_ids)))
+            context_starts.append(len(question_ids) + self.context_shift)
+        length = max(len(ids) for ids, _ in rows)
+        input_ids = torch.full((len(rows), length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), length), dtype=torch.long)
+        token_type_ids = torch.zeros((len(rows), length), dtype=torch.long)
+        for i, (ids, type_ids) in enumerate(rows):
+            input_ids[i, :len(ids)] = torch.tensor(ids)
+            attention_mask[i, :len(ids)] = 1
+            token_type_ids[i, :len(type_ids)] = torch.tensor(type_ids)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if self.use_token_type_ids:
+            inputs["token_type_ids"] = token_type_ids
+        return inputs, context_starts
+
+    # 1つのウィンドウで最も確率の高い答えの範囲 (スコア, 開始トークン, 終了トークン)
+    # パイプラインと同じく、パッセージと CLS 以外の位置を除いて softmax を取り、開始×終了の確率が最大の範囲を選ぶ
+    # CLS（start_cls・end_cls はそのロジット）は分母にだけ含め、答えの範囲にはしない
+    def _best_span(self, start_logits, end_logits, start_cls=None, end_cls=None):
+        start = context_softmax(start_logits, start_cls)
+        end = context_softmax(end_logits, end_cls)
+        scores = np.triu(np.tril(np.outer(start, end), self.max_answer_tokens - 1))
+        best = int(scores.argmax())
+        start_token, end_token = divmod(best, scores.shape[1])
+        return float(scores[start_token, end_token]), start_token, end_token
+
+    # 見つかった範囲をパイプラインと同じ形の辞書にする
+    def _result(self, best):
+        if best is None:
+            return {"score": 0.0, "start": 0, "end": 0, "answer": "", "passage": None}
+        score, window, start_token, end_token = best
+        passage, token_begin, token_end = self.passages.windows[window]
+        offsets = self.passages.passage_offsets(passage)
+        text = self.passages.texts[passage]
+        start, end = int(offsets[start_token][0]), int(offsets[end_token][1])
+        if self.align_words:
+            start, end = align_to_words(text, start, end, int(offsets[token_begin][0]), int(offsets[token_end - 1][1]))
+        # 前後の空白は答えに含めない
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return {"score": score, "start": start, "end": end, "answer": text[start:end], "passage": int(passage)}
+
+    # 指定したパッセージ（None なら全部）を読み、パイプラインと同じ形の辞書
+    # {"score", "start", "end", "answer", "passage"} を返す（start・end はパッセージ内の文字位置）
+    def read(self, question, passages=None):
+        return self.read_batch([question], [passages])[0]
+
+    # 複数の質問をまとめて読む。全質問のウィンドウを並べて batch_size ずつモデルに通すので、
+    # 1質問ずつ読むよりもモデルの呼び出し回数が少ない。passages は質問ごとの読むパッセージ（None なら全部）
+    def read_batch(self, questions, passages=None):
+        passages = [None] * len(questions) if passages is None else passages
+        pairs, owners = [], []
+        for i, (question, question_passages) in enumerate(zip(questions, passages)):
+            question_ids = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(question))[:self.max_question_tokens]
+            for window in self.passages.window_indices(question_passages):
+                pairs.append((question_ids, window))
+                owners.append(i)
+
+        best = [None] * len(questions)
+        for begin in range(0, len(pairs), self.batch_size):
+            batch = pairs[begin:begin + self.batch_size]
+            inputs, context_starts = self._inputs(batch)
+            with torch.inference_mode():
+                outputs = self.model(**inputs)
+            start_logits = outputs.start_logits.float().numpy()
+            end_logits = outputs.end_logits.float().numpy()
+            for row, ((_, window), context_start) in enumerate(zip(batch, context_starts)):
+                owner = owners[begin + row]
+                passage, token_begin, token_end = self.passages.windows[window]
+                context = slice(context_start, context_start + token_end - token_begin)
+                cls = (None, None) if self.cls_index is None else (start_logits[row, self.cls_index],
+                                                                    end_logits[row, self.cls_index])
+                score, start_token, end_token = self._best_span(start_logits[row, context], end_logits[row, context],
+                                                                *cls)
+                if best[owner] is None or score > best[owner][0]:
+                    best[owner] = (score, window, token_begin + start_token, token_begin + end_token)
+        return [self._result(found) for found in best]
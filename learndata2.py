@@ -1,38 +1,63 @@
 import json
+import os
+import sys
 from transformers import pipeline
 
+# 共通モジュールは git_useprogram_chatbot にまとめてある
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "git_useprogram_chatbot"))
+from tokenized_context import TokenizedReader
+from background_loader import BackgroundLoader, StartupTimer
+
 # JSONファイルを読み込む
 def load_json_data(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         data = json.load(file)
     return data
 
-# 質問応答モデルを使って、最適な回答を選ぶ
-def find_answer(question, data, qa_model):
-    # データ全体を1つのコンテンツとして扱う
+# データ全体を1つのコンテンツとして扱う
+def build_context(data):
     context = ""
     for section, content in data.items():
         context += f"{section}: {content}\n"
+    return context
+
+# 質問応答モデルを使って、最適な回答を選ぶ
+# reader (TokenizedReader) があれば、トークン化済みのコンテキストに質問だけを付け足して読む
+def find_answer(question, data, qa_model, reader=None):
+    if reader is not None:
+        return reader.read(question)['answer']
+    context = build_context(data)
     
     # 質問とコンテキストをモデルに渡して回答を生成
     result = qa_model(question=question, context=context)
     return result['answer']
 
-# チャットボットの会話ループ
-def chatbot():
-    data = load_json_data('wikipedia_sections.json')
-    
+# 質問応答モデルを読み込み、コンテキストをトークン化しておく（バックグラウンドのスレッドで実行する）
+def load_models(data, log=print):
     # 日本語対応のRoBERTa質問応答モデルを使用
     qa_model = pipeline('question-answering', model='rinna/japanese-roberta-base')
+    # コンテキストは起動時に一度だけトークン化し、reader_cache に保存して次回も使い回す
+    reader = TokenizedReader(qa_model.model, qa_model.tokenizer, [build_context(data)], cache_dir="reader_cache")
+    return qa_model, reader
+
+# チャットボットの会話ループ（モデルはバックグラウンドで読み込み、入力はすぐに受け付ける）
+def chatbot():
+    timer = StartupTimer()
+    data = load_json_data('wikipedia_sections.json')
+    loader = BackgroundLoader(lambda log: load_models(data, log))
 
     print("沼津高専チャットボットへようこそ！'exit'と入力して終了できます。")
 
     while True:
+        loader.flush()
+        timer.prompt()
         user_input = input("あなた: ")
         if user_input.lower() == "exit":
             break
-        response = find_answer(user_input, data, qa_model)
+        (qa_model, reader), waited = loader.wait()
+        response = find_answer(user_input, data, qa_model, reader)
         print(f"チャットボット: {response}")
+        timer.answer(waited)
 
 # チャットボットを起動
 if __name__ == "__main__":
@@ -1,9 +1,19 @@
 import json
-import numpy as np
-from transformers import pipeline, AutoTokenizer, AutoModelForQuestionAnswering, AutoModel
-from sklearn.metrics.pairwise import cosine_similarity
-import torch
 import os
+import sys
+from types import SimpleNamespace
+
+# 共通モジュールは git_useprogram_chatbot にまとめてある
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "git_useprogram_chatbot"))
+from startup_profile import PROFILE, phase
+# torch・transformers（pipeline を含む）とそれを使うモジュール（encoder, passage_reader, shared_model, inference_backend）は
+# 使う関数の中で読み込み、完全一致で答えられる質問はモデルの読み込みを待たずに受け付ける
+from embedding_cache import EmbeddingCache
+from exact_match import ExactMatchIndex
+from feedback_index import FeedbackIndex
+from precision import DEFAULT_PRECISION
+from runtime_options import DEFAULT_BACKEND, runtime_args
+from background_loader import BackgroundLoader, StartupTimer
 
 # JSONファイルを読み込む
 def load_json_data(file_path):
@@ -20,33 +30,39 @@ def load_feedback_data(file_path="feedback.json"):
     except FileNotFoundError:
         return []
 
-# フィードバックデータを事前にベクトル化して保存
-def preprocess_feedback_embeddings(feedback_data, tokenizer, model):
-    embeddings = {}
-    for entry in feedback_data:
-        question = entry["question"]
-        inputs = tokenizer(question, return_tensors="pt")
-        embedding = model(**inputs).last_hidden_state.mean(dim=1).detach().numpy()
-        embeddings[question] = (embedding, entry["human_answer"] or entry["bot_answer"])
-    return embeddings
+# フィードバックデータを事前にベクトル化して保存（キャッシュ済みの質問は再計算しない）
+def preprocess_feedback_embeddings(feedback_data, tokenizer, model, cache=None, report=None):
+    from encoder import encode_texts
+    questions = [entry["question"] for entry in feedback_data]
+    encode = lambda texts: encode_texts(texts, tokenizer, model, report=report)
+    if cache is not None:
+        matrix = cache.get_or_encode(questions, encode)
+        cache.garbage_collect(questions)
+    else:
+        matrix = encode(questions)
+
+    answers = [entry["human_answer"] or entry["bot_answer"] for entry in feedback_data]
+    feedback_index = FeedbackIndex(model.config.hidden_size, expected_size=len(questions))
+    feedback_index.add_many(questions, matrix, answers)
+    return feedback_index
 
 # 類似質問を探す関数（事前計算済みの埋め込みを利用）
-def find_similar_question(question, feedback_embeddings, tokenizer, model, threshold=0.7):
+# question_embedding を渡せば、質問のベクトル化を省く
+def find_similar_question(question, feedback_index, tokenizer, model, threshold=0.7, question_embedding=None):
     # 入力された質問をベクトル化
-    inputs = tokenizer(question, return_tensors="pt")
-    question_embedding = model(**inputs).last_hidden_state.mean(dim=1).detach().numpy()
+    if question_embedding is None:
+        from encoder import encode_texts
+        question_embedding = encode_texts([question], tokenizer, model)
 
-    # フィードバック内のベクトルと類似度を比較
-    for feedback_question, (feedback_embedding, feedback_answer) in feedback_embeddings.items():
-        similarity = cosine_similarity(question_embedding, feedback_embedding)
-
-        # 類似度が閾値を超えた場合、その回答を返す
+    # インデックスから最も近いフィードバックを取り出し、類似度が閾値を超えた場合その回答を返す
+    for _, feedback_answer, similarity in feedback_index.search(question_embedding, k=1):
         if similarity >= threshold:
             return feedback_answer
     return None
 
 # フィードバックを保存し、埋め込みを更新する関数
-def save_and_update_feedback(question, bot_answer, rating, feedback_embeddings, tokenizer, model, human_answer=None):
+def save_and_update_feedback(question, bot_answer, rating, feedback_index, tokenizer, model, human_answer=None, cache=None,
+                             exact_index=None):
     feedback_data = {
         "question": question,
         "bot_answer": bot_answer,
@@ -59,49 +75,136 @@ def save_and_update_feedback(question, bot_answer, rating, feedback_embeddings,
         json.dump(feedback_data, file, ensure_ascii=False, indent=4)
         file.write("\n")
 
-    # 新しいフィードバックを埋め込みに追加
-    inputs = tokenizer(question, return_tensors="pt")
-    new_embedding = model(**inputs).last_hidden_state.mean(dim=1).detach().numpy()
-    feedback_embeddings[question] = (new_embedding, human_answer or bot_answer)
+    if exact_index is not None:
+        exact_index.add(feedback_data)
+    # モデルの読み込み前は完全一致の索引だけを更新する（埋め込みは読み込み後に update_feedback_embedding で追加する）
+    if feedback_index is not None:
+        update_feedback_embedding(question, human_answer or bot_answer, feedback_index, tokenizer, model, cache)
+
+# 新しいフィードバックを埋め込みに追加（同じ質問がすでにあれば回答だけを置き換える）
+def update_feedback_embedding(question, answer, feedback_index, tokenizer, model, cache=None):
+    if feedback_index.update_answer(question, answer):
+        return
+    # キャッシュにも書き込んで次回起動時に再利用する
+    from encoder import encode_texts
+    encode = lambda texts: encode_texts(texts, tokenizer, model)
+    if cache is not None:
+        new_embedding = cache.get_or_encode([question], encode)
+    else:
+        new_embedding = encode([question])
+    feedback_index.add(question, new_embedding[0], answer)
 
 # 質問応答モデルを使って、最適な回答を選ぶ
-def find_answer(question, data, feedback_embeddings, qa_model, tokenizer, embedding_model):
+# reader (PassageReader) があれば、全文ではなく質問に関係するパッセージだけを読ませる
+def find_answer(question, data, feedback_index, qa_model, tokenizer, embedding_model, exact_index=None, reader=None):
+    # 正規化した質問文がフィードバックと一致すれば、モデルを使わずにその回答を返す
+    if exact_index is not None:
+        exact_answer = exact_index.lookup(question)
+        if exact_answer is not None:
+            return exact_answer
+
     # まずフィードバックデータから類似質問を探す
-    similar_answer = find_similar_question(question, feedback_embeddings, tokenizer, embedding_model)
+    # 質問のベクトルは1回だけ計算し、見つからなかったときはパッセージの順位付けにも使う
+    from encoder import encode_texts
+    question_embedding = encode_texts([question], tokenizer, embedding_model)
+    similar_answer = find_similar_question(question, feedback_index, tokenizer, embedding_model,
+                                           question_embedding=question_embedding)
     if similar_answer:
         return similar_answer
 
     # 類似質問が見つからない場合は通常のデータで回答生成
+    if reader is not None:
+        return reader.answer(question, question_embedding=question_embedding)
     context = "".join([f"{section}: {content}\n" for section, content in data.items()])
     result = qa_model(question=question, context=context)
     return result['answer']
 
-# チャットボットの会話と評価ループ
-def chatbot():
-    data = load_json_data('wikipedia_sections.json')
-    feedback_data = load_feedback_data()
-
-    # トークナイザとモデルをxlm-roberta-baseで読み込み
-    tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base", use_fast=False)
-    qa_model = AutoModelForQuestionAnswering.from_pretrained("xlm-roberta-base")
-    embedding_model = AutoModel.from_pretrained("xlm-roberta-base")  # 同じモデルを埋め込み生成にも利用
+# トークナイザ・モデル・フィードバックの埋め込み・パッセージを読み込む（バックグラウンドのスレッドで実行する）
+def load_models(data, feedback_data, precision=DEFAULT_PRECISION, backend=DEFAULT_BACKEND, mmap_weights=False, log=print):
+    with phase("model", "xlm-roberta-base"):
+        from transformers import pipeline, AutoTokenizer
+        from shared_model import SharedEncoderModel
+        from inference_backend import create_backend, warm_up
+        # トークナイザとモデルをxlm-roberta-baseで読み込み
+        tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base", use_fast=False)
+        # エンコーダは1つだけ読み込み、質問応答ヘッドと埋め込み生成の両方で共有する
+        shared_model = SharedEncoderModel.from_pretrained("xlm-roberta-base", precision=precision, mmap=mmap_weights)
+        qa_model = shared_model.qa_model
+        log(f"モデルの重み: {shared_model.parameter_bytes / 1024 ** 2:.0f} MB ({precision})")
+        # 埋め込みと読み取りは選んだバックエンドで実行し、よく使う形で先に推論して準備を済ませておく
+        embedding_model = create_backend(shared_model.backbone, backend)
+        reader_model = create_backend(qa_model, backend)
+    with phase("warmup", f"推論の準備 ({backend})"):
+        warm_up_seconds = warm_up(embedding_model) + warm_up(reader_model, batch_sizes=(1, 2, 4), lengths=(128, 256, 384))
+    log(f"推論の準備 ({backend}): {warm_up_seconds:.2f} 秒")
 
     # 質問応答パイプラインを設定
-    qa_pipeline = pipeline("question-answering", model=qa_model, tokenizer=tokenizer, framework="pt")
+    with phase("model", "question-answering pipeline"):
+        qa_pipeline = pipeline("question-answering", model=qa_model, tokenizer=tokenizer, framework="pt")
 
     # フィードバックデータの事前ベクトル化
-    feedback_embeddings = preprocess_feedback_embeddings(feedback_data, tokenizer, embedding_model)
+    with phase("index", "フィードバックの埋め込み"):
+        from encoder import EncodeReport
+        feedback_cache = EmbeddingCache.for_model("embedding_cache", tokenizer, embedding_model, precision=precision)
+        encode_report = EncodeReport()
+        feedback_index = preprocess_feedback_embeddings(feedback_data, tokenizer, embedding_model, feedback_cache,
+                                                        encode_report)
+    log(f"フィードバックのベクトル化: {encode_report}")
+    # コーパスは起動時に一度だけパッセージに分けてトークン化しておき、質問ごとに上位のパッセージだけを読む
+    with phase("index", "パッセージ"):
+        from passage_reader import PassageReader
+        reader = PassageReader(data, qa_pipeline, tokenizer, cache_dir="reader_cache", embedding_model=embedding_model,
+                               qa_model=reader_model)
+    log(f"パッセージ数: {len(reader)}")
+    return SimpleNamespace(tokenizer=tokenizer, embedding_model=embedding_model, qa_pipeline=qa_pipeline,
+                           feedback_cache=feedback_cache, feedback_index=feedback_index, reader=reader)
+
+# チャットボットの会話と評価ループ（precision は推論の精度、backend は推論バックエンド、mmap_weights なら重みを mmap する）
+# モデルはバックグラウンドで読み込み、その間もフィードバックと完全一致する質問にはすぐに答える
+def chatbot(precision=DEFAULT_PRECISION, backend=DEFAULT_BACKEND, mmap_weights=False):
+    timer = StartupTimer()
+    with phase("data", "wikipedia_sections.json"):
+        data = load_json_data('wikipedia_sections.json')
+    with phase("data", "feedback.json"):
+        feedback_data = load_feedback_data()
+    with phase("index", "完全一致索引"):
+        exact_index = ExactMatchIndex(feedback_data)
+    loader = BackgroundLoader(lambda log: load_models(data, feedback_data, precision, backend, mmap_weights, log))
+    # 埋め込みにまだ反映していないフィードバックの (質問, 回答)
+    pending_feedback = []
 
     print("沼津高専チャットボットへようこそ！'exit'と入力して終了できます。")
 
     while True:
+        loader.flush()
+        models = loader.result_if_ready()
+        if models is not None and pending_feedback:
+            for question, answer in pending_feedback:
+                update_feedback_embedding(question, answer, models.feedback_index, models.tokenizer,
+                                          models.embedding_model, models.feedback_cache)
+            pending_feedback = []
+        # 起動時間の内訳は、読み込みが終わった時点（途中で終了したときはその時点）で1回だけ表示する
+        if PROFILE.enabled and not PROFILE.reported and models is not None:
+            PROFILE.report()
+
+        timer.prompt()
         user_input = input("あなた: ")
         if user_input.lower() == "exit":
+            print(f"完全一致による高速応答: {exact_index.stats.hits}/{exact_index.stats.lookups} 件")
+            if PROFILE.enabled and not PROFILE.reported:
+                PROFILE.report()
             break
 
-        # モデルで回答を生成
-        bot_answer = find_answer(user_input, data, feedback_embeddings, qa_pipeline, tokenizer, embedding_model)
+        # 正規化した質問文がフィードバックと一致すれば、モデルを待たずにその回答を返す
+        waited = 0.0
+        bot_answer = exact_index.lookup(user_input)
+        if bot_answer is None:
+            # モデルで回答を生成
+            models, waited = loader.wait()
+            bot_answer = find_answer(user_input, data, models.feedback_index, models.qa_pipeline, models.tokenizer,
+                                     models.embedding_model, reader=models.reader)
         print(f"チャットボット: {bot_answer}")
+        timer.answer(waited)
 
         # 回答に対する評価をユーザーに求める
         try:
@@ -115,9 +218,13 @@ def chatbot():
         if rating < 3:
             human_answer = input("改善された回答を入力してください: ")
         
-        # 評価とフィードバックを保存、埋め込み更新
-        save_and_update_feedback(user_input, bot_answer, rating, feedback_embeddings, tokenizer, embedding_model, human_answer)
+        # 評価とフィードバックを保存し、埋め込みは次の入力の前に（モデルの読み込みが終わっていれば）更新する
+        save_and_update_feedback(user_input, bot_answer, rating, None, None, None, human_answer, exact_index=exact_index)
+        pending_feedback.append((user_input, human_answer or bot_answer))
 
 # チャットボットを起動
 if __name__ == "__main__":
-    chatbot()
+    args = runtime_args()
+    if args.profile_startup:
+        PROFILE.enable()
+    chatbot(args.precision, args.backend, args.mmap_weights)